@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# Copyright (C) 2017 Jolla Ltd.
+#
+# All rights reserved.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to
+# the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+"""Lookup cost of the POST ip filter: linear netmask scan vs. IPTrie
+
+Uses the GitHub hook ranges (https://api.github.com/meta) plus --extra
+random IPv4 networks to mimic a long allow-list of several services. The
+linear scan only handles IPv4, as did the filter it replaced.
+"""
+
+import argparse
+import os
+import random
+import socket
+import struct
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from webhook_launcher.app.iptrie import IPTrie  # noqa
+
+GITHUB_HOOKS = [
+    "192.30.252.0/22",
+    "185.199.108.0/22",
+    "140.82.112.0/20",
+    "143.55.64.0/20",
+    "2a0a:a440::/29",
+    "2606:50c0::/32",
+]
+
+
+def netmasks(networks):
+    masks = []
+    for network in networks:
+        if ":" in network:
+            continue
+        address, bits = network.split("/")
+        mask = (0xffffffff << (32 - int(bits))) & 0xffffffff
+        value = struct.unpack("!L", socket.inet_aton(address))[0]
+        masks.append((value & mask, mask))
+    return masks
+
+
+def linear_contains(masks, address):
+    value = struct.unpack("!L", socket.inet_aton(address))[0]
+    for network, mask in masks:
+        if value & mask == network:
+            return True
+    return False
+
+
+def report(name, count, elapsed):
+    print "%-8s n=%d total=%.3fs per lookup=%.2fus" % (
+        name, count, elapsed, 1e6 * elapsed / count
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-n", "--count", type=int, default=100000)
+    parser.add_argument("--extra", type=int, default=500)
+    args = parser.parse_args()
+
+    rand = random.Random(0)
+    networks = list(GITHUB_HOOKS)
+    for _ in range(args.extra):
+        networks.append("%s/%d" % (
+            socket.inet_ntoa(struct.pack("!L", rand.getrandbits(32))),
+            rand.randint(16, 28),
+        ))
+    # Mostly misses, which is the worst case for the linear scan
+    addresses = [
+        socket.inet_ntoa(struct.pack("!L", rand.getrandbits(32)))
+        for _ in range(args.count)
+    ]
+    print "%d networks" % len(networks)
+
+    masks = netmasks(networks)
+    start = time.time()
+    for address in addresses:
+        linear_contains(masks, address)
+    report("linear", args.count, time.time() - start)
+
+    trie = IPTrie(networks)
+    start = time.time()
+    for address in addresses:
+        address in trie
+    report("trie", args.count, time.time() - start)
+
+    v6 = ["2606:50c0:%x::1" % rand.getrandbits(16) for _ in range(args.count)]
+    start = time.time()
+    for address in v6:
+        address in trie
+    report("trie v6", args.count, time.time() - start)
+
+
+if __name__ == "__main__":
+    main()
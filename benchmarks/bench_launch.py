@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# Copyright (C) 2017 Jolla Ltd.
+#
+# All rights reserved.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to
+# the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+"""Publish latency of a new Launcher per event vs. the LauncherPool
+
+Needs a reachable BOSS AMQP broker. The launched process definition is empty
+so the engine finishes it immediately.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from RuoteAMQP import Launcher  # noqa
+from webhook_launcher.app.boss import LauncherPool  # noqa
+
+PDEF = """Ruote.process_definition 'webhook_bench' do
+  sequence do
+  end
+end
+"""
+
+
+def report(name, timings):
+    timings = sorted(timings)
+    count = len(timings)
+    print "%-10s n=%d mean=%.2fms p50=%.2fms p99=%.2fms" % (
+        name, count,
+        1000 * sum(timings) / count,
+        1000 * timings[count // 2],
+        1000 * timings[min(count - 1, int(count * 0.99))],
+    )
+
+
+def bench(publish, count):
+    timings = []
+    for i in range(count):
+        start = time.time()
+        publish(PDEF, {"bench": i})
+        timings.append(time.time() - start)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--user", default="boss")
+    parser.add_argument("--password", default="boss")
+    parser.add_argument("--vhost", default="boss")
+    parser.add_argument("-n", "--count", type=int, default=200)
+    args = parser.parse_args()
+
+    amqp_args = dict(
+        amqp_host=args.host, amqp_user=args.user,
+        amqp_pass=args.password, amqp_vhost=args.vhost,
+    )
+
+    def per_event(pdef, fields):
+        Launcher(**amqp_args).launch(pdef, fields)
+
+    report("per-event", bench(per_event, args.count))
+    pool = LauncherPool(size=1, **amqp_args)
+    report("pooled", bench(pool.launch, args.count))
+    pool.close()
+
+
+if __name__ == "__main__":
+    main()
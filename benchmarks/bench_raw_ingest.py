@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# Copyright (C) 2017 Jolla Ltd.
+#
+# All rights reserved.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to
+# the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+"""CPU time and memory of parsed vs. raw ingest for large push payloads
+
+Runs the work done for one event between the request body arriving and
+the participant having the payload dict: the view side, serializing the
+launched workitem, and the participant side including the dedup hash. Each
+mode runs in a forked child so the growth of the peak RSS of the modes can
+be compared.
+"""
+
+import argparse
+import copy
+import hashlib
+import json
+import os
+import resource
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'webhook_launcher.settings')
+import django  # noqa
+django.setup()
+
+from webhook_launcher.app.payload import load_event  # noqa
+
+DATA_DIR = os.path.join(
+    os.path.dirname(__file__), '..', 'src', 'webhook_launcher', 'app', 'test'
+)
+
+
+def make_body(commits):
+    data = json.load(open(os.path.join(DATA_DIR, 'payload_gh_push.json')))
+    commit = data['commits'][0]
+    data['commits'] = []
+    for i in range(commits):
+        commit = dict(commit, id="%040x" % i, message="commit %d\n" % i * 20)
+        data['commits'].append(commit)
+    return json.dumps(data)
+
+
+def parsed(body):
+    # view
+    data = json.loads(body)
+    data['webhook_parameters'] = {}
+    message = json.dumps({"fields": {"payload": data}})
+    # participant, as_dict() and the dedup hash
+    fields = json.loads(message)["fields"]
+    payload = copy.deepcopy(fields["payload"])
+    hashlib.md5(json.dumps(payload, sort_keys=True)).hexdigest()
+    return payload
+
+
+def raw(body):
+    # view
+    fields = {
+        "raw": body.decode("utf-8"),
+        "envelope": {"webhook_parameters": {}, "received": time.time()},
+    }
+    message = json.dumps({"fields": fields})
+    # participant
+    fields = json.loads(message)["fields"]
+    hashlib.md5(fields["raw"].encode("utf-8")).hexdigest()
+    return load_event(fields)
+
+
+def run(name, func, body, count):
+    pid = os.fork()
+    if pid:
+        os.waitpid(pid, 0)
+        return
+    before = resource.getrusage(resource.RUSAGE_SELF)
+    for _ in range(count):
+        func(body)
+    after = resource.getrusage(resource.RUSAGE_SELF)
+    cpu = (
+        after.ru_utime - before.ru_utime + after.ru_stime - before.ru_stime
+    )
+    print "%-7s cpu per event=%.1fms peak rss growth=%.1fMB" % (
+        name, 1000 * cpu / count,
+        (after.ru_maxrss - before.ru_maxrss) / 1024.0
+    )
+    sys.stdout.flush()
+    os._exit(0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-n", "--count", type=int, default=20)
+    parser.add_argument("--commits", type=int, default=2000)
+    args = parser.parse_args()
+
+    body = make_body(args.commits)
+    print "payload of %d commits, %.1fMB" % (
+        args.commits, len(body) / 1024.0 / 1024
+    )
+    run("parsed", parsed, body, args.count)
+    run("raw", raw, body, args.count)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# Copyright (C) 2017 Jolla Ltd.
+#
+# All rights reserved.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to
+# the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+"""Cost of parsing repository urls: urlparse based giturlparse vs.
+parse_repourl
+
+giturlparse is the parser parse_repourl replaced, which called
+urlparse.urlparse() up to four times per url. parse_repourl is measured
+with a cold cache (every url new) and a warm one (--repos distinct urls
+seen over and over, as when handling events).
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+import urlparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from webhook_launcher.app.misc import (  # noqa
+    _parse_repourl, _repourls, parse_repourl
+)
+
+
+def giturlparse(repourl):
+    parsed = urlparse.urlparse(repourl)
+    if not parsed.scheme:
+        repourl = "git://%s" % repourl
+        parsed = urlparse.urlparse(repourl)
+    if parsed.netloc.count(":") > 0:
+        try:
+            port = parsed.port
+            repourl = repourl.replace(":%s" % port, "")
+            parsed = urlparse.urlparse(repourl)
+        except ValueError:
+            repourl = "/".join(repourl.rsplit(":", 1))
+            parsed = urlparse.urlparse(repourl)
+    if "@" in parsed.netloc:
+        repourl = "%s://%s" % (parsed.scheme, repourl.split("@", 1)[1])
+        parsed = urlparse.urlparse(repourl)
+    return parsed
+
+
+def make_url(rand, i):
+    host = rand.choice(["github.com", "gitlab.example.com", "bitbucket.org"])
+    path = "org%d/repo%d%s" % (i % 97, i, rand.choice(["", ".git"]))
+    return rand.choice([
+        "https://%s/%s" % (host, path),
+        "git@%s:%s" % (host, path),
+        "ssh://git@%s:22/%s" % (host, path),
+    ])
+
+
+def report(name, count, elapsed):
+    print "%-10s n=%d total=%.3fs per url=%.2fus" % (
+        name, count, elapsed, 1e6 * elapsed / count
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-n", "--count", type=int, default=100000)
+    parser.add_argument("--repos", type=int, default=500)
+    args = parser.parse_args()
+
+    rand = random.Random(0)
+    urls = [make_url(rand, i) for i in range(args.count)]
+    events = [rand.choice(urls[:args.repos]) for _ in range(args.count)]
+
+    for url in urls[:1000]:
+        old, new = giturlparse(url), _parse_repourl(url)
+        assert (old.netloc, old.path) == (new.netloc, new.path), url
+
+    start = time.time()
+    for url in urls:
+        giturlparse(url)
+    report("urlparse", args.count, time.time() - start)
+
+    start = time.time()
+    for url in urls:
+        _parse_repourl(url)
+    report("parse", args.count, time.time() - start)
+
+    _repourls.clear()
+    start = time.time()
+    for url in events:
+        parse_repourl(url)
+    report("cached", args.count, time.time() - start)
+    print _repourls.stats()
+
+
+if __name__ == "__main__":
+    main()
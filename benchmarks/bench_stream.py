@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# Copyright (C) 2017 Jolla Ltd.
+#
+# All rights reserved.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to
+# the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+"""Time to first byte and peak memory of listing all mappings in the API
+
+Compares a single page holding every mapping (?limit=N) with the
+streamed list (?stream=1) for each of --sizes mappings. The mappings are
+created in a temporary SQLite database and every request runs in a
+forked child so the peak RSS growth of the modes can be compared.
+"""
+
+import argparse
+import os
+import resource
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'webhook_launcher.settings')
+import django  # noqa
+django.setup()
+
+from django.conf import settings  # noqa
+from django.contrib.auth.models import User  # noqa
+from django.db import connection  # noqa
+from django.test import Client  # noqa
+from django.test.utils import setup_test_environment  # noqa
+
+from webhook_launcher.app.models import (  # noqa
+    BuildService, LastSeenRevision, WebHookMapping
+)
+
+
+def create_mappings(count):
+    WebHookMapping.objects.all().delete()
+    user = User.objects.get_or_create(username="bench")[0]
+    obs = BuildService.objects.get_or_create(
+        namespace="bench", apiurl="https://api.example.com",
+        weburl="https://build.example.com",
+    )[0]
+    # bulk_create skips save() and the signals, which is fine for listing
+    for start in range(0, count, 5000):
+        WebHookMapping.objects.bulk_create(
+            WebHookMapping(
+                repourl="https://github.com/org/repo%d" % i,
+                canonical_repo="github.com/org/repo%d" % i,
+                project="project:%d" % (i % 100), package="package%d" % i,
+                user=user, obs=obs,
+            ) for i in range(start, min(start + 5000, count))
+        )
+    LastSeenRevision.objects.bulk_create(
+        LastSeenRevision(mapping_id=pk, revision="%040x" % pk)
+        for pk in WebHookMapping.objects.values_list("pk", flat=True)
+    )
+
+
+def request(name, count, params):
+    connection.close()
+    pid = os.fork()
+    if pid:
+        os.waitpid(pid, 0)
+        return
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.time()
+    response = Client().get(
+        "/webhook/api/webhookmappings/", params,
+        HTTP_ACCEPT="application/json",
+    )
+    if response.streaming:
+        content = iter(response.streaming_content)
+        size = len(next(content))
+        ttfb = time.time() - start
+        size += sum(len(chunk) for chunk in content)
+    else:
+        ttfb = time.time() - start
+        size = len(response.content)
+    total = time.time() - start
+    after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print "%-7s n=%-6d ttfb=%.3fs total=%.3fs size=%.1fMB " \
+        "peak rss growth=%.1fMB" % (
+            name, count, ttfb, total, size / 1024.0 / 1024,
+            (after - before) / 1024.0
+        )
+    sys.stdout.flush()
+    os._exit(0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[10000, 100000]
+    )
+    args = parser.parse_args()
+
+    db = tempfile.NamedTemporaryFile(suffix=".db")
+    settings.DATABASES["default"]["ENGINE"] = "django.db.backends.sqlite3"
+    settings.DATABASES["default"]["TEST"] = {"NAME": db.name}
+    setup_test_environment()
+    connection.creation.create_test_db(verbosity=0, keepdb=True)
+
+    for count in args.sizes:
+        create_mappings(count)
+        request("page", count, {"limit": count})
+        request("stream", count, {"stream": 1})
+
+
+if __name__ == "__main__":
+    main()
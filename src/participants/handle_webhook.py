@@ -24,24 +24,55 @@
 :Parameters:
    :payload (dict):
       Payload of incoming event
+   :raw (string):
+      Request body of incoming event when raw ingest is enabled, used
+      instead of payload
+   :envelope (dict):
+      Request details of a raw event (headers, webhook_parameters,
+      received, delivery)
+   :payload_ref (string):
+      Key of the stored payload of incoming event when the payload store is
+      enabled, used instead of payload
+   :delivery (string):
+      Delivery id of incoming event from the request headers, used to
+      suppress redeliveries
+   :coalesced (dict):
+      Number of pushes to the branch this event replaced, the revision
+      before the first one and the emails of their authors
+   :handler (string):
+      Name of the handle_webhook participant (shard) handling events of the
+      repository
+   :payload_type (string):
+      Optional name of the payload class for the payload, detected from the
+      payload when not given
+   :events (list):
+      Batch of incoming events, each a dict with the fields of a single
+      event (eg. payload). Used instead of payload.
 
 :term:`Workitem` fields OUT:
 
 :Returns:
    :result (Boolean):
       True if the everything went OK, False otherwise
+   :events (list):
+      The events of a batch that were handled, which are relayed
+   :failed_events (list):
+      The events of a batch that failed, each a dict with the "event" fields
+      and the "error"
 
 """
 
 import os
-import hashlib
-import json
-import time
+import logging
 os.environ['DJANGO_SETTINGS_MODULE'] = 'webhook_launcher.settings'
 import django
 django.setup()
 
-from webhook_launcher.app.payload import get_payload
+from webhook_launcher.app.dedup import dedup_keys, get_dedup_store
+from webhook_launcher.app.log import event_summary
+from webhook_launcher.app.payload import get_payload, load_event
+
+logger = logging.getLogger(__name__)
 
 
 class ParticipantHandler(object):
@@ -53,35 +84,65 @@ class ParticipantHandler(object):
 
     def handle_lifecycle_control(self, ctrl):
         """ participant control thread """
-        if ctrl.message == "start":
-            self.seen = {}
+        if ctrl.message == "stop":
+            stats = get_dedup_store().stats()
+            logger.info(
+                "Duplicate webhooks: %(duplicates)s of %(checked)s "
+                "(%(hit_rate).3f)", stats, extra={"dedup": stats}
+            )
 
     def handle_wi(self, wid):
         """ Workitem handling function """
         wid.result = False
 
-        if wid.fields.payload is None:
-            raise RuntimeError("Missing mandatory field: payload")
-
-        md5 = hashlib.md5(json.dumps(wid.fields.payload.as_dict(),
-                                     sort_keys=True)).hexdigest()
-        now = time.time()
-        # purge seen hashes
-        for seen_md5, seen_time in self.seen.items():
-            if now - seen_time > 30:
-                del self.seen[seen_md5]
-
-        if md5 in self.seen:
-            print("Ignoring duplicate webhook (possible resend or "
-                  "github hook set at both repo and orginisation level)")
-            print("Last seen %ss ago" % (now - self.seen[md5]))
+        fields = wid.fields.as_dict()
+        if fields.get("events") is None:
+            self.handle_event(fields)
             wid.result = True
             return
-        self.seen[md5] = now
 
-        print("Handling a webhook payload")
-        payload = get_payload(wid.fields.payload.as_dict())
-        payload.handle()
-        print("Webhook handled")
+        # A failed event doesn't fail the batch, which would skip relaying
+        # the others and handle them again when the workitem is redelivered
+        handled = []
+        failed = []
+        for event in fields["events"]:
+            try:
+                self.handle_event(event)
+            except Exception as exc:
+                logger.exception("Handling webhook in batch failed: %s", exc)
+                failed.append({"event": event, "error": str(exc)})
+            else:
+                handled.append(event)
+        wid.fields.events = handled
+        if failed:
+            logger.error(
+                "%s of %s webhooks in batch failed",
+                len(failed), len(fields["events"])
+            )
+            wid.fields.failed_events = failed
+        wid.result = not failed
+
+    def handle_event(self, event):
+        """ Handle the fields of a single event """
+        store = get_dedup_store()
+        if store.seen(*dedup_keys(event)):
+            payload = event.get("payload")
+            summary = event.get("summary") or event_summary(
+                payload if isinstance(payload, dict) else {}
+            )
+            logger.info(
+                "Ignoring duplicate webhook for %(repo)s %(ref)s %(after)s "
+                "(possible resend or github hook set at both repo and "
+                "orginisation level)", summary,
+                extra=dict(summary, dedup=store.stats())
+            )
+            return
 
-        wid.result = True
+        data = load_event(event)
+        summary = event_summary(data)
+        logger.info("Handling webhook for %(repo)s %(ref)s %(after)s",
+                    summary, extra=summary)
+        payload = get_payload(data, event.get("payload_type"))
+        payload.payload_ref = event.get("payload_ref")
+        payload.handle()
+        logger.info("Webhook handled")
@@ -23,6 +23,21 @@
 :Parameters:
    :payload (dict):
       Payload of incoming event
+   :raw (string):
+      Request body of incoming event when raw ingest is enabled, used
+      instead of payload
+   :envelope (dict):
+      Request details of a raw event (headers, webhook_parameters,
+      received, delivery)
+   :payload_ref (string):
+      Key of the stored payload of incoming event when the payload store is
+      enabled, used instead of payload
+   :payload_type (string):
+      Optional name of the payload class for the payload, detected from the
+      payload when not given
+   :events (list):
+      Batch of incoming events, each a dict with the fields of a single
+      event (eg. payload). Used instead of payload.
 
 :term:`Workitem` fields OUT:
 
@@ -37,7 +52,7 @@ os.environ['DJANGO_SETTINGS_MODULE'] = 'webhook_launcher.settings'
 import django
 django.setup()
 
-from webhook_launcher.app.payload import get_payload
+from webhook_launcher.app.payload import get_payload, load_event
 
 class ParticipantHandler(object):
     """ Participant class as defined by the SkyNET API """
@@ -54,10 +69,17 @@ class ParticipantHandler(object):
         """ Workitem handling function """
         wid.result = False
 
-        if wid.fields.payload is None:
-           raise RuntimeError("Missing mandatory field: payload")
+        fields = wid.fields.as_dict()
+        # A batch may be left with no events when all of them failed
+        if fields.get("events") is not None:
+            events = fields["events"]
+        else:
+            events = [fields]
 
-        payload = get_payload(wid.fields.payload.as_dict())
-        payload.relay()
+        for event in events:
+            payload = get_payload(
+                load_event(event), event.get("payload_type")
+            )
+            payload.relay()
 
         wid.result = True
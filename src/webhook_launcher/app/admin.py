@@ -27,6 +27,7 @@ from django.forms import TextInput
 from django.http import HttpResponseRedirect
 from django.utils.encoding import force_text
 
+from webhook_launcher.app.misc import canonical_repourl
 from webhook_launcher.app.models import (
     BuildService, LastSeenRevision, Project, QueuePeriod, RelayTarget,
     VCSNameSpace, VCSService, WebHookMapping
@@ -118,24 +119,29 @@ class WebHookMappingAdmin(admin.ModelAdmin):
         obj.placeholder = False
         obj.save()
 
-    # HACK: When creating similar webhook inline model is not saved.
-    # this is probably not correct place to fix the issue but works
-    # non the less.
-    def save_related(self, request, form, formsets, change):
+    def save_formset(self, request, form, formset, change):
+        if formset.model is LastSeenRevision:
+            # A new mapping got its LastSeenRevision when it was saved, so
+            # the inline form of one updates it instead of adding another
+            lsr = form.instance.lsr
+            for inline_form in formset.forms:
+                if inline_form.instance.pk is None and \
+                        inline_form.has_changed():
+                    lsr.revision = inline_form.cleaned_data.get(
+                        "revision"
+                    ) or ""
+                    lsr.tag = inline_form.cleaned_data.get("tag")
+                    lsr.save()
+                    # For the admin log entry
+                    formset.new_objects = []
+                    formset.changed_objects = [
+                        (lsr, inline_form.changed_data)
+                    ]
+                    formset.deleted_objects = []
+                    return
         super(
             WebHookMappingAdmin, self
-        ).save_related(request, form, formsets, change)
-
-        instance = form.instance
-        if not instance.lastseenrevision_set.count():
-            rev = request.POST.get('lastseenrevision_set-0-revision', None)
-            tag = request.POST.get('lastseenrevision_set-0-tag', None)
-            if rev or tag:
-                LastSeenRevision.objects.create(
-                    mapping=instance,
-                    revision=rev,
-                    tag=tag,
-                )
+        ).save_formset(request, form, formset, change)
 
     def response_change(self, request, obj):
         if "_triggerbuild" in request.POST:
@@ -211,17 +217,23 @@ class RelayTargetAdmin(admin.ModelAdmin):
     def trigger_relay(self, request, relaytargets):
         payloads = []
         for rt in relaytargets:
-            urls = set([str(src) for src in rt.sources])
+            namespaces = set(
+                canonical_repourl(str(src)) for src in rt.sources.all()
+            )
+            if not namespaces:
+                continue
             mapobjs = WebHookMapping.objects.filter(
                 reduce(
                     operator.or_,
-                    (models.Q(repourl__contains=u) for u in urls)
+                    (models.Q(canonical_repo__startswith=ns + "/")
+                     for ns in namespaces)
                 )
-            )
+            ).select_related("lastseenrevision")
             for mapobj in mapobjs:
                 lsr = mapobj.lsr
-                if lsr and lsr.payload:
-                    payloads.append(get_payload(lsr.payload))
+                data = lsr.payload_data() if lsr else None
+                if data:
+                    payloads.append(get_payload(data))
 
         for pld in payloads:
             pld.relay(relays=relaytargets)
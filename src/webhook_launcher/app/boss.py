@@ -16,25 +16,187 @@
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 
+import logging
+import os
+import threading
+import time
+
 from django.conf import settings
 from RuoteAMQP import Launcher
 
+logger = logging.getLogger(__name__)
+
+
+class LauncherPool(object):
+    """ Bounded pool of persistent BOSS launchers
+
+    Every Launcher owns one AMQP connection and channel, so the pool size is
+    also the maximum number of channels this process keeps open. Launchers
+    idle for longer than max_idle are reconnected before use, and a launcher
+    that fails to publish is dropped and the launch retried once on a fresh
+    connection.
+
+    :param size: maximum number of launchers (connections)
+    :param max_idle: seconds after which an idle launcher is reconnected
+    :param timeout: seconds to wait for a free launcher
+    :param amqp_args: keyword arguments passed to Launcher
+    """
+
+    def __init__(self, size=4, max_idle=300, timeout=30, **amqp_args):
+        self.size = size
+        self.max_idle = max_idle
+        self.timeout = timeout
+        self.amqp_args = amqp_args
+        self._cond = threading.Condition()
+        self._reset()
+
+    def _reset(self):
+        # Connections must not be shared with a forked child
+        self._pid = os.getpid()
+        self._idle = []
+        self._count = 0
+
+    def _connect(self):
+        return Launcher(**self.amqp_args)
+
+    def _close(self, launcher):
+        try:
+            launcher.conn.close()
+        except Exception as exc:
+            logger.debug("Ignoring error while closing launcher: %s", exc)
+
+    def _get(self):
+        deadline = time.time() + self.timeout
+        with self._cond:
+            if self._pid != os.getpid():
+                self._reset()
+            while True:
+                if self._idle:
+                    return self._idle.pop()
+                if self._count < self.size:
+                    self._count += 1
+                    return None, None
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise RuntimeError(
+                        "No free BOSS launcher after %ss" % self.timeout
+                    )
+                self._cond.wait(remaining)
+
+    def _put(self, launcher):
+        with self._cond:
+            if launcher is None:
+                self._count -= 1
+            else:
+                self._idle.append((launcher, time.time()))
+            self._cond.notify()
+
+    def launch(self, pdef, fields):
+        launcher, last_used = self._get()
+        try:
+            if launcher is not None and \
+                    time.time() - last_used > self.max_idle:
+                self._close(launcher)
+                launcher = None
+            if launcher is None:
+                launcher = self._connect()
+            try:
+                launcher.launch(pdef, fields)
+            except Exception as exc:
+                logger.warning("Launch failed (%s), reconnecting", exc)
+                self._close(launcher)
+                launcher = None
+                launcher = self._connect()
+                launcher.launch(pdef, fields)
+        except Exception:
+            if launcher is not None:
+                self._close(launcher)
+                launcher = None
+            raise
+        finally:
+            self._put(launcher)
+
+    def close(self):
+        """ Close all idle launchers """
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._count -= len(idle)
+        for launcher, _ in idle:
+            self._close(launcher)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """ Returns the process wide LauncherPool """
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = LauncherPool(
+                    size=settings.BOSS_POOL_SIZE,
+                    max_idle=settings.BOSS_POOL_MAX_IDLE,
+                    amqp_host=settings.BOSS_HOST,
+                    amqp_user=settings.BOSS_USER,
+                    amqp_pass=settings.BOSS_PASS,
+                    amqp_vhost=settings.BOSS_VHOST,
+                )
+    return _pool
+
+
+# process definition path -> ((mtime, inode, size), checked, pdef)
+_pdefs = {}
+
+
+def read_pdef(process):
+    """ Returns the contents of a process definition file
+
+    The contents are cached per path and the file is re-read when its mtime,
+    inode or size changes. The file is stat()ed at most once every
+    PDEF_CHECK_INTERVAL seconds.
+
+    :param process: process definition file
+    """
+    now = time.time()
+    cached = _pdefs.get(process)
+    if cached is not None and \
+            now - cached[1] < settings.PDEF_CHECK_INTERVAL:
+        return cached[2]
+
+    stat = os.stat(process)
+    key = (stat.st_mtime, stat.st_ino, stat.st_size)
+    if cached is not None and cached[0] == key:
+        pdef = cached[2]
+    else:
+        with open(process, mode='r') as process_file:
+            pdef = process_file.read()
+    _pdefs[process] = (key, now, pdef)
+    return pdef
+
+
+def clear_pdef_cache(*args):
+    """ Forget all cached process definitions
+
+    Takes and ignores any arguments so that it can be used as a signal
+    handler, eg. signal.signal(signal.SIGHUP, clear_pdef_cache)
+    """
+    _pdefs.clear()
+
+
 def launch(process, fields):
     """ BOSS process launcher
 
     :param process: process definition file
     :param fields: dict of workitem fields
     """
-    with open(process, mode='r') as process_file:
-        pdef = process_file.read()
+    pdef = read_pdef(process)
 
-    launcher = Launcher(amqp_host = settings.BOSS_HOST,
-                        amqp_user = settings.BOSS_USER,
-                        amqp_pass = settings.BOSS_PASS,
-                        amqp_vhost = settings.BOSS_VHOST)
-
-    print "launching to (%s,%s)" %(settings.BOSS_HOST, settings.BOSS_VHOST)
-    launcher.launch(pdef, fields)
+    logger.debug(
+        "launching to (%s,%s)", settings.BOSS_HOST, settings.BOSS_VHOST
+    )
+    get_pool().launch(pdef, fields)
 
 def launch_queue(fields):
     launch(settings.VCSCOMMIT_QUEUE, fields)
@@ -44,4 +206,3 @@ def launch_notify(fields):
 
 def launch_build(fields):
     launch(settings.VCSCOMMIT_BUILD, fields)
-
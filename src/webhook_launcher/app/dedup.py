@@ -0,0 +1,287 @@
+# Copyright (C) 2017 Jolla Ltd.
+#
+# All rights reserved.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to
+# the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+""" Suppression of duplicate webhook deliveries """
+
+import collections
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+from webhook_launcher.app.log import event_summary
+
+CACHE_PREFIX = "webhook-dedup:"
+
+ZEROSHA = "0" * 40
+
+
+def dedup_keys(event):
+    """ Returns the keys identifying a webhook event
+
+    The keys are computed from fields the event carries as is, so that
+    duplicates are dropped before their payload is loaded and parsed.
+    Redeliveries carry the delivery id of the original request, and the
+    same push delivered by hooks set at both repository and organisation
+    level has the same (repo, ref, before, after) fingerprint. Refs created
+    or deleted get no fingerprint, as a tag deleted and created again at
+    the same revision would look like the first creation. Raw and
+    stored payloads are identified by a hash of their body instead, and
+    events with neither by a hash of their payload.
+
+    :param event: dict with the workitem fields of a single event
+    """
+    keys = []
+    envelope = event.get("envelope") or {}
+    delivery = event.get("delivery") or envelope.get("delivery")
+    if delivery:
+        keys.append("delivery:%s" % delivery)
+    data = event.get("payload")
+    if event.get("payload_ref") is not None or event.get("raw") is not None:
+        # The payload reference is the hash of the body already
+        body = event.get("payload_ref") or event["raw"].encode("utf-8")
+        keys.append("payload:%s" % hashlib.sha1(body + json.dumps(
+            envelope.get("webhook_parameters"), sort_keys=True
+        )).hexdigest())
+    elif isinstance(data, dict):
+        summary = event_summary(data)
+        if summary["after"] and ZEROSHA not in (
+            data.get("before"), summary["after"]
+        ):
+            fingerprint = json.dumps([
+                summary["repo"], summary["ref"], data.get("before"),
+                summary["after"], data.get("webhook_parameters"),
+            ], sort_keys=True)
+            keys.append("push:%s" % hashlib.sha1(fingerprint).hexdigest())
+        elif not keys:
+            keys.append("payload:%s" % hashlib.sha1(
+                json.dumps(data, sort_keys=True)
+            ).hexdigest())
+    return keys
+
+
+class DedupStore(object):
+    """ Keys of events seen within the last ttl seconds
+
+    Subclasses implement _add() to record keys in a backend.
+
+    :param ttl: seconds a key is remembered for
+    """
+
+    backend = None
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._stats = {
+            "checked": 0,
+            "duplicates": 0,
+        }
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def _add(self, keys, now):
+        """ Record keys, returns True if any of them was seen already """
+        raise NotImplementedError
+
+    def seen(self, *keys):
+        """ Returns True if an event with any of the keys was seen within ttl
+
+        The keys are recorded either way.
+        """
+        keys = [key for key in keys if key]
+        if not keys:
+            return False
+        duplicate = self._add(keys, time.time())
+        self._count("checked")
+        if duplicate:
+            self._count("duplicates")
+        return duplicate
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats["backend"] = self.backend
+        stats["ttl"] = self.ttl
+        stats["hit_rate"] = (
+            float(stats["duplicates"]) / stats["checked"]
+            if stats["checked"] else 0.0
+        )
+        return stats
+
+
+class MemoryDedupStore(DedupStore):
+    """ DedupStore in process memory
+
+    Keys are kept in time ordered buckets of ttl / 10 seconds and expire a
+    bucket at a time, so expiry doesn't scan the keys still remembered.
+    """
+
+    backend = "memory"
+
+    def __init__(self, ttl):
+        super(MemoryDedupStore, self).__init__(ttl)
+        self.bucket_size = max(ttl / 10.0, 1)
+        self._expires = {}
+        self._buckets = collections.deque()
+
+    def _expire(self, now):
+        while self._buckets and self._buckets[0][0] <= now:
+            _, keys = self._buckets.popleft()
+            for key in keys:
+                # Unless it was recorded again meanwhile
+                if key in self._expires and self._expires[key] <= now:
+                    del self._expires[key]
+
+    def _add(self, keys, now):
+        expires = now + self.ttl
+        bucket_end = (int(expires / self.bucket_size) + 1) * self.bucket_size
+        with self._lock:
+            self._expire(now)
+            duplicate = False
+            if not self._buckets or self._buckets[-1][0] != bucket_end:
+                self._buckets.append((bucket_end, []))
+            for key in keys:
+                if self._expires.get(key, now) > now:
+                    duplicate = True
+                    continue
+                self._expires[key] = expires
+                self._buckets[-1][1].append(key)
+            return duplicate
+
+    def stats(self):
+        stats = super(MemoryDedupStore, self).stats()
+        stats["keys"] = len(self._expires)
+        return stats
+
+
+class SQLiteDedupStore(DedupStore):
+    """ DedupStore in an SQLite database file
+
+    All processes using the same file share the keys. The database is in
+    WAL mode so that readers don't block the writer, and expired keys are
+    deleted every ttl seconds through the index on their expiry time.
+
+    :param path: database file
+    """
+
+    backend = "sqlite"
+
+    def __init__(self, path, ttl):
+        super(SQLiteDedupStore, self).__init__(ttl)
+        self.path = path
+        self._db = None
+        self._pid = None
+        self._purged_at = 0
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS seen "
+            "(key TEXT PRIMARY KEY, expires REAL NOT NULL)"
+        )
+        db.execute(
+            "CREATE INDEX IF NOT EXISTS seen_expires ON seen (expires)"
+        )
+        return db
+
+    def _add(self, keys, now):
+        with self._lock:
+            if self._pid != os.getpid():
+                # Don't share the connection of a parent process
+                self._db = self._connect()
+                self._pid = os.getpid()
+            db = self._db
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                if now - self._purged_at >= self.ttl:
+                    db.execute("DELETE FROM seen WHERE expires <= ?", (now,))
+                    self._purged_at = now
+                live = set(row[0] for row in db.execute(
+                    "SELECT key FROM seen WHERE expires > ? AND key IN (%s)" %
+                    ",".join("?" * len(keys)), [now] + keys
+                ))
+                db.executemany(
+                    "INSERT OR REPLACE INTO seen VALUES (?, ?)",
+                    [(key, now + self.ttl) for key in keys if key not in live]
+                )
+            except Exception:
+                db.execute("ROLLBACK")
+                raise
+            db.execute("COMMIT")
+            return bool(live)
+
+
+class CacheDedupStore(DedupStore):
+    """ DedupStore in a Django cache, eg. memcached shared between nodes
+
+    Keys are added with the atomic cache.add() and expire with the cache
+    timeout.
+
+    :param cache: Django cache alias
+    """
+
+    backend = "cache"
+
+    def __init__(self, cache, ttl):
+        super(CacheDedupStore, self).__init__(ttl)
+        self.cache = caches[cache]
+
+    def _add(self, keys, now):
+        duplicate = False
+        for key in keys:
+            # memcached keys are limited in length and characters
+            cache_key = CACHE_PREFIX + hashlib.sha1(
+                key.encode("utf-8")
+            ).hexdigest()
+            if not self.cache.add(cache_key, now, self.ttl):
+                duplicate = True
+        return duplicate
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_dedup_store():
+    """ Returns the process wide DedupStore """
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                if settings.DEDUP_CACHE:
+                    _store = CacheDedupStore(
+                        settings.DEDUP_CACHE, settings.DEDUP_TTL
+                    )
+                elif settings.DEDUP_DB:
+                    _store = SQLiteDedupStore(
+                        settings.DEDUP_DB, settings.DEDUP_TTL
+                    )
+                else:
+                    _store = MemoryDedupStore(settings.DEDUP_TTL)
+    return _store
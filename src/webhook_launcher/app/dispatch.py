@@ -0,0 +1,100 @@
+# Copyright (C) 2017 Jolla Ltd.
+#
+# All rights reserved.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to
+# the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+""" Event type dispatch based on the webhook request headers """
+
+import threading
+from collections import defaultdict
+
+PING = "ping"
+IGNORE = "ignore"
+
+# Request header carrying the event type -> {event type: route}
+# where route is a payload class name, PING or IGNORE. Event types not listed
+# for a header are ignored.
+EVENT_HEADERS = (
+    # Github
+    ("HTTP_X_GITHUB_EVENT", {
+        "push": "GhPush",
+        "ping": PING,
+    }),
+    # Gitlab
+    ("HTTP_X_GITLAB_EVENT", {
+        "Push Hook": "GhPush",
+        "Tag Push Hook": "GhPush",
+        # Instance wide hooks, which also send other system events; those
+        # don't parse as pushes and are detected from the payload
+        "System Hook": "GhPush",
+    }),
+    # Bitbucket
+    ("HTTP_X_EVENT_KEY", {
+        "repo:push": "BbPushV2",
+        "diagnostics:ping": PING,
+    }),
+)
+
+# Request headers carrying the unique id of a delivery
+DELIVERY_HEADERS = (
+    "HTTP_X_GITHUB_DELIVERY",
+    "HTTP_X_GITLAB_EVENT_UUID",
+    "HTTP_X_REQUEST_UUID",
+)
+
+_lock = threading.Lock()
+_stats = defaultdict(lambda: defaultdict(int))
+
+
+def _count(route, event):
+    with _lock:
+        _stats[route][event] += 1
+
+
+def dispatch(meta):
+    """ Find out what to do with a webhook request from its headers
+
+    :param meta: request.META
+    :returns: (event type, route) where route is the name of the payload
+        class handling the event, PING or IGNORE. Both are None when the
+        request has no known event header and the payload type needs to be
+        detected from the content.
+    """
+    for header, routes in EVENT_HEADERS:
+        event = meta.get(header)
+        if event is not None:
+            route = routes.get(event, IGNORE)
+            _count(route, event)
+            return event, route
+    _count("detect", "")
+    return None, None
+
+
+def delivery_id(meta):
+    """ Returns the delivery id of a webhook request or None """
+    for header in DELIVERY_HEADERS:
+        delivery = meta.get(header)
+        if delivery:
+            return delivery
+    return None
+
+
+def stats():
+    with _lock:
+        return dict(
+            (route, dict(events)) for route, events in _stats.items()
+        )
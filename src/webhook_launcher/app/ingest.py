@@ -0,0 +1,489 @@
+# Copyright (C) 2017 Jolla Ltd.
+#
+# All rights reserved.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to
+# the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+""" Asynchronous publishing of incoming webhook events to BOSS """
+
+import atexit
+import json
+import logging
+import os
+import Queue
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+from django.conf import settings
+
+from webhook_launcher.app.boss import launch_queue
+from webhook_launcher.app.misc import canonical_repourl
+from webhook_launcher.app.models import EventPayload
+from webhook_launcher.app.spool import get_spool
+
+logger = logging.getLogger(__name__)
+
+LAUNCHED = "launched"
+QUEUED = "queued"
+SPOOLED = "spooled"
+
+ZEROSHA = "0" * 40
+
+
+class EventQueue(object):
+    """ Bounded in-process queue of events waiting to be launched
+
+    Events are launched with launch_queue() by background worker threads,
+    which are started on first use (and again in a forked child). Each
+    worker has a queue of its own and the events for a handle_webhook
+    participant are always queued to the same worker, so that the events
+    of a repository are launched in the order they arrived.
+
+    With batch_size > 1 a worker collects up to batch_size events arriving
+    within batch_window seconds of the first one and launches them as a
+    single workitem with the fields of each event in the "events" list.
+
+    :param size: maximum number of events queued for each worker
+    :param workers: number of publisher threads
+    :param batch_size: maximum number of events launched in one workitem
+    :param batch_window: seconds to wait for more events to batch
+    """
+
+    def __init__(self, size=1000, workers=2, batch_size=1, batch_window=0.5):
+        self.size = size
+        self.workers = workers
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self._queues = [Queue.Queue(size) for _ in range(workers)]
+        self._lock = threading.Lock()
+        self._pid = None
+        self._stats = {
+            "queued": 0,
+            "published": 0,
+            "batches": 0,
+            "spooled": 0,
+            "failed": 0,
+            "dropped": 0,
+        }
+
+    def _count(self, name, value=1):
+        with self._lock:
+            self._stats[name] += value
+
+    def _start(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            for i, queue in enumerate(self._queues):
+                thread = threading.Thread(
+                    target=self._run, args=(queue,),
+                    name="webhook-publisher-%s" % i,
+                )
+                thread.daemon = True
+                thread.start()
+
+    def _collect(self, queue):
+        batch = [queue.get()]
+        deadline = time.time() + self.batch_window
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(queue.get(timeout=remaining))
+            except Queue.Empty:
+                break
+        return batch
+
+    def _run(self, queue):
+        while True:
+            batch = self._collect(queue)
+            try:
+                self._publish(batch)
+            finally:
+                for _ in batch:
+                    queue.task_done()
+
+    def _publish(self, batch):
+        # Events handled by different handle_webhook shards are launched
+        # separately, keeping the order of the events of each shard
+        shards = OrderedDict()
+        for fields in batch:
+            shards.setdefault(fields.get("handler"), []).append(fields)
+        for handler, events in shards.items():
+            if len(events) == 1:
+                fields = events[0]
+            else:
+                fields = {"events": events}
+                if handler is not None:
+                    fields["handler"] = handler
+                self._count("batches")
+            try:
+                result = publish(fields)
+            except Exception as exc:
+                logger.error("Publishing queued events failed: %s", exc)
+                self._count("failed", len(events))
+            else:
+                self._count(
+                    "published" if result == LAUNCHED else "spooled",
+                    len(events)
+                )
+
+    def submit(self, fields):
+        """ Queue workitem fields for launching
+
+        When the queue is full the event is spooled if a spool is configured
+        and dropped otherwise.
+
+        :returns: QUEUED, SPOOLED or None if the event was dropped
+        """
+        if self._pid != os.getpid():
+            self._start()
+        handler = fields.get("handler") or ""
+        queue = self._queues[
+            (zlib.crc32(handler) & 0xffffffff) % len(self._queues)
+        ]
+        try:
+            queue.put_nowait(fields)
+        except Queue.Full:
+            spool = _get_spool()
+            if spool is None:
+                self._count("dropped")
+                return None
+            spool.append(fields)
+            self._count("spooled")
+            return SPOOLED
+        self._count("queued")
+        return QUEUED
+
+    def join(self):
+        """ Block until all queued events have been handled """
+        for queue in self._queues:
+            queue.join()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats["depth"] = sum(queue.qsize() for queue in self._queues)
+        stats["size"] = self.size
+        stats["workers"] = self.workers
+        return stats
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_queue():
+    """ Returns the process wide EventQueue """
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                _queue = EventQueue(
+                    size=settings.INGEST_QUEUE_SIZE,
+                    workers=settings.INGEST_WORKERS,
+                    batch_size=settings.INGEST_BATCH_SIZE,
+                    batch_window=settings.INGEST_BATCH_WINDOW,
+                )
+    return _queue
+
+
+def _get_spool():
+    spool = get_spool()
+    if spool is not None:
+        spool.start_drainer(
+            launch_queue, interval=settings.SPOOL_DRAIN_INTERVAL
+        )
+    return spool
+
+
+def publish(fields):
+    """ Launch an event, spooling it if the broker is not available
+
+    While earlier events are waiting in the spool new ones are spooled
+    behind them so that they are launched in order.
+
+    :returns: LAUNCHED or SPOOLED
+    """
+    spool = _get_spool()
+    if spool is not None and spool.backlog:
+        spool.append(fields)
+        return SPOOLED
+    try:
+        launch_queue(fields)
+    except Exception as exc:
+        if spool is None:
+            raise
+        logger.warning("Launch failed, spooling event: %s", exc)
+        spool.append(fields)
+        return SPOOLED
+    return LAUNCHED
+
+
+def claim_check(fields, summary):
+    """ Replace the payload in event fields with a reference to it
+
+    The payload (or raw body) is stored as an EventPayload and the fields
+    carry its key in "payload_ref" and a short "summary" of the event.
+    """
+    if fields.get("raw") is not None:
+        body = fields.pop("raw")
+    else:
+        body = json.dumps(fields.pop("payload"))
+    fields["payload_ref"] = EventPayload.store(body)
+    fields["summary"] = dict(
+        (key, summary[key]) for key in ("event", "repo", "ref", "after")
+    )
+    return fields
+
+
+def ingest(fields):
+    """ Hand over an incoming event for launching
+
+    Depending on settings the event is launched right away or queued for the
+    background publishers. Events that can't be launched or queued are
+    spooled when a spool is configured.
+
+    :returns: LAUNCHED, QUEUED, SPOOLED or None if the event was rejected
+    """
+    if settings.ASYNC_INGEST:
+        return get_queue().submit(fields)
+
+    try:
+        return publish(fields)
+    except Exception as exc:
+        logger.error("Launch failed: %s", exc)
+        return None
+
+
+class Coalescer(object):
+    """ Holds pushes to a branch for a quiet window and ingests the latest
+
+    A held push is ingested once no newer push with the same key arrived
+    for window seconds, or max_delay seconds after the first one. A newer
+    push replaces the fields of the held one, and the "coalesced" field of
+    the push finally ingested carries the number of pushes, the "before"
+    revision of the first one and the emails of all of them.
+
+    Held pushes are ingested by a background thread, which is started on
+    first use (and again in a forked child). They are kept in the memory of
+    the process, so pushes are only coalesced with others received by the
+    same process. Pushes still held when the process exits are launched
+    by close(). Held pushes that can't be ingested are spooled when a
+    spool is configured.
+
+    :param window: quiet window in seconds
+    :param max_delay: maximum seconds a push is held, 10 windows by default
+    """
+
+    def __init__(self, window, max_delay=None):
+        self.window = window
+        self.max_delay = max_delay or window * 10
+        self._cond = threading.Condition()
+        # Keeps a flush() from overtaking pushes the thread is ingesting
+        self._ingest_lock = threading.Lock()
+        self._held = OrderedDict()
+        self._pid = None
+        self._atexit = False
+        self._stats = {
+            "held": 0,
+            "coalesced": 0,
+            "flushed": 0,
+            "spooled": 0,
+            "failed": 0,
+        }
+
+    def _count(self, name, value=1):
+        with self._cond:
+            self._stats[name] += value
+
+    def _start(self):
+        with self._cond:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._held.clear()
+            if not self._atexit:
+                # Registered handlers are inherited by forked children
+                atexit.register(self.close)
+                self._atexit = True
+            thread = threading.Thread(
+                target=self._run, name="webhook-coalescer"
+            )
+            thread.daemon = True
+            thread.start()
+
+    def _ingest(self, key, entry, handover=None):
+        fields = entry["fields"]
+        if entry["count"] > 1:
+            fields["coalesced"] = {
+                "count": entry["count"],
+                "before": entry["before"],
+                "emails": sorted(entry["emails"]),
+            }
+        self._count("flushed")
+        try:
+            if (handover or ingest)(fields) is not None:
+                return
+        except Exception as exc:
+            logger.error("Ingesting held push failed: %s", exc)
+        spool = _get_spool()
+        if spool is None:
+            logger.error("Ingesting held push to %s %s failed", *key[:2])
+            self._count("failed")
+            return
+        logger.warning("Spooling held push to %s %s", *key[:2])
+        spool.append(fields)
+        self._count("spooled")
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._held:
+                    self._cond.wait()
+                    continue
+                now = time.time()
+                due = min(entry["due"] for entry in self._held.values())
+                if due > now:
+                    self._cond.wait(due - now)
+                    continue
+            with self._ingest_lock:
+                with self._cond:
+                    ready = [
+                        (key, self._held.pop(key))
+                        for key, entry in self._held.items()
+                        if entry["due"] <= now
+                    ]
+                for key, entry in ready:
+                    self._ingest(key, entry)
+
+    def submit(self, key, fields, before=None, emails=()):
+        """ Hold the fields of a push
+
+        :param key: (repository, ref, ...) pushes are coalesced by
+        :param before: revision the branch pointed at before the push
+        :param emails: emails of the people behind the push
+        :returns: QUEUED
+        """
+        if self._pid != os.getpid():
+            self._start()
+        now = time.time()
+        with self._cond:
+            entry = self._held.get(key)
+            if entry is None:
+                self._held[key] = {
+                    "fields": fields,
+                    "before": before,
+                    "emails": set(emails),
+                    "count": 1,
+                    "first": now,
+                    "due": now + self.window,
+                }
+                self._stats["held"] += 1
+            else:
+                entry["fields"] = fields
+                entry["emails"].update(emails)
+                entry["count"] += 1
+                entry["due"] = min(
+                    now + self.window, entry["first"] + self.max_delay
+                )
+                self._stats["coalesced"] += 1
+            self._cond.notify()
+        return QUEUED
+
+    def flush(self, repo):
+        """ Ingest the held pushes of a repository right away
+
+        Used before events that must not overtake the held pushes.
+        """
+        with self._ingest_lock:
+            with self._cond:
+                ready = [
+                    (key, self._held.pop(key))
+                    for key in list(self._held) if key[0] == repo
+                ]
+                self._cond.notify()
+            for key, entry in ready:
+                self._ingest(key, entry)
+
+    def close(self):
+        """ Launch all held pushes right away
+
+        Called when the process exits. The pushes are launched directly
+        rather than through the EventQueue, whose threads don't outlive
+        the process.
+        """
+        if self._pid != os.getpid():
+            return
+        with self._ingest_lock:
+            with self._cond:
+                ready = list(self._held.items())
+                self._held.clear()
+            for key, entry in ready:
+                self._ingest(key, entry, handover=publish)
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats)
+            stats["pending"] = len(self._held)
+        stats["window"] = self.window
+        return stats
+
+
+_coalescer = None
+_coalescer_lock = threading.Lock()
+
+
+def get_coalescer():
+    """ Returns the process wide Coalescer """
+    global _coalescer
+    if _coalescer is None:
+        with _coalescer_lock:
+            if _coalescer is None:
+                _coalescer = Coalescer(settings.COALESCE_WINDOW)
+    return _coalescer
+
+
+def coalesce(fields, payload):
+    """ Hand over an incoming event through the Coalescer
+
+    Pushes to a branch are held and coalesced by repository, ref and webhook
+    parameters. Other events, like tags and branch deletions, are never
+    coalesced: the held pushes of their repository are ingested first and
+    the event right after them.
+
+    :param fields: workitem fields of the event
+    :param payload: Payload of the event
+    :returns: like ingest()
+    """
+    coalescer = get_coalescer()
+    data = payload.data
+    repo = canonical_repourl(payload.url)
+    ref = data.get("ref") or ""
+    if not ref.startswith("refs/heads/") or data.get("after") == ZEROSHA:
+        coalescer.flush(repo)
+        return ingest(fields)
+    key = (
+        repo, ref,
+        json.dumps(data.get("webhook_parameters"), sort_keys=True),
+    )
+    return coalescer.submit(
+        key, fields, before=data.get("before"), emails=payload.emails()
+    )
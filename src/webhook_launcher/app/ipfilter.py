@@ -0,0 +1,116 @@
+# Copyright (C) 2017 Jolla Ltd.
+#
+# All rights reserved.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to
+# the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+""" Allow-list of addresses webhook POSTs are accepted from """
+
+import logging
+import re
+import threading
+import time
+
+from django.conf import settings
+
+from webhook_launcher.app.iptrie import IPTrie
+from webhook_launcher.app.models import CacheVersion, VCSService
+
+logger = logging.getLogger(__name__)
+
+
+class IPAllowList(object):
+    """ Networks from post_ip_filter and the ips of the VCSServices
+
+    The trie is rebuilt when the "services" CacheVersion changed, which is
+    checked at most every check_interval seconds.
+
+    :param networks: networks from the configuration
+    :param check_interval: seconds between CacheVersion checks
+    """
+
+    def __init__(self, networks, check_interval=5):
+        self.networks = networks
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._version = None
+        self._checked_at = 0
+        self._trie = IPTrie()
+        self._stats = {
+            "allowed": 0,
+            "denied": 0,
+            "reloads": 0,
+        }
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def _load(self):
+        networks = list(self.networks)
+        for ips in VCSService.objects.exclude(ips=None).values_list(
+            "ips", flat=True
+        ):
+            networks.extend(re.split(r"[\s,]+", ips))
+        trie = IPTrie()
+        for network in networks:
+            if not network:
+                continue
+            try:
+                trie.add(network)
+            except ValueError as exc:
+                logger.warning("Ignoring post_ip_filter entry: %s", exc)
+        return trie
+
+    def refresh(self, force=False):
+        """ Rebuild the trie if the VCSServices changed """
+        now = time.time()
+        if not force and now - self._checked_at < self.check_interval:
+            return
+        self._checked_at = now
+        version = CacheVersion.current("services")
+        if force or version != self._version:
+            self._trie = self._load()
+            self._version = version
+            self._count("reloads")
+
+    def allows(self, address):
+        self.refresh()
+        if address in self._trie:
+            self._count("allowed")
+            return True
+        self._count("denied")
+        return False
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats["networks"] = len(self._trie)
+        return stats
+
+
+_allow_list = None
+_allow_list_lock = threading.Lock()
+
+
+def get_allow_list():
+    """ Returns the process wide IPAllowList """
+    global _allow_list
+    if _allow_list is None:
+        with _allow_list_lock:
+            if _allow_list is None:
+                _allow_list = IPAllowList(settings.POST_IP_FILTER_NETWORKS)
+    return _allow_list
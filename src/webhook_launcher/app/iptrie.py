@@ -0,0 +1,126 @@
+# Copyright (C) 2017 Jolla Ltd.
+#
+# All rights reserved.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to
+# the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+""" Prefix trie of IPv4 and IPv6 networks """
+
+import binascii
+import socket
+
+_ZERO, _ONE, _LEAF = range(3)
+_V4_MAPPED = "::ffff:"
+
+
+def parse_address(address):
+    """ Returns (family, address as int, address bits) of an IP address
+
+    IPv4 addresses mapped to IPv6 (::ffff:1.2.3.4), as seen on dual stack
+    sockets, are returned as IPv4 addresses.
+
+    :raises ValueError: if address is not a valid IP address
+    """
+    address = address.strip()
+    if address.lower().startswith(_V4_MAPPED) and "." in address:
+        address = address[len(_V4_MAPPED):]
+    for family, bits in ((socket.AF_INET, 32), (socket.AF_INET6, 128)):
+        try:
+            packed = socket.inet_pton(family, address)
+        except (socket.error, UnicodeError):
+            continue
+        return family, int(binascii.hexlify(packed), 16), bits
+    raise ValueError("invalid IP address %r" % address)
+
+
+def _count_leaves(node):
+    # Networks in the subtree of node
+    count = 0
+    nodes = [node]
+    while nodes:
+        node = nodes.pop()
+        if node[_LEAF]:
+            count += 1
+        nodes.extend(child for child in node[:_LEAF] if child is not None)
+    return count
+
+
+class IPTrie(object):
+    """ Binary trie of IPv4 and IPv6 networks
+
+    Lookups walk at most the prefix length of the longest network covering
+    the address, independent of the number of networks.
+
+    :param networks: iterable of addresses or CIDR networks
+    """
+
+    def __init__(self, networks=()):
+        self._roots = {
+            socket.AF_INET: [None, None, False],
+            socket.AF_INET6: [None, None, False],
+        }
+        self.size = 0
+        for network in networks:
+            self.add(network)
+
+    def add(self, network):
+        """ Add an address or CIDR network (eg. 192.30.252.0/22)
+
+        :raises ValueError: if network is not valid
+        """
+        address, _, prefixlen = network.partition("/")
+        family, value, bits = parse_address(address)
+        if prefixlen:
+            try:
+                prefixlen = int(prefixlen)
+            except ValueError:
+                prefixlen = -1
+            if not 0 <= prefixlen <= bits:
+                raise ValueError("invalid prefix length in %r" % network)
+        else:
+            prefixlen = bits
+
+        node = self._roots[family]
+        for shift in range(bits - 1, bits - 1 - prefixlen, -1):
+            if node[_LEAF]:
+                # Already covered by a shorter prefix
+                return
+            bit = (value >> shift) & 1
+            if node[bit] is None:
+                node[bit] = [None, None, False]
+            node = node[bit]
+        if node[_LEAF]:
+            return
+        # Longer prefixes below this one are redundant now
+        self.size += 1 - _count_leaves(node)
+        node[:] = [None, None, True]
+
+    def __contains__(self, address):
+        try:
+            family, value, bits = parse_address(address)
+        except ValueError:
+            return False
+        node = self._roots[family]
+        for shift in range(bits - 1, -1, -1):
+            if node[_LEAF]:
+                return True
+            node = node[(value >> shift) & 1]
+            if node is None:
+                return False
+        return node[_LEAF]
+
+    def __len__(self):
+        return self.size
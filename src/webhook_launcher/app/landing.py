@@ -0,0 +1,132 @@
+# Copyright (C) 2017 Jolla Ltd.
+#
+# All rights reserved.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to
+# the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+""" Paged JSON data of the landing page """
+
+import base64
+import hashlib
+import json
+
+from django.db.models import Count, F, Min, Q
+
+from webhook_launcher.app.models import CacheVersion, WebHookMapping
+
+# CacheVersion stamps of the data the landing page is built from
+STAMPS = ("mappings", "projects", "revisions")
+
+OFFICIAL = "official"
+PERSONAL = "personal"
+TABS = (OFFICIAL, PERSONAL)
+
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values))
+
+
+def decode_cursor(cursor):
+    """ Returns the values of a cursor, raises ValueError if it is bad """
+    try:
+        return json.loads(base64.urlsafe_b64decode(str(cursor)))
+    except (TypeError, UnicodeEncodeError):
+        raise ValueError("bad cursor %r" % cursor)
+
+
+def mappings(tab, user, search=None):
+    """ Returns the complete mappings listed in a tab of the landing page
+
+    :param tab: OFFICIAL or PERSONAL
+    :param user: the user looking at the page
+    :param search: only mappings with this in project, package or repourl
+    """
+    queryset = WebHookMapping.objects.exclude(package="")
+    if tab == OFFICIAL:
+        queryset = queryset.filter(project_official=True)
+    elif user.is_authenticated:
+        queryset = queryset.filter(user=user)
+    else:
+        queryset = queryset.none()
+    if search:
+        queryset = queryset.filter(
+            Q(project__icontains=search) |
+            Q(package__icontains=search) |
+            Q(repourl__icontains=search)
+        )
+    return queryset
+
+
+def etag(*args):
+    """ Returns an ETag of the landing data
+
+    The ETag changes whenever a mapping or Project is saved or deleted and
+    when a push is seen for a mapping, as told by their CacheVersion stamps.
+    args are the other inputs of the data, like the query parameters.
+    """
+    versions = dict(CacheVersion.objects.filter(
+        name__in=STAMPS
+    ).values_list("name", "version"))
+    return hashlib.sha1(json.dumps(
+        [versions.get(name, 0) for name in STAMPS] + list(args)
+    )).hexdigest()
+
+
+def _page(rows, limit, cursor):
+    rows = list(rows[:limit + 1])
+    more = len(rows) > limit
+    rows = rows[:limit]
+    return {
+        "results": rows,
+        "next": encode_cursor(cursor(rows[-1])) if more else None,
+    }
+
+
+def groups(queryset, after=None, limit=100):
+    """ Returns a page of the projects of the mappings
+
+    Projects are ordered by name, each with the number of its packages
+    and the OBS web url. The "next" cursor of the page is passed as after
+    to get the next page.
+    """
+    rows = queryset.values("project").annotate(
+        packages=Count("pk"), obsweburl=Min("obs__weburl")
+    ).order_by("project")
+    if after is not None:
+        rows = rows.filter(project__gt=decode_cursor(after))
+    return _page(rows, limit, lambda row: row["project"])
+
+
+def packages(queryset, project, after=None, limit=100):
+    """ Returns a page of the packages mapped in a project
+
+    Packages are ordered by name, and by pk for packages built from
+    several branches.
+    """
+    rows = queryset.filter(project=project).order_by("package", "pk").values(
+        "pk", "package", "repourl", "branch",
+        revision=F("lastseenrevision__revision"),
+        tag=F("lastseenrevision__tag"),
+    )
+    if after is not None:
+        try:
+            package, pk = decode_cursor(after)
+        except TypeError:
+            raise ValueError("bad cursor %r" % after)
+        rows = rows.filter(
+            Q(package__gt=package) | Q(package=package, pk__gt=pk)
+        )
+    return _page(rows, limit, lambda row: [row["package"], row["pk"]])
@@ -0,0 +1,88 @@
+# Copyright (C) 2017 Jolla Ltd.
+#
+# All rights reserved.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to
+# the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+""" Logging helpers """
+
+import json
+import logging
+
+# Format of the per-event summary line, logged with the event_summary() dict
+# as both the arguments and the extra fields of the record
+SUMMARY_FORMAT = (
+    "%(event)s event for %(repo)s %(ref)s %(after)s "
+    "(%(size)s bytes): %(result)s"
+)
+
+# Attributes every LogRecord has, anything else was passed in extra
+_RECORD_ATTRS = frozenset(
+    logging.LogRecord("", 0, "", 0, "", (), None).__dict__
+) | frozenset(["message", "asctime"])
+
+
+def event_summary(data, event=None, size=None):
+    """ Returns the fields identifying a webhook event for logging
+
+    :param data: payload dict
+    :param event: event type from the request headers
+    :param size: payload size in bytes
+    """
+    repository = data.get("repository") or {}
+    project = data.get("project") or {}
+    ref = data.get("ref")
+    after = data.get("after")
+    if ref is None and isinstance(data.get("push"), dict):
+        # Bitbucket, summarize the first change
+        for change in data["push"].get("changes") or []:
+            new = change.get("new") or {}
+            ref = new.get("name")
+            after = (new.get("target") or {}).get("hash")
+            break
+    return {
+        "event": event or "unknown",
+        "repo": (
+            repository.get("full_name") or
+            project.get("path_with_namespace") or
+            repository.get("url")
+        ),
+        "ref": ref,
+        "after": after,
+        "size": size,
+        "result": None,
+    }
+
+
+class JSONFormatter(logging.Formatter):
+    """ Formats log records as JSON objects, one per line
+
+    Fields passed with extra= are included in the object.
+    """
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS:
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=repr)
@@ -3,9 +3,7 @@ from xml.etree import ElementTree as ET
 from django.contrib.auth.models import User
 from django.core.management.base import BaseCommand, CommandError
 
-from webhook_launcher.app.models import (
-    BuildService, LastSeenRevision, WebHookMapping
-)
+from webhook_launcher.app.models import BuildService, WebHookMapping
 
 
 def _extract_service_file(service_file):
@@ -45,12 +43,9 @@ def create_branch_hook(project, package, branch, url, revision):
         package=package,
     )
 
-    if obj.lastseenrevision_set.count():
-        last_seen = obj.lastseenrevision_set.all()[0]
-        last_seen.revision = revision
-        last_seen.save()
-    else:
-        LastSeenRevision.objects.create(mapping=obj, revision=revision)
+    last_seen = obj.lsr
+    last_seen.revision = revision
+    last_seen.save()
 
     return obj
 
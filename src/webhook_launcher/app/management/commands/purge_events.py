@@ -0,0 +1,38 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from webhook_launcher.app.models import EventPayload
+
+
+class Command(BaseCommand):
+    help = """Remove old stored event payloads.
+
+    Payloads still referred to by a last seen revision are kept.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=7,
+            help="Remove payloads stored more than this many days ago"
+        )
+        parser.add_argument(
+            "--dry-run",
+            dest="dry_run",
+            action="store_true",
+            help="Only print how many payloads would be removed"
+        )
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        old = EventPayload.objects.filter(
+            created__lt=cutoff, lastseenrevision__isnull=True
+        )
+        if options['dry_run']:
+            self.stdout.write("would remove %s payloads" % old.count())
+            return
+        removed, _ = old.delete()
+        self.stdout.write("removed %s payloads" % removed)
@@ -0,0 +1,74 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from webhook_launcher.app.boss import launch_queue
+from webhook_launcher.app.spool import Spool
+
+
+class Command(BaseCommand):
+    help = """Inspect and replay the event spool.
+
+    Without options lists the spool segments. --show prints the pending
+    records of a segment and --replay launches all spooled events in order.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--spool-dir",
+            dest="spool_dir",
+            help="Spool directory, defaults to spool_dir from the config"
+        )
+        parser.add_argument(
+            "--show",
+            metavar="SEGMENT",
+            help="Print pending records of SEGMENT"
+        )
+        parser.add_argument(
+            "--replay",
+            action="store_true",
+            help="Launch spooled events and remove replayed segments"
+        )
+
+    def handle(self, *args, **options):
+        path = options['spool_dir'] or settings.SPOOL_DIR
+        if not path:
+            raise CommandError(
+                "no spool directory configured, use --spool-dir"
+            )
+        if not os.path.isdir(path):
+            raise CommandError("%s is not a directory" % path)
+        spool = Spool(path)
+
+        if options['show']:
+            segment_path = os.path.join(path, os.path.basename(
+                options['show']
+            ))
+            if not os.path.exists(segment_path):
+                raise CommandError("no such segment: %s" % options['show'])
+            with open(segment_path, "rb") as segment:
+                start = spool.read_offset(segment_path)
+                for _, line in spool.records(segment, start):
+                    self.stdout.write(line.rstrip("\n"))
+
+        elif options['replay']:
+            if not spool.drain(launch_queue):
+                raise CommandError(
+                    "replay stopped, %s segments left" %
+                    len(spool.segments())
+                )
+            self.stdout.write(
+                "replayed %s events" % spool.stats()['replayed']
+            )
+
+        else:
+            for segment_path in spool.segments():
+                with open(segment_path, "rb") as segment:
+                    start = spool.read_offset(segment_path)
+                    pending = sum(1 for _ in spool.records(segment, start))
+                self.stdout.write("%s %s bytes, %s pending records" % (
+                    os.path.basename(segment_path),
+                    os.path.getsize(segment_path),
+                    pending,
+                ))
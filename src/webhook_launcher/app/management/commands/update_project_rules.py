@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from webhook_launcher.app.models import WebHookMapping
+
+
+class Command(BaseCommand):
+    help = """Recompute the Project rules stored on webhook mappings.
+
+    The matched project, official, allowed and namespace valid fields are
+    kept up to date when mappings, Projects and namespaces are saved. This
+    rebuilds them after changes that bypassed that, like bulk updates.
+    """
+
+    def handle(self, *args, **options):
+        updated = WebHookMapping.update_rules()
+        self.stdout.write("updated %s mappings" % updated)
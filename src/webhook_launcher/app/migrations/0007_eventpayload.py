@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 12:00
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0006_cacheversion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EventPayload',
+            fields=[
+                ('sha256', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('body', models.TextField()),
+                ('created', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='lastseenrevision',
+            name='event',
+            field=models.ForeignKey(blank=True, editable=False, help_text=b'Stored payload, used instead of payload', null=True, on_delete=django.db.models.deletion.SET_NULL, to='app.EventPayload'),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 12:00
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0007_eventpayload'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='relaytarget',
+            name='compress',
+            field=models.BooleanField(default=False, help_text=b'Send gzip compressed POSTs (the receiver needs to accept Content-Encoding: gzip)'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 12:00
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0008_relaytarget_compress'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='vcsservice',
+            name='rate_burst',
+            field=models.PositiveIntegerField(blank=True, help_text=b'Events accepted at once above the rate limit (optional)', null=True),
+        ),
+        migrations.AddField(
+            model_name='vcsservice',
+            name='rate_limit',
+            field=models.PositiveIntegerField(blank=True, help_text=b'Events per minute accepted for one repository of this service (optional, defaults to rate_limit in config)', null=True),
+        ),
+    ]
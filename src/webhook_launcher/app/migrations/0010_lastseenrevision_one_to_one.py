@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 12:00
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import Count
+import django.db.models.deletion
+
+
+def collapse_lsrs(apps, schema_editor):
+    WebHookMapping = apps.get_model('app', 'WebHookMapping')
+    LastSeenRevision = apps.get_model('app', 'LastSeenRevision')
+    # Keep only the latest LastSeenRevision of a mapping
+    duplicated = LastSeenRevision.objects.values('mapping').annotate(
+        count=Count('id')
+    ).filter(count__gt=1)
+    for row in duplicated:
+        lsrs = LastSeenRevision.objects.filter(
+            mapping_id=row['mapping']
+        ).order_by('-timestamp', '-pk')
+        LastSeenRevision.objects.filter(
+            pk__in=[lsr.pk for lsr in lsrs[1:]]
+        ).delete()
+    # and give one to the mappings that don't have any
+    LastSeenRevision.objects.bulk_create(
+        LastSeenRevision(mapping_id=pk, revision="") for pk in
+        WebHookMapping.objects.filter(
+            lastseenrevision__isnull=True
+        ).values_list('pk', flat=True)
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0009_vcsservice_rate_limit'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            # Forward
+            collapse_lsrs,
+            # Backward
+            migrations.RunPython.noop
+        ),
+        migrations.AlterField(
+            model_name='lastseenrevision',
+            name='mapping',
+            field=models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to='app.WebHookMapping'),
+        ),
+    ]
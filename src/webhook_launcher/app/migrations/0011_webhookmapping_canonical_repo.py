@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 12:00
+from __future__ import unicode_literals
+
+from collections import defaultdict
+
+from django.db import migrations, models
+
+from webhook_launcher.app.misc import canonical_repourl
+
+BATCH_SIZE = 1000
+
+
+def fill_canonical_repo(apps, schema_editor):
+    WebHookMapping = apps.get_model('app', 'WebHookMapping')
+    rows = WebHookMapping.objects.order_by('pk').values_list('pk', 'repourl')
+    last = 0
+    while True:
+        batch = list(rows.filter(pk__gt=last)[:BATCH_SIZE])
+        if not batch:
+            break
+        last = batch[-1][0]
+        # One UPDATE per repository in the batch
+        pks = defaultdict(list)
+        for pk, repourl in batch:
+            pks[canonical_repourl(repourl)].append(pk)
+        for canonical, repo_pks in pks.items():
+            WebHookMapping.objects.filter(pk__in=repo_pks).update(
+                canonical_repo=canonical
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0010_lastseenrevision_one_to_one'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='webhookmapping',
+            name='canonical_repo',
+            field=models.CharField(db_index=True, default=b'', editable=False, help_text=b'host/path of repourl, used to look up the mappings of a repository whichever way its url is written', max_length=200),
+        ),
+        migrations.RunPython(
+            # Forward
+            fill_canonical_repo,
+            # Backward
+            migrations.RunPython.noop
+        ),
+    ]
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 12:00
+from __future__ import unicode_literals
+
+import os
+import re
+from collections import defaultdict
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+from webhook_launcher.app.misc import parse_repourl
+
+
+def fill_project_rules(apps, schema_editor):
+    # Same as WebHookMapping.update_rules(), with the historical models
+    WebHookMapping = apps.get_model('app', 'WebHookMapping')
+    Project = apps.get_model('app', 'Project')
+    VCSNameSpace = apps.get_model('app', 'VCSNameSpace')
+    projects = []
+    for project in Project.objects.order_by('pk'):
+        try:
+            regex = re.compile(project.match) if project.match else None
+        except re.error:
+            regex = None
+        projects.append((project, regex))
+    namespaces = set(VCSNameSpace.objects.values_list(
+        'service__netloc', 'path'
+    ))
+    rules = {}
+    changed = defaultdict(list)
+    for pk, repourl, name in WebHookMapping.objects.values_list(
+        'pk', 'repourl', 'project'
+    ):
+        if name not in rules:
+            matching = [
+                project for project, regex in projects
+                if project.name == name or (regex and regex.match(name))
+            ]
+            rules[name] = (
+                matching[0].pk if matching else None,
+                any(match.official and match.allowed for match in matching),
+                all(match.allowed for match in matching),
+            )
+        url = parse_repourl(repourl)
+        valid = (url.netloc, os.path.dirname(url.path)) in namespaces
+        changed[rules[name] + (valid,)].append(pk)
+    for values, pks in changed.items():
+        for start in range(0, len(pks), 1000):
+            WebHookMapping.objects.filter(
+                pk__in=pks[start:start + 1000]
+            ).update(**dict(zip((
+                'matched_project_id', 'project_official', 'project_allowed',
+                'namespace_valid',
+            ), values)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0011_webhookmapping_canonical_repo'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='webhookmapping',
+            name='matched_project',
+            field=models.ForeignKey(blank=True, editable=False, help_text=b'first Project whose name or match fits the project', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='app.Project'),
+        ),
+        migrations.AddField(
+            model_name='webhookmapping',
+            name='namespace_valid',
+            field=models.BooleanField(db_index=True, default=False, editable=False, help_text=b'the repository is in a known VCS namespace'),
+        ),
+        migrations.AddField(
+            model_name='webhookmapping',
+            name='project_allowed',
+            field=models.BooleanField(db_index=True, default=True, editable=False, help_text=b'all the Projects matching the project allow webhooks'),
+        ),
+        migrations.AddField(
+            model_name='webhookmapping',
+            name='project_official',
+            field=models.BooleanField(db_index=True, default=False, editable=False, help_text=b'an official Project that allows webhooks matches the project'),
+        ),
+        migrations.RunPython(
+            # Forward
+            fill_project_rules,
+            # Backward
+            migrations.RunPython.noop
+        ),
+    ]
@@ -1,35 +1,155 @@
-import urlparse
+import threading
+import zlib
+from collections import namedtuple
 
 import requests
 from django.conf import settings
 
+# Number of parsed repository urls kept by parse_repourl()
+REPOURL_CACHE_SIZE = 4096
 
-def giturlparse(repourl):
-    parsed = urlparse.urlparse(repourl)
-    if not parsed.scheme:
-        # if url didn't have scheme prepend default git:// and parse again
-        repourl = "git://%s" % repourl
-        parsed = urlparse.urlparse(repourl)
-
-    if parsed.netloc.count(":") > 0:
-        # if url has : other than the scheme it could be a port or
-        # a git service thingie
-        try:
-            # invalid port raises value error
-            port = parsed.port
-            repourl = repourl.replace(":%s" % port, "")
-            parsed = urlparse.urlparse(repourl)
-        except ValueError:
-            # in that case replace it with / and reparse
-            repourl = "/".join(repourl.rsplit(":", 1))
-            parsed = urlparse.urlparse(repourl)
-
-    # finally remove users from the url
-    if "@" in parsed.netloc:
-        repourl = "%s://%s" % (parsed.scheme, repourl.split("@", 1)[1])
-        parsed = urlparse.urlparse(repourl)
-
-    return parsed
+RepoUrl = namedtuple("RepoUrl", "scheme netloc path canonical")
+
+
+class LRUCache(object):
+    """ Thread safe mapping keeping the size most recently used items
+
+    Items are kept in a dict and in a circular doubly linked list of
+    [prev, next, key, value] links ordered by use, which is cheaper to
+    reorder than an OrderedDict.
+
+    :param size: maximum number of items
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self._lock = threading.Lock()
+        self._stats = {
+            "hits": 0,
+            "misses": 0,
+        }
+        self.clear()
+
+    def _use(self, link):
+        # Move the link to the most recently used end
+        prev, next_ = link[0], link[1]
+        prev[1], next_[0] = next_, prev
+        last = self._root[0]
+        last[1] = self._root[0] = link
+        link[0], link[1] = last, self._root
+
+    def get(self, key, default=None):
+        with self._lock:
+            link = self._links.get(key)
+            if link is None:
+                self._stats["misses"] += 1
+                return default
+            self._stats["hits"] += 1
+            self._use(link)
+            return link[3]
+
+    def put(self, key, value):
+        with self._lock:
+            link = self._links.get(key)
+            if link is not None:
+                link[3] = value
+                self._use(link)
+                return
+            root = self._root
+            last = root[0]
+            link = [last, root, key, value]
+            last[1] = root[0] = self._links[key] = link
+            if len(self._links) > self.size:
+                oldest = root[1]
+                root[1], oldest[1][0] = oldest[1], root
+                del self._links[oldest[2]]
+
+    def clear(self):
+        with self._lock:
+            self._links = {}
+            self._root = []
+            self._root[:] = [self._root, self._root, None, None]
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["items"] = len(self._links)
+        stats["size"] = self.size
+        return stats
+
+
+_repourls = LRUCache(REPOURL_CACHE_SIZE)
+
+
+def _parse_repourl(repourl):
+    url = repourl.strip()
+    scheme, sep, rest = url.partition("://")
+    if sep:
+        scheme = scheme.lower()
+    else:
+        # scp like user@host:path or a bare host/path
+        scheme, rest = "git", url
+    for mark in "?#":
+        rest = rest.split(mark, 1)[0]
+    netloc, slash, path = rest.partition("/")
+    path = slash + path
+    # Leave out the user
+    netloc = netloc.rpartition("@")[2]
+    netloc, colon, port = netloc.partition(":")
+    if port and not port.isdigit():
+        # Not a port but the start of the path of a scp like url
+        path = "/" + port + path
+    canonical = path.rstrip("/")
+    if canonical.endswith(".git"):
+        canonical = canonical[:-4]
+    return RepoUrl(scheme, netloc, path, netloc.lower() + canonical)
+
+
+def parse_repourl(repourl):
+    """Parses a git url into a RepoUrl
+
+    Handles scheme://[user@]host[:port]/path as well as scp like
+    [user@]host:path urls. The scheme defaults to "git", the user and port
+    are left out of netloc. canonical is the "host/path" of the url with a
+    lower case host and without a trailing .git, which is the same for all
+    the ways to write the url of one repository.
+
+    Results are kept in a LRU cache as the same few urls are parsed over
+    and over again.
+    """
+    url = _repourls.get(repourl)
+    if url is None:
+        url = _parse_repourl(repourl)
+        _repourls.put(repourl, url)
+    return url
+
+
+def canonical_repourl(repourl):
+    """Returns the "host/path" of a git url
+
+    Scheme, user, port and a trailing .git are left out so that all the
+    ways to write the url of one repository give the same result.
+    """
+    return parse_repourl(repourl).canonical
+
+
+def repourl_cache_stats():
+    return _repourls.stats()
+
+
+def handler_participant(repourl, shards):
+    """Returns the handle_webhook participant for events of a repository
+
+    With more than one shard events are spread over the participants
+    handle_webhook_0 .. handle_webhook_<shards - 1> by a hash of the
+    canonical repository url. All events of a repository go to the same
+    participant, which handles them one at a time in the order they were
+    launched.
+    """
+    if shards <= 1 or not repourl:
+        return "handle_webhook"
+    shard = (zlib.crc32(canonical_repourl(repourl)) & 0xffffffff) % shards
+    return "handle_webhook_%d" % shard
 
 
 def get_or_none(model, **kwargs):
@@ -17,17 +17,33 @@
 # the Free Software Foundation, Inc.,
 # 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 
+import hashlib
+import json
+import logging
+import operator
 import os
 import re
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
 
 from django.conf import settings
 from django.contrib.auth.models import Group, User
-from django.core.exceptions import ValidationError
-from django.db import models
+from django.core.exceptions import MultipleObjectsReturned, ValidationError
+from django.db import models, transaction
+from django.db.models import Case, F, Q, Value, When
+from django.db.models.signals import (
+    m2m_changed, post_delete, post_save, pre_delete, pre_save
+)
+from django.dispatch import receiver
 from django.utils import timezone
 
 from webhook_launcher.app.boss import launch_notify, launch_build
-from webhook_launcher.app.misc import get_or_none, giturlparse
+from webhook_launcher.app.misc import (
+    canonical_repourl, get_or_none, parse_repourl
+)
+
+logger = logging.getLogger(__name__)
 
 
 # FIXME: All null=True + blank=True text fields
@@ -73,6 +89,17 @@ class VCSService(models.Model):
         null=True,
         help_text="Known IP adresses of this service (optional)",
     )
+    rate_limit = models.PositiveIntegerField(
+        blank=True,
+        null=True,
+        help_text="Events per minute accepted for one repository of this "
+                  "service (optional, defaults to rate_limit in config)",
+    )
+    rate_burst = models.PositiveIntegerField(
+        blank=True,
+        null=True,
+        help_text="Events accepted at once above the rate limit (optional)",
+    )
 
     def __unicode__(self):
         return self.netloc
@@ -100,7 +127,7 @@ class VCSNameSpace(models.Model):
 
     @staticmethod
     def find(repourl):
-        url = giturlparse(repourl)
+        url = parse_repourl(repourl)
         return get_or_none(
             VCSNameSpace,
             service__netloc=url.netloc,
@@ -158,7 +185,7 @@ class Project(models.Model):
 
     def is_repourl_allowed(self, repourl):
 
-        repourl = giturlparse(repourl)
+        repourl = parse_repourl(repourl)
         netloc = repourl.netloc
         path = repourl.path.rsplit("/", 1)[1]
         if self.vcsnamespaces.count():
@@ -194,15 +221,13 @@ class Project(models.Model):
     def get_matching(cls, name, apiurl):
         # Search all Projects for a match
         # Exception raised if more than one match found
-        found = None
-        for project in Project.objects.filter(obs__apiurl=apiurl):
-            if project.matches(name):
-                if found is not None:
-                    raise MultipleObjectsReturned(
-                        "Project %s matches both %s and %s (possibly more)" %
-                        (name, found.name, project.name))
-                found = project
-        return found
+        from webhook_launcher.app.projectmatcher import get_project_matcher
+        found = get_project_matcher().matching(name, apiurl)
+        if len(found) > 1:
+            raise MultipleObjectsReturned(
+                "Project %s matches both %s and %s (possibly more)" %
+                (name, found[0].name, found[1].name))
+        return found[0] if found else None
 
 
 class WebHookMapping(models.Model):
@@ -284,12 +309,127 @@ class WebHookMapping(models.Model):
     obs = models.ForeignKey(
         BuildService,
     )
+    canonical_repo = models.CharField(
+        max_length=200,
+        default="",
+        db_index=True,
+        editable=False,
+        help_text="host/path of repourl, used to look up the mappings of "
+                  "a repository whichever way its url is written",
+    )
+    # The Project rules that apply to the mapping, kept up to date by
+    # update_rules() when the mapping, a Project or a namespace changes
+    matched_project = models.ForeignKey(
+        Project,
+        null=True,
+        blank=True,
+        editable=False,
+        on_delete=models.SET_NULL,
+        related_name="+",
+        help_text="first Project whose name or match fits the project",
+    )
+    project_official = models.BooleanField(
+        default=False,
+        db_index=True,
+        editable=False,
+        help_text="an official Project that allows webhooks matches the "
+                  "project",
+    )
+    project_allowed = models.BooleanField(
+        default=True,
+        db_index=True,
+        editable=False,
+        help_text="all the Projects matching the project allow webhooks",
+    )
+    namespace_valid = models.BooleanField(
+        default=False,
+        db_index=True,
+        editable=False,
+        help_text="the repository is in a known VCS namespace",
+    )
+
+    RULE_FIELDS = (
+        "matched_project_id", "project_official", "project_allowed",
+        "namespace_valid",
+    )
 
     def __unicode__(self):
         return "%s/%s -> %s/%s" % (
             self.repourl, self.branch, self.project, self.package
         )
 
+    def save(self, *args, **kwargs):
+        from webhook_launcher.app.projectmatcher import get_project_matcher
+        self.canonical_repo = canonical_repourl(self.repourl)
+        get_project_matcher().refresh()
+        rules = self._match_rules(
+            self.repourl, self.project, {}, self._namespaces()
+        )
+        for field, value in zip(self.RULE_FIELDS, rules):
+            setattr(self, field, value)
+        super(WebHookMapping, self).save(*args, **kwargs)
+
+    @staticmethod
+    def _namespaces():
+        return set(VCSNameSpace.objects.values_list(
+            "service__netloc", "path"
+        ))
+
+    @staticmethod
+    def _match_rules(repourl, project, projects, namespaces):
+        # Returns the values of RULE_FIELDS for a mapping, projects caches
+        # the Project rules by project name. The callers refresh the
+        # ProjectMatcher once beforehand.
+        from webhook_launcher.app.projectmatcher import get_project_matcher
+        if project not in projects:
+            matching = get_project_matcher().matching(project, refresh=False)
+            projects[project] = (
+                matching[0].pk if matching else None,
+                any(match.official and match.allowed for match in matching),
+                all(match.allowed for match in matching),
+            )
+        url = parse_repourl(repourl)
+        namespace = (url.netloc, os.path.dirname(url.path))
+        return projects[project] + (namespace in namespaces,)
+
+    @classmethod
+    def update_rules(cls, mapobjs=None):
+        """Recomputes the Project rule fields of mappings
+
+        Only the mappings whose rules changed are updated, in an UPDATE per
+        distinct set of rules.
+
+        :param mapobjs: queryset of the mappings to check, all by default
+        :returns: number of mappings updated
+        """
+        from webhook_launcher.app.projectmatcher import get_project_matcher
+        if mapobjs is None:
+            mapobjs = cls.objects.all()
+        get_project_matcher().refresh()
+        fields = cls.RULE_FIELDS
+        projects = {}
+        namespaces = cls._namespaces()
+        changed = defaultdict(list)
+        for row in mapobjs.values_list("pk", "repourl", "project", *fields):
+            rules = cls._match_rules(row[1], row[2], projects, namespaces)
+            if rules != row[3:]:
+                changed[rules].append(row[0])
+        for rules, pks in changed.items():
+            for start in range(0, len(pks), 1000):
+                cls.objects.filter(pk__in=pks[start:start + 1000]).update(
+                    **dict(zip(fields, rules))
+                )
+        if changed:
+            CacheVersion.bump("mappings")
+        return sum(len(pks) for pks in changed.values())
+
+    @classmethod
+    def for_repo(cls, *repourls):
+        """Returns the mappings of the repository at any of the repourls"""
+        return cls.objects.filter(canonical_repo__in=set(
+            canonical_repourl(repourl) for repourl in repourls if repourl
+        ))
+
     @property
     def tag(self):
         lsr = self.lsr
@@ -304,15 +444,17 @@ class WebHookMapping(models.Model):
 
     @property
     def lsr(self):
-        # TODO: refactor the WebHookMapping and LastSeenRevision relation
-        if not hasattr(self, '_lsr'):
-            if self.pk:
-                self._lsr, _ = LastSeenRevision.objects.get_or_create(
-                    mapping=self
-                )
-            else:
-                return None
-        return self._lsr
+        if not self.pk:
+            return None
+        try:
+            # Joined in with select_related("lastseenrevision")
+            return self.lastseenrevision
+        except LastSeenRevision.DoesNotExist:
+            # Created with the mapping, unless that bypassed the post_save
+            # signal (eg. bulk_create())
+            lsr, _ = LastSeenRevision.objects.get_or_create(mapping=self)
+            self.lastseenrevision = lsr
+            return lsr
 
     @property
     def mapped(self):
@@ -322,36 +464,48 @@ class WebHookMapping(models.Model):
     def rev_or_head(self):
         return self.revision or self.branch
 
+    @classmethod
+    def prefetch(cls, mapobjs):
+        """Loads what handling events for the mappings needs in bulk
+
+        The queue periods are loaded in one query and shared by the
+        mappings, so that trigger_build() doesn't query them per mapping.
+        The mappings should come with select_related("lastseenrevision").
+
+        :param mapobjs: list of saved WebHookMappings
+        """
+        if not mapobjs:
+            return
+        queue_periods = defaultdict(list)
+        for qp_project in QueuePeriod.projects.through.objects.filter(
+            project__name__in=set(mapobj.project for mapobj in mapobjs)
+        ).select_related("queueperiod", "project"):
+            project = qp_project.project
+            queue_periods[(project.name, project.obs_id)].append(
+                qp_project.queueperiod
+            )
+        rules = {
+            "queue_periods": queue_periods,
+        }
+        for mapobj in mapobjs:
+            mapobj._rules = rules
+
+    def _queue_periods(self):
+        rules = getattr(self, "_rules", None)
+        if rules is not None:
+            return rules["queue_periods"][(self.project, self.obs_id)]
+        return QueuePeriod.objects.filter(
+            projects__name=self.project,
+            projects__obs=self.obs,
+        )
+
     @property
     def project_disabled(self):
-        # Just search all Projects for a match
-        for project in Project.objects.all():
-            if project.matches(self.project):
-                print "Project disable check: %s matches rules in %s" % (
-                    self.project, project.name
-                )
-                if project and not project.allowed:
-                    # Disabled if Project is marked not-allowed
-                    return True
-                if project and project.official:
-                    # Disabled if Project is official and namespace is not
-                    # valid
-                    repourl = giturlparse(self.repourl)
-                    service = get_or_none(
-                        VCSService,
-                        netloc=repourl.netloc,
-                    )
-                    if not service:
-                        return True
-                    namespace = get_or_none(
-                        VCSNameSpace,
-                        service=service,
-                        path=os.path.dirname(repourl.path),
-                    )
-                    if not namespace:
-                        return True
-
-        return False
+        # Disabled if a matching Project is marked not-allowed, or is
+        # official and the namespace is not valid
+        return not self.project_allowed or (
+            self.project_official and not self.namespace_valid
+        )
 
     def clean(self, exclude=None):
         self.repourl = self.repourl.strip()
@@ -374,7 +528,7 @@ class WebHookMapping(models.Model):
                 (duplicates[0].pk, self.obs, self.project, self.package)
             )
 
-        repourl = giturlparse(self.repourl)
+        repourl = parse_repourl(self.repourl)
         service = get_or_none(VCSService, netloc=repourl.netloc)
 
         if settings.ONLY_KNOWN_SERVICES and service is None:
@@ -431,12 +585,12 @@ class WebHookMapping(models.Model):
         # rely on validation since a Project may forbid hooks after
         # the hook was created
         if self.project_disabled:
-            print "Project has build disabled"
+            logger.info("Project %s has build disabled", self.project)
             return
 
         handled = self.lsr.handled and self.lsr.tag == tag and not force
         if handled:
-            print "build already handled, skipping"
+            logger.info("Build of %s already handled, skipping", self)
         build = self.build and self.mapped and not handled
         qp = None
         if user is None:
@@ -447,14 +601,13 @@ class WebHookMapping(models.Model):
                 self.lsr.tag = tag
 
             # Find possible queue period objects
-            qps = QueuePeriod.objects.filter(
-                projects__name=self.project,
-                projects__obs=self.obs,
-            )
+            qps = self._queue_periods()
             for qp in qps:
                 if qp.delay() and not qp.override(webuser=user):
-                    print "Build trigger for %s delayed by %s" % (self, qp)
-                    print qp.comment
+                    logger.info(
+                        "Build trigger for %s delayed by %s: %s",
+                        self, qp, qp.comment
+                    )
                     build = False
                     break
             else:
@@ -540,7 +693,7 @@ class WebHookMapping(models.Model):
 
         fields = self.to_fields()
         fields['msg'] = message
-        print message.encode('utf-8')
+        logger.info("%s", message)
         launch_notify(fields)
 
     def to_fields(self):
@@ -567,8 +720,38 @@ class WebHookMapping(models.Model):
         return fields
 
 
+class EventPayload(models.Model):
+    """Body of an incoming event, stored once at ingest
+
+    Workitems and LastSeenRevisions refer to it by the SHA-256 of the body
+    instead of carrying a copy of it.
+    """
+    sha256 = models.CharField(
+        max_length=64,
+        primary_key=True,
+    )
+    body = models.TextField()
+    created = models.DateTimeField(
+        auto_now_add=True,
+        db_index=True,
+    )
+
+    def __unicode__(self):
+        return self.sha256
+
+    @classmethod
+    def store(cls, body):
+        """Stores body unless already stored and returns its key"""
+        if isinstance(body, unicode):
+            key = hashlib.sha256(body.encode("utf-8")).hexdigest()
+        else:
+            key = hashlib.sha256(body).hexdigest()
+        cls.objects.get_or_create(sha256=key, defaults={"body": body})
+        return key
+
+
 class LastSeenRevision(models.Model):
-    mapping = models.ForeignKey(
+    mapping = models.OneToOneField(
         WebHookMapping,
     )
     revision = models.CharField(
@@ -596,12 +779,78 @@ class LastSeenRevision(models.Model):
         null=True,
         editable=False,
     )
+    event = models.ForeignKey(
+        EventPayload,
+        blank=True,
+        null=True,
+        editable=False,
+        on_delete=models.SET_NULL,
+        help_text="Stored payload, used instead of payload",
+    )
 
     def __unicode__(self):
         return "%s @ %s/%s" % (
             self.revision, self.mapping.repourl, self.mapping.branch
         )
 
+    # Per thread LastSeenRevisions whose save() is deferred by bulk_save()
+    _deferred = threading.local()
+
+    def save(self, *args, **kwargs):
+        pending = getattr(self._deferred, "lsrs", None)
+        if pending is not None and self.pk and not args and not kwargs:
+            pending[self.pk] = self
+            return
+        super(LastSeenRevision, self).save(*args, **kwargs)
+
+    @classmethod
+    @contextmanager
+    def bulk_save(cls):
+        """Context manager collecting the saves of LastSeenRevisions
+
+        Within the context save() of an existing LastSeenRevision only
+        records it. The recorded ones are written with a single UPDATE when
+        the context is left, in the same transaction as everything else
+        done in the context.
+        """
+        with transaction.atomic():
+            cls._deferred.lsrs = {}
+            try:
+                yield
+                lsrs = cls._deferred.lsrs.values()
+            finally:
+                cls._deferred.lsrs = None
+            cls.bulk_update(lsrs)
+
+    @classmethod
+    def bulk_update(cls, lsrs):
+        """Writes the fields of LastSeenRevisions with one UPDATE query"""
+        if not lsrs:
+            return
+        updates = {"timestamp": timezone.now()}
+        for name in ("revision", "tag", "handled", "emails", "payload",
+                     "event"):
+            field = cls._meta.get_field(name)
+            if field.is_relation:
+                output_field = field.target_field
+            else:
+                output_field = field
+            updates[name] = Case(*[
+                When(pk=lsr.pk, then=Value(
+                    getattr(lsr, field.attname), output_field=output_field
+                )) for lsr in lsrs
+            ], output_field=output_field)
+        cls.objects.filter(pk__in=[lsr.pk for lsr in lsrs]).update(**updates)
+        CacheVersion.bump("revisions")
+
+    def payload_data(self):
+        """Returns the payload of the last seen push as a dict or None"""
+        if self.payload:
+            return json.loads(self.payload)
+        if self.event_id:
+            return json.loads(self.event.body)
+        return None
+
 
 class QueuePeriod(models.Model):
     start_time = models.TimeField(
@@ -688,6 +937,11 @@ class RelayTarget(models.Model):
         default=True,
         help_text="Turn on SSL certificate verification",
     )
+    compress = models.BooleanField(
+        default=False,
+        help_text="Send gzip compressed POSTs "
+                  "(the receiver needs to accept Content-Encoding: gzip)",
+    )
     sources = models.ManyToManyField(
         VCSNameSpace,
         help_text="List of VCS namespaces "
@@ -696,3 +950,180 @@ class RelayTarget(models.Model):
 
     def __unicode__(self):
         return "%s webhook relay" % self.name
+
+
+class CacheVersion(models.Model):
+    """Version stamp of data cached by the webhook processes
+
+    Bumped whenever the data a process wide cache is built from changes,
+    so that every process can cheaply tell when to rebuild its copy.
+    """
+    name = models.CharField(
+        max_length=50,
+        unique=True,
+    )
+    version = models.PositiveIntegerField(
+        default=0,
+    )
+
+    def __unicode__(self):
+        return "%s version %s" % (self.name, self.version)
+
+    @classmethod
+    def current(cls, name):
+        return cls.objects.filter(name=name).values_list(
+            "version", flat=True
+        ).first() or 0
+
+    @classmethod
+    def bump(cls, name):
+        stamp, _ = cls.objects.get_or_create(name=name)
+        cls.objects.filter(pk=stamp.pk).update(version=F("version") + 1)
+
+
+@receiver(post_save, sender=WebHookMapping)
+@receiver(post_delete, sender=WebHookMapping)
+def _mappings_changed(sender, **kwargs):
+    CacheVersion.bump("mappings")
+
+
+@receiver(post_save, sender=LastSeenRevision)
+@receiver(post_delete, sender=LastSeenRevision)
+def _revisions_changed(sender, **kwargs):
+    CacheVersion.bump("revisions")
+
+
+@receiver(post_save, sender=WebHookMapping)
+def _create_lsr(sender, instance, created, raw=False, **kwargs):
+    # Every mapping has its LastSeenRevision from the start, so that it can
+    # be joined in instead of queried per mapping
+    if created and not raw:
+        LastSeenRevision.objects.get_or_create(mapping=instance)
+
+
+@receiver(pre_save, sender=Project)
+def _project_saving(sender, instance, raw=False, **kwargs):
+    # The name and match before the change, the mappings they matched need
+    # their rules updated too
+    instance._previous = None
+    if instance.pk and not raw:
+        instance._previous = Project.objects.filter(
+            pk=instance.pk
+        ).values_list("name", "match").first()
+
+
+def _project_mappings(projects):
+    # Returns the names of the mapped projects any of projects matches
+    matching = []
+    for name in WebHookMapping.objects.values_list(
+        "project", flat=True
+    ).distinct():
+        for project in projects:
+            try:
+                if project.matches(name):
+                    matching.append(name)
+                    break
+            except re.error:
+                continue
+    return matching
+
+
+@receiver(post_save, sender=Project)
+@receiver(post_delete, sender=Project)
+@receiver(post_save, sender=BuildService)
+@receiver(post_delete, sender=BuildService)
+def _projects_changed(sender, instance, raw=False, **kwargs):
+    from webhook_launcher.app.projectmatcher import get_project_matcher
+    CacheVersion.bump("projects")
+    # Other processes notice the bumped CacheVersion
+    get_project_matcher().invalidate()
+    if sender is Project and not raw:
+        projects = [instance]
+        previous = getattr(instance, "_previous", None)
+        if previous:
+            projects.append(Project(name=previous[0], match=previous[1]))
+        names = _project_mappings(projects)
+        for start in range(0, len(names), 500):
+            WebHookMapping.update_rules(WebHookMapping.objects.filter(
+                project__in=names[start:start + 500]
+            ))
+
+
+@receiver(post_save, sender=RelayTarget)
+@receiver(post_delete, sender=RelayTarget)
+@receiver(m2m_changed, sender=RelayTarget.sources.through)
+@receiver(post_save, sender=VCSNameSpace)
+@receiver(post_delete, sender=VCSNameSpace)
+def _relays_changed(sender, **kwargs):
+    CacheVersion.bump("relays")
+
+
+@receiver(pre_save, sender=VCSNameSpace)
+@receiver(pre_delete, sender=VCSNameSpace)
+@receiver(pre_save, sender=VCSService)
+def _namespace_changing(sender, instance, raw=False, update_fields=None,
+                        **kwargs):
+    # The (netloc, path) before the change, the mappings it covered need
+    # their rules updated too. Read before a deleted VCSService takes its
+    # namespaces along.
+    instance._previous = None
+    if update_fields and not {"netloc", "service", "path"} & set(
+        update_fields
+    ):
+        return
+    if instance.pk and not raw:
+        if sender is VCSService:
+            netloc = VCSService.objects.filter(
+                pk=instance.pk
+            ).values_list("netloc", flat=True).first()
+            if netloc is not None:
+                instance._previous = (netloc, "")
+        else:
+            instance._previous = VCSNameSpace.objects.filter(
+                pk=instance.pk
+            ).values_list("service__netloc", "path").first()
+
+
+def _namespace_mappings(locations):
+    # Returns the mappings with repourls under any of the (netloc, path)
+    # locations
+    return WebHookMapping.objects.filter(reduce(operator.or_, (
+        Q(canonical_repo__startswith=canonical_repourl(netloc + path) + "/")
+        for netloc, path in locations
+    )))
+
+
+@receiver(post_save, sender=VCSNameSpace)
+@receiver(post_delete, sender=VCSNameSpace)
+@receiver(post_save, sender=VCSService)
+def _namespaces_changed(sender, instance, raw=False, update_fields=None,
+                        **kwargs):
+    if raw:
+        return
+    previous = getattr(instance, "_previous", None)
+    if sender is VCSService:
+        # Only a changed netloc moves namespaces, a VCSService is deleted
+        # with its namespaces
+        if previous is None or previous[0] == instance.netloc:
+            return
+        locations = [(previous[0], ""), (instance.netloc, "")]
+    elif "created" not in kwargs:
+        # Deleted
+        if previous is None:
+            return
+        locations = [previous]
+    else:
+        if update_fields and not {"service", "path"} & set(update_fields):
+            return
+        current = (instance.service.netloc, instance.path)
+        if previous == current:
+            return
+        locations = [current] + ([previous] if previous else [])
+    WebHookMapping.update_rules(_namespace_mappings(locations))
+
+
+@receiver(post_save, sender=VCSService)
+@receiver(post_delete, sender=VCSService)
+def _services_changed(sender, **kwargs):
+    CacheVersion.bump("relays")
+    CacheVersion.bump("services")
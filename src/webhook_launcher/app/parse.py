@@ -0,0 +1,142 @@
+# Copyright (C) 2017 Jolla Ltd.
+#
+# All rights reserved.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to
+# the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+""" Parsing of webhook payloads with a bounded number of commits """
+
+import json
+import zlib
+from decimal import Decimal
+from StringIO import StringIO
+
+from django.conf import settings
+
+# ijson is optional, prefer its C backend when available
+try:
+    from ijson.backends import yajl2_c as ijson
+except ImportError:
+    try:
+        import ijson
+    except ImportError:
+        ijson = None
+if ijson is not None:
+    from ijson.common import JSONError, ObjectBuilder
+
+# zlib wbits for the supported Content-Encodings. "deflate" should be zlib
+# wrapped but some clients send raw deflate data, which is tried as well.
+_WBITS = {
+    "gzip": (16 + zlib.MAX_WBITS,),
+    "x-gzip": (16 + zlib.MAX_WBITS,),
+    "deflate": (zlib.MAX_WBITS, -zlib.MAX_WBITS),
+}
+
+_START = ("start_map", "start_array")
+_END = ("end_map", "end_array")
+
+
+class PayloadTooLarge(ValueError):
+    pass
+
+
+def decompress(body, encoding, limit):
+    """ Decode a request body with a gzip or deflate Content-Encoding
+
+    :param limit: maximum size of the decoded body
+    :raises PayloadTooLarge: if the decoded body would exceed limit
+    :raises ValueError: on unsupported encodings or corrupt data
+    """
+    encoding = encoding.strip().lower()
+    if encoding in ("", "identity"):
+        return body
+    if encoding not in _WBITS:
+        raise ValueError("unsupported content encoding %s" % encoding)
+    error = None
+    for wbits in _WBITS[encoding]:
+        decoder = zlib.decompressobj(wbits)
+        try:
+            decoded = decoder.decompress(body, limit + 1)
+        except zlib.error as exc:
+            error = exc
+            continue
+        if not decoder.unconsumed_tail:
+            decoded += decoder.flush()
+        if len(decoded) > limit or decoder.unconsumed_tail:
+            raise PayloadTooLarge(
+                "decoded body exceeds %s bytes" % limit
+            )
+        return decoded
+    raise ValueError("invalid %s data: %s" % (encoding, error))
+
+
+def compress(data):
+    """ gzip data for a request with Content-Encoding: gzip """
+    encoder = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return encoder.compress(data) + encoder.flush()
+
+
+def _stream_loads(body, max_commits):
+    """ json.loads() that drops commits past max_commits while parsing """
+    builder = ObjectBuilder()
+    commits = 0
+    skipping = 0
+    for prefix, event, value in ijson.parse(StringIO(body)):
+        if skipping:
+            if event in _START:
+                skipping += 1
+            elif event in _END:
+                skipping -= 1
+            continue
+        if prefix == "commits.item" and max_commits and \
+                event not in _END and event != "map_key":
+            # A new item of the commits list
+            commits += 1
+            if commits > max_commits:
+                if event in _START:
+                    skipping = 1
+                continue
+        if event == "number" and isinstance(value, Decimal):
+            # Floats as json.loads() returns them
+            value = float(value)
+        builder.event(event, value)
+    return builder.value
+
+
+def parse_payload(body):
+    """ Parse a webhook request body
+
+    The "commits" list of Github and Gitlab pushes is truncated to
+    settings.MAX_COMMITS entries, as only the first few are used. Bodies
+    larger than settings.STREAM_PARSE_SIZE are parsed with ijson, when it
+    is installed, so that the dropped commits are never built.
+
+    :raises ValueError: if the body is not valid JSON
+    """
+    max_commits = settings.MAX_COMMITS
+    if ijson is not None and len(body) > settings.STREAM_PARSE_SIZE:
+        if isinstance(body, unicode):
+            body = body.encode("utf-8")
+        try:
+            return _stream_loads(body, max_commits)
+        except JSONError as exc:
+            raise ValueError("invalid JSON payload: %s" % exc)
+
+    data = json.loads(body)
+    if max_commits and isinstance(data, dict) and \
+            isinstance(data.get("commits"), list):
+        del data["commits"][max_commits:]
+    return data
@@ -16,9 +16,8 @@
 # along with this program; if not, write to the
 # Free Software Foundation, Inc.,
 # 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
-from __future__ import print_function
-
 import json
+import logging
 import os
 import urlparse
 
@@ -27,9 +26,12 @@ from django.conf import settings
 from django.contrib.auth.models import User
 from webhook_launcher.app.misc import bbAPIcall
 from webhook_launcher.app.models import (
-    BuildService, Project, RelayTarget, VCSNameSpace, WebHookMapping
+    BuildService, EventPayload, LastSeenRevision, Project, RelayTarget,
+    VCSNameSpace, WebHookMapping
 )
+from webhook_launcher.app.parse import compress, parse_payload
 
+logger = logging.getLogger(__name__)
 
 # TODO: Split handling of commits and tags in generic methods.
 #   Specific payload classes should only handle parsing the commits, branches
@@ -43,8 +45,54 @@ from webhook_launcher.app.models import (
 #   is not ideal.
 
 
-def get_payload(data):
-    """Payload factory function"""
+def load_event(event):
+    """Returns the payload dict of the fields of an incoming event
+
+    With raw ingest the event carries the request body in "raw" and the
+    request GET parameters in its "envelope". The body is parsed here.
+    With the payload store enabled the body is loaded from the
+    EventPayload referred to by "payload_ref". The "coalesced" details of
+    earlier pushes the event replaced are added as "webhook_coalesced".
+
+    :param event: dict with the workitem fields of a single event
+    """
+    if event.get("payload_ref") is not None:
+        data = parse_payload(EventPayload.objects.get(
+            sha256=event["payload_ref"]
+        ).body)
+        if event.get("envelope") is not None:
+            data["webhook_parameters"] = event["envelope"].get(
+                "webhook_parameters", {}
+            )
+    elif event.get("raw") is not None:
+        data = parse_payload(event["raw"])
+        envelope = event.get("envelope") or {}
+        data["webhook_parameters"] = envelope.get("webhook_parameters", {})
+    elif event.get("payload") is not None:
+        data = event["payload"]
+    else:
+        raise RuntimeError("Missing mandatory field: payload")
+    if event.get("coalesced"):
+        # Earlier pushes to the branch this one replaced
+        data["webhook_coalesced"] = event["coalesced"]
+    return data
+
+
+def get_payload(data, payload_type=None):
+    """Payload factory function
+
+    :param data: payload dict
+    :param payload_type: name of the payload class to use, as found by
+        dispatch.dispatch(). The payload type is detected if not given or
+        the payload doesn't parse as that type.
+    """
+    klass = PAYLOAD_TYPES.get(payload_type)
+    if klass is not None:
+        try:
+            return klass(data)
+        except PayloadParsingError as e:
+            logger.warning("Payload is not a %s: %s", payload_type, e)
+
     for klass in [
         GhPush,
         BbPushV2,
@@ -53,7 +101,7 @@ def get_payload(data):
     ]:
         try:
             payload = klass(data)
-            print("Parsed payload as %s" % klass)
+            logger.debug("Parsed payload as %s", klass)
             break
         except PayloadParsingError:
             continue
@@ -68,7 +116,10 @@ class Payload(object):
 
     def __init__(self, data):
         self.url = None
+        self.sshurl = None
         self.data = data
+        # Key of the stored payload when the event came with a payload_ref
+        self.payload_ref = None
         self.params = data.get('webhook_parameters', {})
 
     def create_placeholder(self, repourl, branch, packages=None):
@@ -80,7 +131,7 @@ class Payload(object):
         if not packages:
             packages = [""]
 
-        print("no mappings, create placeholders")
+        logger.info("no mappings, create placeholders")
         mapobjs = []
         user = User.objects.get(id=1)
         obs = BuildService.objects.all()[0]
@@ -97,10 +148,26 @@ class Payload(object):
 
         return mapobjs
 
+    def emails(self):
+        """Returns the emails of the people behind the event"""
+        coalesced = self.data.get("webhook_coalesced") or {}
+        return set(coalesced.get("emails", []))
+
+    def save_payload(self, seenrev):
+        """Records the payload in a LastSeenRevision
+
+        A stored payload is referred to instead of copied.
+        """
+        if self.payload_ref:
+            seenrev.event_id = self.payload_ref
+            seenrev.payload = None
+        else:
+            seenrev.payload = json.dumps(self.data)
+
     def relay(self, relays=None):
 
         if not self.url:
-            print("Trying to relay but Payload has no url, skipping")
+            logger.info("Trying to relay but Payload has no url, skipping")
             return
 
         parsed_url = urlparse.urlparse(self.url)
@@ -113,8 +180,7 @@ class Payload(object):
         official_packages = list(
             set(
                 mapobj.package for mapobj in
-                WebHookMapping.objects.filter(
-                    repourl=self.url,
+                WebHookMapping.for_repo(self.url).filter(
                     project__in=official_projects
                 ).exclude(package="")
             )
@@ -130,10 +196,10 @@ class Payload(object):
                 )
             )
             if not relays:
-                print(
+                logger.info(
                     "This event's netloc path (%s %s) "
-                    "is not in any Relay Target" % (
-                        parsed_url.netloc, service_path)
+                    "is not in any Relay Target",
+                    parsed_url.netloc, service_path
                 )
                 return
 
@@ -148,18 +214,28 @@ class Payload(object):
         payload = self.data
         payload["webhook_parameters"]["packages"] = official_packages
         data = json.dumps(payload)
+        compressed = None
         for relay in relays:
             # TODO: allow uploading self signed certificates
             # and client certificates
-            print("Relaying event from %s to %s" % (self.url, relay))
+            logger.info("Relaying event from %s to %s", self.url, relay)
+            if relay.compress:
+                if compressed is None:
+                    compressed = compress(data)
+                post_data = compressed
+                post_headers = dict(headers, **{'content-encoding': 'gzip'})
+            else:
+                post_data = data
+                post_headers = headers
             response = requests.post(
                 relay.url,
-                data=data,
-                headers=headers,
+                data=post_data,
+                headers=post_headers,
                 proxies=proxies,
                 verify=relay.verify_SSL,
             )
-            if response.status_code != requests.codes.ok:
+            # Webhooks with asynchronous ingest answer 202
+            if not 200 <= response.status_code < 300:
                 raise RuntimeError(
                     "%s returned %s" % (relay, response.status_code)
                 )
@@ -167,9 +243,9 @@ class Payload(object):
     def handle(self):
         if self.data.get('zen', None) and self.data.get('hook_id', None):
             # Github ping event, do nothing
-            print("Github says hi!")
+            logger.info("Github says hi!")
         else:
-            print("unknown payload")
+            logger.warning("unknown payload")
 
 
 class GhPush(Payload):
@@ -189,11 +265,36 @@ class GhPush(Payload):
             except KeyError:
                 raise PayloadParsingError("Not a GhPush payload")
 
-        print("github/gitlab payload")
+        logger.debug("github/gitlab payload")
         if not url.endswith(".git"):
             url = url + ".git"
         self.url = url
 
+    def emails(self):
+        payload = self.data
+        emails = set()
+        if 'head_commit' in payload:
+            # Github
+            try:
+                emails.add(payload["head_commit"]["author"]["email"])
+                emails.add(payload["head_commit"]["committer"]["email"])
+            except KeyError:
+                # do not fail if head_commit does not have "author" or
+                # "committer" info
+                pass
+
+        for commit in payload.get("commits", []):
+            emails.add(commit["author"]["email"])
+            # I assume this is just to limit the amount of emails we get
+            if len(emails) == 2:
+                break
+
+        if "pusher" in payload:
+            emails.add(payload["pusher"]["email"])
+
+        emails.update(super(GhPush, self).emails())
+        return emails
+
     def handle(self):
         payload = self.data
         repourl = self.url
@@ -201,13 +302,13 @@ class GhPush(Payload):
         # github performs one POST per ref (tag/branch) touched
         # even if they are pushed together
         if 'ref' not in payload:
-            print("This payload has no 'ref' in it. Nothing to do.")
+            logger.info("This payload has no 'ref' in it. Nothing to do.")
             return
         refsplit = payload['ref'].split("/", 2)
         if len(refsplit) > 1:
             reftype, refname = refsplit[1:]
         else:
-            print("Couldn't figure out reftype or refname")
+            logger.warning("Couldn't figure out reftype or refname")
             return
 
         if reftype == "tags":
@@ -223,26 +324,26 @@ class GhPush(Payload):
                 # we wouldn't know which project / package to trigger. Instead
                 # try to use the head sha1sum in the lsr and hope that the lsr
                 # was for the same commit and get the branch from there.
-                print("annotated tag on %s" % repourl)
+                logger.info("annotated tag on %s", repourl)
                 branches = []
 
         elif reftype == "heads":
             # commit to branch
             branches = [refname]
         else:
-            print("Couldn't use payload")
+            logger.warning("Couldn't use payload")
             return
 
-        print("Url is %s or maybe %s" % (repourl, self.sshurl))
-        print("Branches %s" % branches)
+        logger.debug("Url is %s or maybe %s", repourl, self.sshurl)
+        logger.debug("Branches %s", branches)
         mapobj = None
         # Look for mappings based on either the canonical url or the ssh one
-        mapobjs = WebHookMapping.objects.filter(
-            repourl__in=[u for u in [repourl, self.sshurl] if u is not None]
-        )
+        mapobjs = WebHookMapping.for_repo(
+            repourl, self.sshurl
+        ).select_related("obs", "user", "lastseenrevision")
         if branches:
             mapobjs = mapobjs.filter(branch__in=branches)
-        print("Mappings %s" % mapobjs)
+        logger.debug("Mappings %s", mapobjs)
 
         zerosha = '0000000000000000000000000000000000000000'
         # action
@@ -259,18 +360,10 @@ class GhPush(Payload):
             # or what the tag is pointing at
             revision = None
             name = None
-            emails = set()
             if 'head_commit' in payload:
                 # Github
                 revision = payload['head_commit']['id']
                 name = payload["pusher"]["name"]
-                try:
-                    emails.add(payload["head_commit"]["author"]["email"])
-                    emails.add(payload["head_commit"]["committer"]["email"])
-                except KeyError:
-                    # do not fail if head_commit does not have "author" or
-                    # "committer" info
-                    pass
             elif 'checkout_sha' in payload:
                 # Gitlab
                 revision = payload['checkout_sha']
@@ -279,21 +372,13 @@ class GhPush(Payload):
                 # Fallback, should not be needed?
                 revision = payload['after']
                 name = payload["user_name"]
-
-            for commit in payload.get("commits", []):
-                emails.add(commit["author"]["email"])
-                # I assume this is just to limit the amount of emails we get
-                if len(emails) == 2:
-                    break
-
-            if "pusher" in payload:
-                emails.add(payload["pusher"]["email"])
+            emails = self.emails()
 
             if not revision:
-                print("No revision. Giving up.")
+                logger.warning("No revision. Giving up.")
                 return
             if not name:
-                print("No name. Giving up.")
+                logger.warning("No name. Giving up.")
                 return
 
             if not len(mapobjs):
@@ -306,60 +391,65 @@ class GhPush(Payload):
                         )
                     )
 
-            notified = False
-            for mapobj in mapobjs:
-                # seenrev is modified in place here and assumed to be
-                # saved later by trigger_build. Note that this doesn't
-                # actually happen all the time (eg when the project is
-                # disabled)
-                seenrev = mapobj.lsr
-                seenrev.payload = json.dumps(payload)
-
-                if emails:
-                    seenrev.emails = json.dumps(list(emails))
-
-                if seenrev.revision != revision:
-                    if branches:
-                        print(
-                            "%s in %s was not seen before, "
-                            "notify it if enabled" % (revision, mapobj.branch)
-                        )
-                        seenrev.revision = revision
-
+            # The mappings share their prefetched rules and LastSeenRevision
+            # changes are written in one query at the end
+            mapobjs = list(mapobjs)
+            WebHookMapping.prefetch(mapobjs)
+            with LastSeenRevision.bulk_save():
+                notified = False
+                for mapobj in mapobjs:
+                    # seenrev is modified in place here and assumed to be
+                    # saved later by trigger_build. Note that this doesn't
+                    # actually happen all the time (eg when the project is
+                    # disabled)
+                    seenrev = mapobj.lsr
+                    self.save_payload(seenrev)
+
+                    if emails:
+                        seenrev.emails = json.dumps(list(emails))
+
+                    if seenrev.revision != revision:
+                        if branches:
+                            logger.info(
+                                "%s in %s was not seen before, "
+                                "notify it if enabled", revision, mapobj.branch
+                            )
+                            seenrev.revision = revision
+
+                        else:
+                            # annotated tag. only continue if we already had a
+                            # mapping with a matching revision
+                            logger.warning(
+                                "LastSeenRevision %s was not the same as for"
+                                " this tag: %s so the branch is unknown and"
+                                " nothing can be triggered.\nTry deleting and"
+                                " re-pushing the branch to set the lsr.\n"
+                                " CAN'T TRIGGER A BUILD",
+                                seenrev.revision, revision
+                            )
+                            continue
                     else:
-                        # annotated tag. only continue if we already had a
-                        # mapping with a matching revision
-                        print(
-                            "LastSeenRevision %s was not the same as for this"
-                            " tag: %s so the branch is unknown and nothing"
-                            " can be triggered.\nTry deleting and re-pushing"
-                            " the branch to set the lsr.\n"
-                            " CAN'T TRIGGER A BUILD" %
-                            (seenrev.revision, revision)
+                        logger.info("This tag matches the last branch pushed "
+                                    "so the branch is known")
+
+                    # notify new branch created or commit in branch
+                    if reftype == "heads":
+                        mapobj.handle_commit(
+                            user=name,
+                            notify=mapobj.notify and not notified,
                         )
-                        continue
-                else:
-                    print("This tag matches the last branch pushed so the"
-                          " branch is known")
+                        notified = True
 
-                # notify new branch created or commit in branch
-                if reftype == "heads":
-                    mapobj.handle_commit(
-                        user=name,
-                        notify=mapobj.notify and not notified,
-                    )
-                    notified = True
-
-                elif reftype == "tags":
-                    print(
-                        "Tag %s for %s in %s/%s, "
-                        "notify and build it if enabled" % (
-                            refname, revision, repourl, mapobj.branch)
-                    )
-                    mapobj.trigger_build(
-                        user=name,
-                        tag=refname,
-                    )
+                    elif reftype == "tags":
+                        logger.info(
+                            "Tag %s for %s in %s/%s, "
+                            "notify and build it if enabled",
+                            refname, revision, repourl, mapobj.branch
+                        )
+                        mapobj.trigger_build(
+                            user=name,
+                            tag=refname,
+                        )
 
 
 class BbPushV2(Payload):
@@ -371,7 +461,7 @@ class BbPushV2(Payload):
         except KeyError as e:
             raise PayloadParsingError("Not a BbPushV2 payload: %s" % e)
 
-        print("bitbucket V2 payload")
+        logger.debug("bitbucket V2 payload")
         self.url = urlparse.urljoin("https://bitbucket.org", path) + '.git'
 
     def handle(self):
@@ -393,7 +483,7 @@ class BbPushV2(Payload):
             elif newref['type'] == 'tag':
                 tags[name] = [hash, set()]
             else:
-                print("Unknown ref type '%s'" % newref['type'])
+                logger.warning("Unknown ref type '%s'", newref['type'])
                 continue
 
         # Find branches for tags
@@ -406,9 +496,9 @@ class BbPushV2(Payload):
 
         # Handle commits in branches
         for branch, (revision, commits) in branches.iteritems():
-            mapobjs = WebHookMapping.objects.filter(
-                repourl=self.url, branch=branch,
-            )
+            mapobjs = WebHookMapping.for_repo(self.url).filter(
+                branch=branch,
+            ).select_related("obs", "user", "lastseenrevision")
             if not len(mapobjs):
                 packages = self.params.get("packages", None)
                 mapobjs = self.create_placeholder(
@@ -427,12 +517,12 @@ class BbPushV2(Payload):
                     seenrev.emails = json.dumps(list(emails))
 
                 if seenrev.revision != revision:
-                    print(
-                        "%s in %s was not seen before, notify it if enabled" %
-                        (revision, branch)
+                    logger.info(
+                        "%s in %s was not seen before, notify it if enabled",
+                        revision, branch
                     )
                     seenrev.revision = revision
-                    seenrev.payload = json.dumps(self.data)
+                    self.save_payload(seenrev)
                     mapobj.handle_commit(
                         user=user,
                         notify=mapobj.notify and not notified,
@@ -442,27 +532,31 @@ class BbPushV2(Payload):
         # Handle tags
         for tag, (revision, branches) in tags.iteritems():
             if not branches:
-                print("No branch found for tag '%s'" % tag)
+                logger.warning("No branch found for tag '%s'", tag)
                 continue
-            mapobjs = WebHookMapping.objects.filter(
-                repourl=self.url, branch__in=branches,
-            )
+            mapobjs = WebHookMapping.for_repo(self.url).filter(
+                branch__in=branches,
+            ).select_related("obs", "user", "lastseenrevision")
             for mapobj in mapobjs:
                 seenrev = mapobj.lsr
                 if seenrev.revision != revision:
-                    print(
-                        "Tag '%s' revision '%s' not seen before, skipping" % (
-                            tag, revision
-                        )
+                    logger.info(
+                        "Tag '%s' revision '%s' not seen before, skipping",
+                        tag, revision
                     )
                     continue
 
-                print(
-                    "%s in %s was seen before, trigger build if enabled" % (
-                        revision, mapobj.branch
-                    )
+                logger.info(
+                    "%s in %s was seen before, trigger build if enabled",
+                    revision, mapobj.branch
                 )
                 mapobj.trigger_build(
                     user=user,
                     tag=tag,
                 )
+
+
+PAYLOAD_TYPES = {
+    "GhPush": GhPush,
+    "BbPushV2": BbPushV2,
+}
@@ -0,0 +1,203 @@
+# Copyright (C) 2017 Jolla Ltd.
+#
+# All rights reserved.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to
+# the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+""" In-process matcher of OBS project names to Project rules """
+
+import logging
+import re
+import threading
+import time
+from collections import defaultdict
+
+from webhook_launcher.app.models import CacheVersion, Project
+
+logger = logging.getLogger(__name__)
+
+# Python 2 re supports at most 100 named groups in a pattern
+CHUNK_SIZE = 99
+
+# Inline flags apply to the whole pattern, so such regexes can't be
+# combined with others
+INLINE_FLAGS = re.compile(r"\(\?[iLmsux]")
+
+
+class _Rules(object):
+    """ Projects of one OBS (or of all of them) indexed for matching
+
+    Exact names are looked up in a dict. The match regexes are combined
+    into alternations of named groups, CHUNK_SIZE at a time, so that a name
+    matching none of them is rejected with one re.match() per chunk.
+    """
+
+    def __init__(self, projects, compiled):
+        self.exact = defaultdict(list)
+        self.chunks = []
+        regexes = []
+        for project in projects:
+            self.exact[project.name].append(project)
+            if project.pk in compiled:
+                regexes.append((project, compiled[project.pk]))
+
+        for start in range(0, len(regexes), CHUNK_SIZE):
+            chunk = regexes[start:start + CHUNK_SIZE]
+            self.chunks.append((self._combine(chunk), chunk))
+
+    @staticmethod
+    def _combine(chunk):
+        if any(
+            regex.groups or INLINE_FLAGS.search(regex.pattern)
+            for _, regex in chunk
+        ):
+            # Groups of their own would shift backreferences
+            return None
+        return re.compile("|".join(
+            "(?P<p%d>%s)" % (i, regex.pattern)
+            for i, (_, regex) in enumerate(chunk)
+        ))
+
+    def matching(self, name):
+        found = list(self.exact.get(name, ()))
+        for combined, chunk in self.chunks:
+            if combined is None:
+                first = 0
+            else:
+                match = combined.match(name)
+                if match is None:
+                    continue
+                # The first alternative that matched; the ones after it
+                # may match too
+                first = int(match.lastgroup[1:])
+                found.append(chunk[first][0])
+                first += 1
+            found.extend(
+                project for project, regex in chunk[first:]
+                if regex.match(name)
+            )
+        if len(found) > 1:
+            found = sorted(set(found), key=lambda project: project.pk)
+        return found
+
+
+class ProjectMatcher(object):
+    """ Project names and match regexes compiled for all projects
+
+    Answers which Projects match an OBS project name, like
+    Project.matches() does for one Project, without loading the Projects
+    for every lookup. The rules are rebuilt when the "projects"
+    CacheVersion changed, which is checked at most every check_interval
+    seconds, or when invalidate() was called after a Project was saved or
+    deleted in this process.
+
+    :param check_interval: seconds between CacheVersion checks
+    """
+
+    def __init__(self, check_interval=0):
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._version = None
+        self._checked_at = 0
+        self._rules = {}
+        self._stats = {
+            "lookups": 0,
+            "reloads": 0,
+        }
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def _load(self):
+        projects = list(Project.objects.select_related("obs").order_by("pk"))
+        by_apiurl = defaultdict(list)
+        compiled = {}
+        for project in projects:
+            by_apiurl[project.obs.apiurl].append(project)
+            if not project.match:
+                continue
+            try:
+                compiled[project.pk] = re.compile(project.match)
+            except re.error as exc:
+                logger.error(
+                    "Ignoring invalid match of project %s: %s",
+                    project.name, exc
+                )
+        rules = dict(
+            (apiurl, _Rules(apiurl_projects, compiled))
+            for apiurl, apiurl_projects in by_apiurl.items()
+        )
+        rules[None] = _Rules(projects, compiled)
+        return rules
+
+    def invalidate(self):
+        """ Rebuild the rules on the next lookup """
+        with self._lock:
+            self._version = None
+            self._checked_at = 0
+
+    def refresh(self, force=False):
+        """ Rebuild the rules if the Projects changed """
+        now = time.time()
+        if not force and now - self._checked_at < self.check_interval:
+            return
+        self._checked_at = now
+        version = CacheVersion.current("projects")
+        if force or version != self._version:
+            self._rules = self._load()
+            self._version = version
+            self._count("reloads")
+
+    def matching(self, name, apiurl=None, refresh=True):
+        """ Returns the Projects matching an OBS project name
+
+        :param name: OBS project name
+        :param apiurl: only match the Projects of the OBS at apiurl
+        :param refresh: False to skip checking for changed Projects, when
+            refresh() was just called
+        :returns: list of Projects ordered by pk
+        """
+        if refresh:
+            self.refresh()
+        self._count("lookups")
+        rules = self._rules.get(apiurl)
+        if rules is None:
+            return []
+        return rules.matching(name)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        rules = self._rules.get(None)
+        stats["names"] = len(rules.exact) if rules else 0
+        stats["chunks"] = len(rules.chunks) if rules else 0
+        return stats
+
+
+_matcher = None
+_matcher_lock = threading.Lock()
+
+
+def get_project_matcher():
+    """ Returns the process wide ProjectMatcher """
+    global _matcher
+    if _matcher is None:
+        with _matcher_lock:
+            if _matcher is None:
+                _matcher = ProjectMatcher()
+    return _matcher
+
@@ -0,0 +1,181 @@
+# Copyright (C) 2017 Jolla Ltd.
+#
+# All rights reserved.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to
+# the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+""" Token bucket rate limiting of webhook events per source """
+
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+from webhook_launcher.app.models import CacheVersion, VCSService
+
+CACHE_PREFIX = "webhook-ratelimit:"
+
+
+class RateLimiter(object):
+    """ Token buckets of events keyed by source
+
+    Every key (eg. "ip:192.0.2.1" or "repo:github.com/org/repo") has a
+    bucket of burst tokens refilled at rate tokens per minute, and an event
+    is admitted if it can take a token. The limits of repositories hosted on
+    a VCSService can be set per service, others use the defaults.
+
+    Buckets live in process memory, or in a shared Django cache when one is
+    given so that all webhook processes share the limits. The buckets in the
+    cache are read and written back without locking, so concurrent events
+    from one key can take the same token and the shared limit is only
+    approximate.
+
+    :param rate: default events per minute, 0 for no limit
+    :param burst: default bucket size
+    :param cache: Django cache alias to keep the buckets in
+    :param check_interval: seconds between checks for VCSService changes
+    :param max_keys: number of buckets after which full ones are pruned,
+        and of keys counted in the stats
+    """
+
+    def __init__(
+        self, rate, burst, cache=None, check_interval=5, max_keys=10000
+    ):
+        self.rate = rate
+        self.burst = burst
+        self.cache = caches[cache] if cache else None
+        self.check_interval = check_interval
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._buckets = {}
+        self._keys = {}
+        self._services = {}
+        self._version = None
+        self._checked_at = 0
+        self._stats = {
+            "admitted": 0,
+            "throttled": 0,
+        }
+
+    def _refresh(self):
+        now = time.time()
+        if now - self._checked_at < self.check_interval:
+            return
+        self._checked_at = now
+        version = CacheVersion.current("services")
+        if version != self._version:
+            self._services = dict(
+                (netloc, (rate, burst)) for netloc, rate, burst in
+                VCSService.objects.filter(
+                    rate_limit__isnull=False
+                ).values_list("netloc", "rate_limit", "rate_burst")
+            )
+            self._version = version
+
+    def limits(self, netloc=None):
+        """ Returns (rate, burst) for events from a VCSService netloc """
+        self._refresh()
+        rate, burst = self._services.get(netloc, (None, None))
+        if rate is None:
+            return self.rate, self.burst
+        return rate, burst or self.burst
+
+    def limited(self):
+        """ Returns True if a default or any VCSService limit is set """
+        self._refresh()
+        return bool(self.rate or self._services)
+
+    @staticmethod
+    def _take(bucket, now, rate, burst):
+        """ Returns the tokens left in a bucket and the seconds to wait """
+        tokens, updated = (bucket or (burst, now))[:2]
+        tokens = min(burst, tokens + (now - updated) * rate / 60.0)
+        if tokens >= 1:
+            return tokens - 1, 0
+        return tokens, (1 - tokens) * 60.0 / rate
+
+    def _prune(self, now):
+        for key, (_, _, full_at) in self._buckets.items():
+            if full_at <= now:
+                del self._buckets[key]
+
+    def _count(self, key, admitted):
+        name = "admitted" if admitted else "throttled"
+        self._stats[name] += 1
+        if key not in self._keys and len(self._keys) >= self.max_keys:
+            self._keys.clear()
+        counts = self._keys.setdefault(key, {"admitted": 0, "throttled": 0})
+        counts[name] += 1
+
+    def admit(self, key, netloc=None):
+        """ Take a token for an event from key
+
+        :param key: source of the event
+        :param netloc: netloc of the VCSService the event comes from
+        :returns: 0 if the event is admitted, otherwise the seconds until
+            the next event from key would be
+        """
+        rate, burst = self.limits(netloc)
+        if not rate:
+            return 0
+        now = time.time()
+        if self.cache is not None:
+            bucket = self.cache.get(CACHE_PREFIX + key)
+            tokens, wait = self._take(bucket, now, rate, burst)
+            # Seconds until the bucket is full again, after which it can be
+            # forgotten
+            refill = (burst - tokens) * 60.0 / rate
+            self.cache.set(
+                CACHE_PREFIX + key, (tokens, now), int(refill) + 1
+            )
+            with self._lock:
+                self._count(key, not wait)
+            return wait
+        with self._lock:
+            tokens, wait = self._take(self._buckets.get(key), now, rate, burst)
+            refill = (burst - tokens) * 60.0 / rate
+            self._buckets[key] = (tokens, now, now + refill)
+            if len(self._buckets) > self.max_keys:
+                self._prune(now)
+            self._count(key, not wait)
+        return wait
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["keys"] = dict(
+                (key, dict(counts)) for key, counts in self._keys.items()
+            )
+        return stats
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter():
+    """ Returns the process wide RateLimiter """
+    global _limiter
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                _limiter = RateLimiter(
+                    settings.RATE_LIMIT,
+                    settings.RATE_BURST,
+                    cache=settings.RATE_LIMIT_CACHE,
+                )
+    return _limiter
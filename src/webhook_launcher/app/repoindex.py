@@ -0,0 +1,128 @@
+# Copyright (C) 2017 Jolla Ltd.
+#
+# All rights reserved.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to
+# the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+""" In-process index of the repositories events are handled for """
+
+import os
+import threading
+import time
+
+from webhook_launcher.app.misc import canonical_repourl
+from webhook_launcher.app.models import (
+    CacheVersion, RelayTarget, WebHookMapping
+)
+
+
+class RepoIndex(object):
+    """ Set of mapped repositories and relayed namespaces
+
+    Repositories are stored as canonical_repourl() values so that any
+    spelling of a repository url matches. The index is rebuilt when the
+    "mappings" or "relays" CacheVersion changed, which is checked at most
+    every check_interval seconds.
+
+    :param check_interval: seconds between CacheVersion checks
+    """
+
+    def __init__(self, check_interval=5):
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._version = None
+        self._checked_at = 0
+        self._repos = frozenset()
+        self._namespaces = frozenset()
+        self._stats = {
+            "mapped": 0,
+            "unmapped": 0,
+            "reloads": 0,
+        }
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def _load(self):
+        repos = frozenset(
+            WebHookMapping.objects.values_list(
+                "canonical_repo", flat=True
+            ).distinct()
+        )
+        namespaces = frozenset(
+            canonical_repourl(netloc + path) for netloc, path in
+            RelayTarget.objects.filter(active=True).values_list(
+                "sources__service__netloc", "sources__path"
+            ).distinct()
+            if netloc
+        )
+        return repos, namespaces
+
+    def refresh(self, force=False):
+        """ Rebuild the index if the models it is built from changed """
+        now = time.time()
+        if not force and now - self._checked_at < self.check_interval:
+            return
+        self._checked_at = now
+        version = (
+            CacheVersion.current("mappings"), CacheVersion.current("relays")
+        )
+        if force or version != self._version:
+            self._repos, self._namespaces = self._load()
+            self._version = version
+            self._count("reloads")
+
+    def contains(self, *repourls):
+        """ Returns True if events of any of the repourls can be handled
+
+        That is, when the repository is mapped or is in a namespace
+        events are relayed from.
+        """
+        self.refresh()
+        for repourl in repourls:
+            if not repourl:
+                continue
+            canonical = canonical_repourl(repourl)
+            if (
+                canonical in self._repos or
+                os.path.dirname(canonical) in self._namespaces
+            ):
+                self._count("mapped")
+                return True
+        self._count("unmapped")
+        return False
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats["repos"] = len(self._repos)
+        stats["namespaces"] = len(self._namespaces)
+        return stats
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_repo_index():
+    """ Returns the process wide RepoIndex """
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = RepoIndex()
+    return _index
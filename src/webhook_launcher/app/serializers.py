@@ -53,6 +53,7 @@ class WebHookMappingSerializer(serializers.ModelSerializer):
     )
     obs = BuildServiceField()
     user = UserField()
+    matched_project = serializers.PrimaryKeyRelatedField(read_only=True)
 
     class Meta:
         model = WebHookMapping
@@ -0,0 +1,271 @@
+# Copyright (C) 2017 Jolla Ltd.
+#
+# All rights reserved.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to
+# the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+""" Durable on-disk spool for events that could not be launched """
+
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+from glob import glob
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class Spool(object):
+    """ Append-only spool of workitem fields
+
+    Records are stored as JSON lines in segment files named after their
+    creation time, so replaying the segments in name order replays the
+    records in the order they were spooled. The segment a process is writing
+    to is flock()ed, which keeps other processes from replaying it until it
+    is rotated or the writer dies.
+
+    Writes are fsync()ed after fsync_batch records or when fsync_interval
+    seconds have passed since the previous fsync, whichever comes first.
+
+    While any segment is left in the directory, by this or another process
+    or from before a restart, the spool has a backlog and new events are
+    spooled behind it to keep the launch order.
+
+    :param path: spool directory
+    :param segment_size: size in bytes after which a segment is rotated
+    :param fsync_batch: maximum number of records written between fsyncs
+    :param fsync_interval: maximum seconds between fsyncs
+    """
+
+    def __init__(
+        self, path, segment_size=16 * 1024 * 1024,
+        fsync_batch=32, fsync_interval=1.0
+    ):
+        self.path = path
+        self.segment_size = segment_size
+        self.fsync_batch = fsync_batch
+        self.fsync_interval = fsync_interval
+        self._lock = threading.Lock()
+        self._pid = None
+        self._segment = None
+        self._seq = 0
+        self._unsynced = 0
+        self._synced_at = 0
+        self._drainer = None
+        self._stats = {
+            "spooled": 0,
+            "replayed": 0,
+            "replay_failed": 0,
+        }
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    def _count(self, name, value=1):
+        with self._lock:
+            self._stats[name] += value
+
+    def _open_segment(self):
+        self._seq += 1
+        name = "segment-%015d-%d-%d.log" % (
+            int(time.time() * 1000), os.getpid(), self._seq
+        )
+        segment = open(os.path.join(self.path, name), "ab")
+        fcntl.flock(segment, fcntl.LOCK_EX)
+        return segment
+
+    def _sync(self):
+        os.fsync(self._segment.fileno())
+        self._unsynced = 0
+        self._synced_at = time.time()
+
+    def _close_segment(self):
+        if self._unsynced:
+            self._sync()
+        fcntl.flock(self._segment, fcntl.LOCK_UN)
+        self._segment.close()
+        self._segment = None
+
+    def append(self, fields):
+        """ Spool workitem fields """
+        line = json.dumps(fields) + "\n"
+        with self._lock:
+            if self._pid != os.getpid():
+                # Don't write to the segment of a parent process
+                self._pid = os.getpid()
+                self._segment = None
+            if self._segment is None:
+                self._segment = self._open_segment()
+            self._segment.write(line)
+            self._segment.flush()
+            self._unsynced += 1
+            self._stats["spooled"] += 1
+            if (
+                self._unsynced >= self.fsync_batch or
+                time.time() - self._synced_at >= self.fsync_interval
+            ):
+                self._sync()
+            if self._segment.tell() >= self.segment_size:
+                self._close_segment()
+
+    def sync(self):
+        """ fsync any records written since the last fsync """
+        with self._lock:
+            if self._segment is not None and self._unsynced and \
+                    self._pid == os.getpid():
+                self._sync()
+
+    @property
+    def backlog(self):
+        """ True while records of any process are waiting in the spool """
+        with self._lock:
+            if self._segment is not None and self._pid == os.getpid():
+                return True
+        return bool(self.segments())
+
+    def segments(self):
+        """ Returns the segment file paths, oldest first """
+        return sorted(glob(os.path.join(self.path, "segment-*.log")))
+
+    @staticmethod
+    def read_offset(segment_path):
+        try:
+            with open(segment_path + ".offset") as offset_file:
+                return int(offset_file.read() or 0)
+        except IOError:
+            return 0
+
+    @staticmethod
+    def _write_offset(segment_path, offset):
+        with open(segment_path + ".offset", "w") as offset_file:
+            offset_file.write(str(offset))
+
+    @staticmethod
+    def records(segment, offset=0):
+        """ Yields (offset after record, line) pairs of a segment file """
+        segment.seek(offset)
+        for line in iter(segment.readline, ""):
+            offset += len(line)
+            yield offset, line
+
+    def drain(self, publish):
+        """ Replay spooled records with publish(fields), oldest first
+
+        Stops at the first record publish() fails on, or at a segment that is
+        still being written by another process. Replayed segments are
+        removed.
+
+        :returns: True if the spool was fully drained
+        """
+        with self._lock:
+            if self._segment is not None and self._pid == os.getpid():
+                self._close_segment()
+
+        for path in self.segments():
+            with open(path, "rb") as segment:
+                try:
+                    fcntl.flock(segment, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except IOError:
+                    # Still open for writing
+                    return False
+                if not os.path.exists(path):
+                    # Replayed by another process meanwhile
+                    continue
+                start = self.read_offset(path)
+                for offset, line in self.records(segment, start):
+                    try:
+                        fields = json.loads(line)
+                    except ValueError:
+                        # Torn write of a writer that died
+                        logger.warning(
+                            "Skipping corrupt record in %s at %s",
+                            path, offset - len(line)
+                        )
+                    else:
+                        try:
+                            publish(fields)
+                        except Exception as exc:
+                            logger.warning(
+                                "Replaying %s failed: %s", path, exc
+                            )
+                            self._count("replay_failed")
+                            return False
+                        self._count("replayed")
+                    self._write_offset(path, offset)
+                os.unlink(path)
+                if os.path.exists(path + ".offset"):
+                    os.unlink(path + ".offset")
+        return True
+
+    def _run_drainer(self, publish, interval):
+        delay = interval
+        while True:
+            time.sleep(delay)
+            self.sync()
+            drained = True
+            if self.backlog:
+                drained = self.drain(publish)
+            # Events spooled behind a backlog while draining are picked up
+            # quickly, a broker that is still down is retried later
+            delay = 1 if drained and self.backlog else interval
+
+    def start_drainer(self, publish, interval=30):
+        """ Replay the spool from a background thread
+
+        The thread retries every interval seconds while publishing fails.
+        """
+        with self._lock:
+            if self._drainer == os.getpid():
+                return
+            self._drainer = os.getpid()
+        thread = threading.Thread(
+            target=self._run_drainer,
+            args=(publish, interval),
+            name="webhook-spool-drainer",
+        )
+        thread.daemon = True
+        thread.start()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats["backlog"] = self.backlog
+        stats["segments"] = len(self.segments())
+        return stats
+
+
+_spool = None
+_spool_lock = threading.Lock()
+
+
+def get_spool():
+    """ Returns the process wide Spool, or None if spooling is disabled """
+    global _spool
+    if not settings.SPOOL_DIR:
+        return None
+    if _spool is None:
+        with _spool_lock:
+            if _spool is None:
+                _spool = Spool(
+                    settings.SPOOL_DIR,
+                    segment_size=settings.SPOOL_SEGMENT_SIZE,
+                    fsync_batch=settings.SPOOL_FSYNC_BATCH,
+                    fsync_interval=settings.SPOOL_FSYNC_INTERVAL,
+                )
+    return _spool
@@ -17,6 +17,7 @@
 # the Free Software Foundation, Inc.,
 # 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 
+import imp
 import json
 import os
 from glob import glob
@@ -49,3 +50,35 @@ def get_obj(name):
         obj = json.loads(get_json(name))
         _DATA_OBJ[name] = obj
     return obj
+
+
+
+def load_participant(name):
+    """ Imports the participant module name from the participants dir """
+    return imp.load_source(name, os.path.join(
+        _DATA_DIR, os.pardir, os.pardir, os.pardir, "participants",
+        "%s.py" % name
+    ))
+
+
+class PostMixin(object):
+    """ TestCase mixin to POST a test payload to the webhook view """
+
+    payload_name = 'payload_gh_push'
+
+    def _post(self, changes=None, **extra):
+        """ POST the payload with the changes applied to its fields
+
+        :param extra: request headers and environment, eg. REMOTE_ADDR
+        """
+        if changes:
+            data = dict(get_obj(self.payload_name), **changes)
+            body = json.dumps(data)
+        else:
+            body = get_json(self.payload_name)
+        return self.client.post(
+            '/webhook/',
+            content_type='application/json',
+            data=body,
+            **extra
+        )
@@ -19,6 +19,8 @@
 
 import json
 
+from mock import patch
+
 from django.contrib.auth.models import User
 from django.test import TestCase
 from webhook_launcher.app.models import (
@@ -121,3 +123,49 @@ class TestWebhookMappingApi(TestCase):
         self.assertEqual(whm.build, TEST_WHM_DATA['build'])
         self.assertEqual(whm.notify, TEST_WHM_DATA['notify'])
 
+
+class TestWebhookMappingStream(TestCase):
+    def setUp(self):
+        user = User.objects.create(username='admin')
+        obs = BuildService.objects.create(
+            namespace='test',
+            apiurl='api.example.com',
+            weburl='build.example.com',
+        )
+        for i in range(7):
+            WebHookMapping.objects.create(
+                repourl="https://example.com/repo%s" % i,
+                project="mer:core" if i % 2 else "nemo:mw",
+                package="package%s" % i, user=user, obs=obs,
+            )
+
+    def _stream(self, **params):
+        params["stream"] = "1"
+        response = self.client.get(
+            '/webhook/api/webhookmappings/', params,
+            HTTP_ACCEPT="application/json",
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return json.loads("".join(response.streaming_content))
+
+    @patch('webhook_launcher.app.views.STREAM_BATCH_SIZE', 3)
+    def test_stream(self):
+        mappings = self._stream()
+        self.assertEqual(
+            [whm["package"] for whm in mappings],
+            ["package%s" % i for i in range(7)]
+        )
+        listed = self.client.get(
+            '/webhook/api/webhookmappings/', {"limit": 3, "offset": 0},
+            HTTP_ACCEPT="application/json",
+        ).json()["results"]
+        self.assertEqual(mappings[:3], listed)
+
+    def test_stream_filtered(self):
+        self.assertEqual(
+            [whm["package"] for whm in self._stream(project="mer:core")],
+            ["package1", "package3", "package5"]
+        )
+        WebHookMapping.objects.all().delete()
+        self.assertEqual(self._stream(), [])
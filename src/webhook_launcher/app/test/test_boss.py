@@ -0,0 +1,97 @@
+# Copyright (C) 2017 Jolla Ltd.
+#
+# All rights reserved.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to
+# the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import os
+import tempfile
+
+from mock import patch
+
+from django.test import SimpleTestCase, override_settings
+from webhook_launcher.app.boss import (
+    LauncherPool, clear_pdef_cache, read_pdef
+)
+
+
+@patch('webhook_launcher.app.boss.Launcher')
+class TestLauncherPool(SimpleTestCase):
+    def test_reuse(self, Launcher):
+        pool = LauncherPool(size=2, amqp_host='localhost')
+        pool.launch('pdef', {'a': 1})
+        pool.launch('pdef', {'a': 2})
+        Launcher.assert_called_once_with(amqp_host='localhost')
+        self.assertEqual(Launcher.return_value.launch.call_count, 2)
+
+    def test_reconnect_on_failure(self, Launcher):
+        pool = LauncherPool(size=1)
+        launcher = Launcher.return_value
+        launcher.launch.side_effect = [IOError("broken pipe"), None]
+        pool.launch('pdef', {})
+        self.assertEqual(Launcher.call_count, 2)
+        launcher.conn.close.assert_called_once()
+        self.assertEqual(launcher.launch.call_count, 2)
+
+    def test_failure_releases_slot(self, Launcher):
+        pool = LauncherPool(size=1, timeout=0)
+        Launcher.return_value.launch.side_effect = IOError("broker down")
+        with self.assertRaises(IOError):
+            pool.launch('pdef', {})
+        Launcher.return_value.launch.side_effect = None
+        pool.launch('pdef', {})
+
+    def test_bounded(self, Launcher):
+        pool = LauncherPool(size=1, timeout=0)
+        pool._get()
+        with self.assertRaises(RuntimeError):
+            pool.launch('pdef', {})
+
+    def test_idle_reconnect(self, Launcher):
+        pool = LauncherPool(size=1, max_idle=-1)
+        pool.launch('pdef', {})
+        pool.launch('pdef', {})
+        self.assertEqual(Launcher.call_count, 2)
+        Launcher.return_value.conn.close.assert_called_once()
+
+
+class TestPdefCache(SimpleTestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        os.write(fd, "first")
+        os.close(fd)
+        clear_pdef_cache()
+
+    def tearDown(self):
+        os.unlink(self.path)
+
+    def _rewrite(self, content):
+        with open(self.path, 'w') as pdef_file:
+            pdef_file.write(content)
+
+    @override_settings(PDEF_CHECK_INTERVAL=0)
+    def test_reload_on_change(self):
+        self.assertEqual(read_pdef(self.path), "first")
+        self._rewrite("second version")
+        self.assertEqual(read_pdef(self.path), "second version")
+
+    @override_settings(PDEF_CHECK_INTERVAL=3600)
+    def test_cached(self):
+        self.assertEqual(read_pdef(self.path), "first")
+        self._rewrite("second version")
+        self.assertEqual(read_pdef(self.path), "first")
+        clear_pdef_cache()
+        self.assertEqual(read_pdef(self.path), "second version")
@@ -0,0 +1,173 @@
+# Copyright (C) 2017 Jolla Ltd.
+#
+# All rights reserved.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to
+# the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import json
+import os
+import shutil
+import tempfile
+
+from mock import patch
+
+from django.test import SimpleTestCase
+from webhook_launcher.app.dedup import (
+    CacheDedupStore, MemoryDedupStore, SQLiteDedupStore, dedup_keys
+)
+
+from .data import get_json, load_participant
+
+
+class TestDedupKeys(SimpleTestCase):
+    def test_keys(self):
+        data = json.loads(get_json('payload_gh_push'))
+        keys = dedup_keys({"delivery": "72d3162e", "payload": data})
+        self.assertEqual(keys[0], "delivery:72d3162e")
+        self.assertTrue(keys[1].startswith("push:"))
+        # Same push from another hook
+        self.assertEqual(
+            dedup_keys({"delivery": "8f4b2c1a", "payload": data})[1:],
+            keys[1:]
+        )
+        # Same push to another hook with different parameters
+        data["webhook_parameters"] = {"packages": ["foo"]}
+        self.assertNotEqual(dedup_keys({"payload": data}), keys[1:])
+        self.assertTrue(dedup_keys({"payload": {"zen": "ok"}})[0].startswith(
+            "payload:"
+        ))
+
+    def test_ref_created(self):
+        data = json.loads(get_json('payload_gh_push'))
+        data.update(ref="refs/tags/v1", before="0" * 40)
+        created = dedup_keys({"delivery": "72d3162e", "payload": data})
+        self.assertEqual(created, ["delivery:72d3162e"])
+        # Deleted and created again
+        self.assertEqual(
+            dedup_keys({"delivery": "8f4b2c1a", "payload": data}),
+            ["delivery:8f4b2c1a"]
+        )
+        data.update(before=data["after"], after="0" * 40)
+        self.assertEqual(
+            dedup_keys({"delivery": "5e3f9d20", "payload": data}),
+            ["delivery:5e3f9d20"]
+        )
+        self.assertTrue(dedup_keys({"payload": data})[0].startswith(
+            "payload:"
+        ))
+
+    def test_body_keys(self):
+        body = get_json('payload_gh_push')
+        event = {"raw": body, "envelope": {
+            "delivery": "72d3162e", "webhook_parameters": {},
+        }}
+        keys = dedup_keys(event)
+        self.assertEqual(keys[0], "delivery:72d3162e")
+        self.assertTrue(keys[1].startswith("payload:"))
+        event["envelope"]["delivery"] = "8f4b2c1a"
+        self.assertEqual(dedup_keys(event)[1:], keys[1:])
+        event["envelope"]["webhook_parameters"] = {"packages": ["foo"]}
+        self.assertNotEqual(dedup_keys(event)[1:], keys[1:])
+        self.assertNotEqual(dedup_keys({"payload_ref": "5e3f"})[0], keys[1])
+
+
+@patch('webhook_launcher.app.payload.EventPayload')
+@patch('webhook_launcher.app.payload.parse_payload')
+class TestDuplicateEvent(SimpleTestCase):
+    """ Duplicates are dropped before their payload is loaded """
+
+    def setUp(self):
+        self.handle_webhook = load_participant("handle_webhook")
+        patcher = patch.object(
+            self.handle_webhook, "get_dedup_store",
+            return_value=MemoryDedupStore(ttl=30)
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = patch.object(self.handle_webhook, "get_payload")
+        self.get_payload = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _handle_twice(self, event):
+        handler = self.handle_webhook.ParticipantHandler()
+        handler.handle_event(dict(event))
+        self.assertEqual(self.get_payload.call_count, 1)
+        handler.handle_event(dict(event, envelope={"delivery": "8f4b2c1a"}))
+        self.assertEqual(self.get_payload.call_count, 1)
+
+    def test_raw(self, parse_payload, EventPayload):
+        parse_payload.return_value = {}
+        self._handle_twice({"raw": get_json('payload_gh_push')})
+        self.assertEqual(parse_payload.call_count, 1)
+        self.assertFalse(EventPayload.mock_calls)
+
+    def test_payload_ref(self, parse_payload, EventPayload):
+        parse_payload.return_value = {}
+        self._handle_twice({
+            "payload_ref": "5e3f", "summary": {
+                "event": "push", "repo": "mer-tools/repo", "ref": None,
+                "after": None,
+            },
+        })
+        self.assertEqual(parse_payload.call_count, 1)
+        self.assertEqual(len(EventPayload.objects.get.mock_calls), 1)
+
+
+@patch('webhook_launcher.app.dedup.time')
+class TestDedupStores(SimpleTestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+
+    def _check_store(self, store, time, other=None):
+        other = other or store
+        time.time.return_value = 1000.0
+        self.assertFalse(store.seen("delivery:a", "push:1"))
+        self.assertTrue(other.seen("delivery:a"))
+        self.assertTrue(other.seen("delivery:b", "push:1"))
+        # Recorded with the duplicate
+        self.assertTrue(store.seen("delivery:b"))
+        time.time.return_value = 1031.0
+        self.assertFalse(other.seen("delivery:a", "push:1"))
+        self.assertFalse(store.seen())
+
+    def test_memory(self, time):
+        store = MemoryDedupStore(ttl=30)
+        self._check_store(store, time)
+        stats = store.stats()
+        self.assertEqual(stats["checked"], 5)
+        self.assertEqual(stats["duplicates"], 3)
+        self.assertEqual(stats["hit_rate"], 0.6)
+        # Expired buckets are dropped
+        time.time.return_value = 1062.0
+        self.assertFalse(store.seen("delivery:c"))
+        self.assertEqual(store.stats()["keys"], 1)
+
+    def test_sqlite(self, time):
+        path = os.path.join(self.path, "dedup.db")
+        self._check_store(
+            SQLiteDedupStore(path, ttl=30), time,
+            other=SQLiteDedupStore(path, ttl=30)
+        )
+
+    def test_cache(self, time):
+        store = CacheDedupStore("default", ttl=30)
+        store.cache.clear()
+        time.time.return_value = 1000.0
+        self.assertFalse(store.seen("delivery:a", "push:1"))
+        self.assertTrue(store.seen("delivery:b", "push:1"))
+        self.assertTrue(store.seen("delivery:b"))
+        self.assertEqual(store.stats()["duplicates"], 2)
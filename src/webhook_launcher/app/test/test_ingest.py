@@ -0,0 +1,551 @@
+# Copyright (C) 2017 Jolla Ltd.
+#
+# All rights reserved.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to
+# the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import Queue
+import json
+import random
+import shutil
+import zlib
+import tempfile
+import threading
+import time
+
+from mock import patch
+
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase, TestCase, override_settings
+from webhook_launcher.app.ingest import Coalescer, EventQueue
+from webhook_launcher.app.misc import (
+    canonical_repourl, handler_participant
+)
+from webhook_launcher.app.models import (
+    BuildService, EventPayload, WebHookMapping
+)
+from webhook_launcher.app.payload import get_payload, load_event
+from webhook_launcher.app.repoindex import RepoIndex
+from webhook_launcher.app.spool import Spool
+
+from .data import PostMixin, get_json, load_participant
+
+
+@patch('webhook_launcher.app.ingest.launch_queue')
+class TestDispatch(PostMixin, TestCase):
+    def test_ping(self, launch_queue):
+        response = self._post(HTTP_X_GITHUB_EVENT='ping')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, 'pong')
+        launch_queue.assert_not_called()
+
+    def test_ignored(self, launch_queue):
+        response = self._post(HTTP_X_GITHUB_EVENT='watch')
+        self.assertEqual(response.status_code, 200)
+        launch_queue.assert_not_called()
+
+    def test_compressed(self, launch_queue):
+        body = get_json('payload_gh_push')
+        gzip = zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        raw_deflate = zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS)
+        for encoding, data in [
+            ('gzip', gzip.compress(body) + gzip.flush()),
+            ('deflate', zlib.compress(body)),
+            ('deflate', raw_deflate.compress(body) + raw_deflate.flush()),
+        ]:
+            response = self.client.post(
+                '/webhook/',
+                content_type='application/json',
+                data=data,
+                HTTP_CONTENT_ENCODING=encoding,
+            )
+            self.assertEqual(response.status_code, 200)
+            fields = launch_queue.call_args[0][0]
+            self.assertEqual(
+                fields['payload']['repository']['name'], 'public-repo'
+            )
+
+        response = self.client.post(
+            '/webhook/',
+            content_type='application/json',
+            data=body,
+            HTTP_CONTENT_ENCODING='gzip',
+        )
+        self.assertEqual(response.status_code, 400)
+
+    @override_settings(MAX_BODY_SIZE=1000)
+    def test_decompression_bomb(self, launch_queue):
+        response = self.client.post(
+            '/webhook/',
+            content_type='application/json',
+            data=zlib.compress('[' + '0,' * 100000 + '0]'),
+            HTTP_CONTENT_ENCODING='deflate',
+        )
+        self.assertEqual(response.status_code, 413)
+        launch_queue.assert_not_called()
+
+    @override_settings(MAX_BODY_SIZE=1000)
+    def test_too_large(self, launch_queue):
+        response = self._post(HTTP_X_GITHUB_EVENT='push')
+        self.assertEqual(response.status_code, 413)
+        launch_queue.assert_not_called()
+
+    def test_routed(self, launch_queue):
+        response = self._post(
+            HTTP_X_GITHUB_EVENT='push',
+            HTTP_X_GITHUB_DELIVERY='72d3162e-cc78-11e3-81ab-4c9367dc0958',
+        )
+        self.assertEqual(response.status_code, 200)
+        fields = launch_queue.call_args[0][0]
+        self.assertEqual(fields['payload_type'], 'GhPush')
+        self.assertEqual(
+            fields['delivery'], '72d3162e-cc78-11e3-81ab-4c9367dc0958'
+        )
+        self.assertEqual(fields['handler'], 'handle_webhook')
+        self._post(HTTP_X_GITLAB_EVENT='System Hook')
+        fields = launch_queue.call_args[0][0]
+        self.assertEqual(fields['payload_type'], 'GhPush')
+        with self.settings(HANDLER_SHARDS=4):
+            self._post(HTTP_X_GITHUB_EVENT='push')
+        fields = launch_queue.call_args[0][0]
+        self.assertEqual(fields['handler'], handler_participant(
+            'https://github.com/baxterthehacker/public-repo', 4
+        ))
+
+
+@override_settings(RAW_INGEST=True)
+@patch('webhook_launcher.app.ingest.launch_queue')
+class TestRawIngest(TestCase):
+    def test_raw(self, launch_queue):
+        body = get_json('payload_gh_push')
+        response = self.client.post(
+            '/webhook/?packages=foo',
+            content_type='application/json',
+            data=body,
+            HTTP_X_GITHUB_EVENT='push',
+            HTTP_X_GITHUB_DELIVERY='72d3162e-cc78-11e3-81ab-4c9367dc0958',
+        )
+        self.assertEqual(response.status_code, 200)
+        fields = launch_queue.call_args[0][0]
+        self.assertEqual(fields['raw'], body)
+        self.assertNotIn('payload', fields)
+        envelope = fields['envelope']
+        self.assertEqual(
+            envelope['delivery'], '72d3162e-cc78-11e3-81ab-4c9367dc0958'
+        )
+        self.assertEqual(envelope['event'], 'push')
+        self.assertEqual(envelope['headers']['HTTP_X_GITHUB_EVENT'], 'push')
+
+        data = load_event(fields)
+        self.assertEqual(data['webhook_parameters'], {'packages': ['foo']})
+        self.assertEqual(data['repository']['name'], 'public-repo')
+
+
+@override_settings(PAYLOAD_STORE=True)
+@patch('webhook_launcher.app.ingest.launch_queue')
+class TestPayloadStore(PostMixin, TestCase):
+    def test_claim_check(self, launch_queue):
+        for raw in [False, True]:
+            with self.settings(RAW_INGEST=raw):
+                response = self._post(HTTP_X_GITHUB_EVENT='push')
+                self.assertEqual(response.status_code, 200)
+            fields = launch_queue.call_args[0][0]
+            self.assertNotIn('payload', fields)
+            self.assertNotIn('raw', fields)
+            self.assertEqual(fields['summary']['event'], 'push')
+            data = load_event(fields)
+            self.assertEqual(data['repository']['name'], 'public-repo')
+            self.assertEqual(data['webhook_parameters'], {})
+        # The raw body and the re-serialized payload differ
+        self.assertEqual(EventPayload.objects.count(), 2)
+        response = self._post(HTTP_X_GITHUB_EVENT='push')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(EventPayload.objects.count(), 2)
+
+
+class Fields(object):
+    """ Workitem fields as attributes """
+
+    def __init__(self, fields):
+        self.__dict__.update(fields)
+
+    def as_dict(self):
+        return dict(self.__dict__)
+
+
+class TestBatchWorkitem(SimpleTestCase):
+    def test_failed_event(self):
+        handle_webhook = load_participant("handle_webhook")
+        relay_webhook = load_participant("relay_webhook")
+        events = [{"n": n} for n in range(3)]
+        wid = type("Workitem", (object,), {})()
+        wid.fields = Fields({"events": events})
+        with patch.object(
+            handle_webhook.ParticipantHandler, "handle_event",
+            side_effect=[None, ValueError("bad payload"), None]
+        ):
+            handle_webhook.ParticipantHandler().handle_wi(wid)
+        self.assertFalse(wid.result)
+        self.assertEqual(wid.fields.events, [{"n": 0}, {"n": 2}])
+        self.assertEqual(wid.fields.failed_events, [
+            {"event": {"n": 1}, "error": "bad payload"},
+        ])
+
+        # Only the handled events are relayed
+        with patch.object(relay_webhook, "load_event", side_effect=dict), \
+                patch.object(relay_webhook, "get_payload") as get_payload:
+            relay_webhook.ParticipantHandler().handle_wi(wid)
+            self.assertEqual(
+                [args[0][0] for args in get_payload.call_args_list],
+                [{"n": 0}, {"n": 2}]
+            )
+        wid.fields = Fields({"events": []})
+        relay_webhook.ParticipantHandler().handle_wi(wid)
+        self.assertTrue(wid.result)
+
+
+@override_settings(ASYNC_INGEST=True, PUBLIC_LANDING_PAGE=True)
+@patch('webhook_launcher.app.ingest.launch_queue')
+class TestAsyncIngest(PostMixin, TestCase):
+    def test_accepted(self, launch_queue):
+        queue = EventQueue(size=10, workers=1)
+        with patch('webhook_launcher.app.ingest._queue', queue):
+            response = self._post()
+            self.assertEqual(response.status_code, 202)
+            queue.join()
+            launch_queue.assert_called_once()
+            fields = launch_queue.call_args[0][0]
+            self.assertEqual(
+                fields['payload']['repository']['name'], 'public-repo'
+            )
+            stats = self.client.get('/webhook/stats/').json()
+            self.assertEqual(stats['ingest']['published'], 1)
+
+    def test_batching(self, launch_queue):
+        queue = EventQueue(size=10, workers=1, batch_size=3, batch_window=5)
+        with patch('webhook_launcher.app.ingest._queue', queue):
+            for _ in range(3):
+                self.assertEqual(self._post().status_code, 202)
+            queue.join()
+            launch_queue.assert_called_once()
+            fields = launch_queue.call_args[0][0]
+            self.assertEqual(len(fields['events']), 3)
+            self.assertIn('payload', fields['events'][0])
+            self.assertEqual(queue.stats()['published'], 3)
+            self.assertEqual(queue.stats()['batches'], 1)
+
+    def test_backpressure(self, launch_queue):
+        release = threading.Event()
+        launch_queue.side_effect = lambda fields: release.wait(10)
+        queue = EventQueue(size=1, workers=1)
+        with patch('webhook_launcher.app.ingest._queue', queue):
+            # First one is taken by the worker, second one fills the queue
+            self.assertEqual(self._post().status_code, 202)
+            while queue.stats()['depth']:
+                time.sleep(0.01)
+            self.assertEqual(self._post().status_code, 202)
+            response = self._post()
+            self.assertEqual(response.status_code, 503)
+            self.assertIn('Retry-After', response)
+            release.set()
+            queue.join()
+            self.assertEqual(queue.stats()['dropped'], 1)
+            self.assertEqual(launch_queue.call_count, 2)
+
+
+class TestSharding(SimpleTestCase):
+    def test_handler_participant(self):
+        self.assertEqual(
+            handler_participant("https://github.com/org/repo", 1),
+            "handle_webhook"
+        )
+        self.assertEqual(handler_participant(None, 4), "handle_webhook")
+        handlers = set(
+            handler_participant("https://github.com/org/repo%s" % i, 4)
+            for i in range(100)
+        )
+        self.assertEqual(handlers, set(
+            "handle_webhook_%s" % shard for shard in range(4)
+        ))
+        self.assertEqual(
+            handler_participant("git@github.com:org/repo.git", 4),
+            handler_participant("https://github.com/org/repo", 4)
+        )
+
+    @patch('webhook_launcher.app.ingest.launch_queue')
+    def test_ordering(self, launch_queue):
+        """ Events of a repository are handled in order by parallel shards
+
+        The engine is replaced by a queue per participant each consumed by
+        its own worker, like the handle_webhook_<n> participants.
+        """
+        shards = 4
+        queues = dict(
+            ("handle_webhook_%s" % shard, Queue.Queue())
+            for shard in range(shards)
+        )
+        handled = dict(
+            ("https://example.com/org/repo%s" % i, []) for i in range(20)
+        )
+        # Launched events with the handler of their workitem, checked here
+        # as the publisher threads catch any exceptions
+        launched = []
+
+        def launch(fields):
+            for event in fields.get("events") or [fields]:
+                launched.append((fields["handler"], event))
+                queues[fields["handler"]].put(event)
+
+        def handle(queue):
+            while True:
+                event = queue.get()
+                if event is None:
+                    return
+                time.sleep(random.random() / 10000)
+                handled[event["payload"]["repo"]].append(
+                    event["payload"]["seq"]
+                )
+
+        launch_queue.side_effect = launch
+        workers = [
+            threading.Thread(target=handle, args=(queue,))
+            for queue in queues.values()
+        ]
+        for worker in workers:
+            worker.start()
+        queue = EventQueue(size=5000, batch_size=8, batch_window=0.001)
+        sent = dict((repo, 0) for repo in handled)
+        for _ in range(2000):
+            repo = random.choice(list(handled))
+            queue.submit({
+                "handler": handler_participant(repo, shards),
+                "payload": {"repo": repo, "seq": sent[repo]},
+            })
+            sent[repo] += 1
+        queue.join()
+        for worker_queue in queues.values():
+            worker_queue.put(None)
+        for worker in workers:
+            worker.join()
+
+        self.assertEqual(len(launched), 2000)
+        for handler, event in launched:
+            self.assertEqual(event["handler"], handler)
+        for repo, seqs in handled.items():
+            self.assertEqual(seqs, range(sent[repo]))
+            self.assertEqual([
+                event["payload"]["seq"] for _, event in launched
+                if event["payload"]["repo"] == repo
+            ], range(sent[repo]))
+        self.assertEqual(queue.stats()["published"], 2000)
+
+
+@patch('webhook_launcher.app.ingest.launch_queue')
+class TestCoalesce(PostMixin, TestCase):
+    def test_coalescer(self, launch_queue):
+        coalescer = Coalescer(window=0.05)
+        key = ("github.com/org/repo", "refs/heads/master", "{}")
+        coalescer.submit(key, {"n": 1}, before="a", emails=["a@example.com"])
+        coalescer.submit(key, {"n": 2}, before="b", emails=["b@example.com"])
+        coalescer.submit(
+            key[:1] + ("refs/heads/devel", "{}"), {"n": 3}, before="c"
+        )
+        # Pushes are no longer pending once the thread started ingesting
+        deadline = time.time() + 5
+        while launch_queue.call_count < 2 and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(launch_queue.call_count, 2)
+        fields = launch_queue.call_args_list[0][0][0]
+        self.assertEqual(fields["n"], 2)
+        self.assertEqual(fields["coalesced"], {
+            "count": 2,
+            "before": "a",
+            "emails": ["a@example.com", "b@example.com"],
+        })
+        self.assertNotIn("coalesced", launch_queue.call_args_list[1][0][0])
+        stats = coalescer.stats()
+        self.assertEqual(stats["held"], 2)
+        self.assertEqual(stats["coalesced"], 1)
+        self.assertEqual(stats["flushed"], 2)
+
+    def test_close(self, launch_queue):
+        coalescer = Coalescer(window=10)
+        key = ("github.com/org/repo", "refs/heads/master", "{}")
+        coalescer.submit(key, {"n": 1})
+        launch_queue.assert_not_called()
+        coalescer.close()
+        launch_queue.assert_called_once_with({"n": 1})
+        self.assertEqual(coalescer.stats()["pending"], 0)
+
+    def test_failed_flush_spooled(self, launch_queue):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        spool = Spool(path)
+        coalescer = Coalescer(window=10)
+        key = ("github.com/org/repo", "refs/heads/master", "{}")
+        coalescer.submit(key, {"n": 1})
+        with patch('webhook_launcher.app.ingest.ingest') as ingest, \
+                patch('webhook_launcher.app.ingest.get_spool') as get_spool:
+            ingest.side_effect = RuntimeError("queue broken")
+            get_spool.return_value = spool
+            coalescer.flush(key[0])
+        replayed = []
+        self.assertTrue(spool.drain(replayed.append))
+        self.assertEqual(replayed, [{"n": 1}])
+        self.assertEqual(coalescer.stats()["spooled"], 1)
+
+    @override_settings(COALESCE_WINDOW=10)
+    def test_tags_not_coalesced(self, launch_queue):
+        coalescer = Coalescer(window=10)
+        with patch('webhook_launcher.app.ingest._coalescer', coalescer):
+            self.assertEqual(self._post(
+                {"before": "1" * 40}, HTTP_X_GITHUB_EVENT='push'
+            ).status_code, 202)
+            self.assertEqual(self._post(
+                {"after": "2" * 40}, HTTP_X_GITHUB_EVENT='push'
+            ).status_code, 202)
+            launch_queue.assert_not_called()
+            # The held push is launched before the tag
+            response = self._post(
+                {"ref": "refs/tags/v1", "base_ref": None},
+                HTTP_X_GITHUB_EVENT='push'
+            )
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(launch_queue.call_count, 2)
+            push, tag = [args[0][0] for args in launch_queue.call_args_list]
+            self.assertEqual(push["payload"]["after"], "2" * 40)
+            self.assertEqual(push["coalesced"]["count"], 2)
+            self.assertEqual(push["coalesced"]["before"], "1" * 40)
+            self.assertEqual(tag["payload"]["ref"], "refs/tags/v1")
+
+            data = load_event(push)
+            self.assertEqual(data["webhook_coalesced"], push["coalesced"])
+            self.assertEqual(
+                get_payload(data).emails(), set(push["coalesced"]["emails"])
+            )
+
+
+class TestSpool(SimpleTestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+
+    def test_replay_in_order(self):
+        spool = Spool(self.path, segment_size=1)
+        for i in range(5):
+            spool.append({"n": i})
+        self.assertEqual(len(spool.segments()), 5)
+        replayed = []
+        self.assertTrue(spool.drain(replayed.append))
+        self.assertEqual([f["n"] for f in replayed], range(5))
+        self.assertEqual(spool.segments(), [])
+        self.assertFalse(spool.backlog)
+
+    def test_shared_backlog(self):
+        # Like another process or a restart using the same directory
+        spool = Spool(self.path)
+        other = Spool(self.path)
+        self.assertFalse(other.backlog)
+        spool.append({"n": 0})
+        self.assertTrue(other.backlog)
+        spool.sync()
+        spool.drain(lambda fields: None)
+        self.assertFalse(other.backlog)
+        self.assertFalse(spool.backlog)
+
+    def test_resume_after_failure(self):
+        spool = Spool(self.path)
+        for i in range(3):
+            spool.append({"n": i})
+        replayed = []
+
+        def publish(fields):
+            if fields["n"] == 1 and not replayed[1:]:
+                replayed.append(None)
+                raise IOError("broker down")
+            replayed.append(fields["n"])
+
+        self.assertFalse(spool.drain(publish))
+        self.assertTrue(spool.backlog)
+        self.assertTrue(spool.drain(publish))
+        self.assertEqual(replayed, [0, None, 1, 2])
+
+
+@patch('webhook_launcher.app.ingest.launch_queue')
+class TestSpoolIngest(PostMixin, TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+
+    def test_broker_down_without_spool(self, launch_queue):
+        launch_queue.side_effect = IOError("broker down")
+        response = self._post()
+        self.assertEqual(response.status_code, 503)
+
+    def test_broker_down(self, launch_queue):
+        spool = Spool(self.path)
+        launch_queue.side_effect = IOError("broker down")
+        with patch('webhook_launcher.app.ingest.get_spool') as get_spool:
+            get_spool.return_value = spool
+            self.assertEqual(self._post().status_code, 202)
+            # Spooled behind the backlog without trying to launch
+            launch_queue.reset_mock()
+            self.assertEqual(self._post().status_code, 202)
+            launch_queue.assert_not_called()
+
+            launch_queue.side_effect = None
+            self.assertTrue(spool.drain(launch_queue))
+            self.assertEqual(launch_queue.call_count, 2)
+            self.assertEqual(self._post().status_code, 200)
+
+
+@override_settings(UNMAPPED_REPOS='drop')
+@patch('webhook_launcher.app.ingest.launch_queue')
+class TestUnmappedRepos(PostMixin, TestCase):
+    def test_canonical_repourl(self, launch_queue):
+        for url in [
+            "https://github.com/baxterthehacker/public-repo",
+            "https://github.com/baxterthehacker/public-repo.git/",
+            "git@github.com:baxterthehacker/public-repo.git",
+            "ssh://git@GitHub.com:22/baxterthehacker/public-repo",
+        ]:
+            self.assertEqual(
+                canonical_repourl(url),
+                "github.com/baxterthehacker/public-repo"
+            )
+
+    def test_drop_unmapped(self, launch_queue):
+        with patch(
+            'webhook_launcher.app.repoindex._index',
+            RepoIndex(check_interval=0)
+        ):
+            response = self._post()
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.content, 'ignored unmapped repository')
+            launch_queue.assert_not_called()
+
+            WebHookMapping.objects.create(
+                repourl="git@github.com:baxterthehacker/public-repo.git",
+                branch="master",
+                user=User.objects.create(username="test"),
+                obs=BuildService.objects.create(
+                    namespace="test",
+                    apiurl="https://example.com",
+                    weburl="https://example.com",
+                ),
+            )
+            self.assertEqual(self._post().status_code, 200)
+            launch_queue.assert_called_once()
@@ -0,0 +1,107 @@
+# Copyright (C) 2017 Jolla Ltd.
+#
+# All rights reserved.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to
+# the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+from mock import patch
+
+from django.test import SimpleTestCase, TestCase, override_settings
+from webhook_launcher.app.ipfilter import IPAllowList
+from webhook_launcher.app.iptrie import IPTrie
+from webhook_launcher.app.models import VCSService
+
+from .data import get_json
+
+GITHUB_HOOKS = [
+    "192.30.252.0/22",
+    "185.199.108.0/22",
+    "140.82.112.0/20",
+    "143.55.64.0/20",
+    "2a0a:a440::/29",
+    "2606:50c0::/32",
+]
+
+
+class TestIPTrie(SimpleTestCase):
+    def test_lookup(self):
+        trie = IPTrie(GITHUB_HOOKS + ["10.1.2.3"])
+        for address in [
+            "192.30.252.1",
+            "192.30.255.255",
+            "140.82.127.1",
+            "10.1.2.3",
+            "::ffff:185.199.110.153",
+            "2a0a:a440::1",
+            "2a0a:a447:ffff::1",
+            "2606:50c0:8000::154",
+        ]:
+            self.assertIn(address, trie)
+        for address in [
+            "192.30.251.255",
+            "192.30.256.1",
+            "10.1.2.4",
+            "2a0a:a448::1",
+            "2606:50c1::1",
+            "::1",
+            "not an address",
+            "",
+        ]:
+            self.assertNotIn(address, trie)
+
+    def test_covering_prefix(self):
+        trie = IPTrie(["10.0.0.0/24", "10.0.0.0/8", "10.1.0.0/16"])
+        self.assertIn("10.200.0.1", trie)
+        self.assertEqual(len(trie), 1)
+        trie = IPTrie(["10.0.0.0/24", "10.0.1.0/24", "10.0.0.0/8"])
+        self.assertEqual(len(trie), 1)
+        trie = IPTrie(["0.0.0.0/0"])
+        self.assertIn("203.0.113.7", trie)
+        self.assertNotIn("2001:db8::1", trie)
+
+    def test_invalid(self):
+        for network in ["10.0.0.0/33", "10.0.0.0/x", "10.0.0", "::/129"]:
+            self.assertRaises(ValueError, IPTrie().add, network)
+
+
+@override_settings(POST_IP_FILTER=True)
+@patch('webhook_launcher.app.ingest.launch_queue')
+class TestPostIPFilter(TestCase):
+    def _post(self, address):
+        return self.client.post(
+            '/webhook/',
+            content_type='application/json',
+            data=get_json('payload_gh_push'),
+            REMOTE_ADDR=address,
+        )
+
+    def test_filter(self, launch_queue):
+        allow_list = IPAllowList(GITHUB_HOOKS, check_interval=0)
+        with patch('webhook_launcher.app.ipfilter._allow_list', allow_list):
+            self.assertEqual(self._post("192.30.252.41").status_code, 200)
+            self.assertEqual(self._post("2606:50c0::1").status_code, 200)
+            self.assertEqual(self._post("198.51.100.1").status_code, 400)
+            self.assertEqual(launch_queue.call_count, 2)
+
+            # ips of a VCS service are picked up without a restart
+            VCSService.objects.create(
+                name="example",
+                netloc="git.example.com",
+                ips="198.51.100.0/24, 2001:db8::1",
+            )
+            self.assertEqual(self._post("198.51.100.1").status_code, 200)
+            self.assertEqual(self._post("2001:db8::1").status_code, 200)
+            self.assertEqual(allow_list.stats()["denied"], 1)
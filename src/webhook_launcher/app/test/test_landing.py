@@ -0,0 +1,130 @@
+# Copyright (C) 2017 Jolla Ltd.
+#
+# All rights reserved.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to
+# the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from webhook_launcher.app.models import (
+    BuildService, Project, WebHookMapping
+)
+
+
+@override_settings(PUBLIC_LANDING_PAGE=True, LANDING_PAGE_SIZE=2)
+class TestLandingData(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="test")
+        obs = BuildService.objects.create(
+            namespace="test",
+            apiurl="https://api.example.com",
+            weburl="https://build.example.com",
+        )
+        Project.objects.create(name="nemo", obs=obs, match="nemo:")
+        for project in ["nemo:a", "nemo:b", "nemo:c"]:
+            for package in ["p2", "p1", "p3"]:
+                WebHookMapping.objects.create(
+                    repourl="https://github.com/%s/%s" % (project, package),
+                    project=project, package=package,
+                    user=self.user, obs=obs,
+                )
+        WebHookMapping.objects.create(
+            repourl="https://github.com/org/personal",
+            project="home:test", package="personal",
+            user=self.user, obs=obs,
+        )
+
+    def _get(self, **params):
+        response = self.client.get('/webhook/landing/data/', params)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def _all(self, key, **params):
+        values = []
+        while True:
+            page = self._get(**params).json()
+            values.extend(row[key] for row in page["results"])
+            if not page["next"]:
+                return values
+            params["after"] = page["next"]
+
+    def test_groups(self):
+        page = self._get().json()
+        self.assertEqual(page["results"][0], {
+            "project": "nemo:a", "packages": 3,
+            "obsweburl": "https://build.example.com",
+        })
+        self.assertEqual(
+            self._all("project"), ["nemo:a", "nemo:b", "nemo:c"]
+        )
+        self.assertEqual(self._all("project", tab="personal"), [])
+        self.client.force_login(self.user)
+        self.assertEqual(
+            self._all("project", tab="personal"),
+            ["home:test", "nemo:a", "nemo:b", "nemo:c"]
+        )
+
+    def test_packages(self):
+        self.assertEqual(
+            self._all("package", project="nemo:b"), ["p1", "p2", "p3"]
+        )
+        row = self._get(project="nemo:b", limit=1).json()["results"][0]
+        self.assertEqual(row["repourl"], "https://github.com/nemo:b/p1")
+        self.assertEqual(row["revision"], "")
+
+    def test_search(self):
+        self.assertEqual(self._all("project", q="NEMO:B"), ["nemo:b"])
+        self.assertEqual(
+            self._get(q="p2").json()["results"][0]["packages"], 1
+        )
+
+    def test_bad_request(self):
+        for params in [
+            {"tab": "other"}, {"limit": "x"}, {"after": "x"},
+            {"project": "nemo:a", "after": "WzFd"},
+        ]:
+            response = self.client.get('/webhook/landing/data/', params)
+            self.assertEqual(response.status_code, 400, params)
+
+    def test_etag(self):
+        response = self._get()
+        etag = response["ETag"]
+        # Revalidating only reads the CacheVersion stamps
+        with self.assertNumQueries(1):
+            response = self.client.get(
+                '/webhook/landing/data/', HTTP_IF_NONE_MATCH=etag
+            )
+        self.assertEqual(response.status_code, 304)
+
+        # A push seen for a mapping changes it
+        lsr = WebHookMapping.objects.get(project="nemo:c", package="p1").lsr
+        lsr.revision = "1" * 40
+        lsr.save()
+        response = self.client.get(
+            '/webhook/landing/data/', HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_cached(self):
+        with CaptureQueriesContext(connection) as first:
+            self._get()
+        with CaptureQueriesContext(connection) as second:
+            self._get()
+        self.assertLess(len(second), len(first))
+        WebHookMapping.objects.filter(project="nemo:a").delete()
+        self.assertEqual(self._all("project"), ["nemo:b", "nemo:c"])
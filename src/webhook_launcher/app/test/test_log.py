@@ -0,0 +1,56 @@
+# Copyright (C) 2017 Jolla Ltd.
+#
+# All rights reserved.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to
+# the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import json
+import logging
+
+from django.test import SimpleTestCase
+from webhook_launcher.app.log import (
+    SUMMARY_FORMAT, JSONFormatter, event_summary
+)
+
+from .data import get_obj
+
+
+class TestLog(SimpleTestCase):
+    def test_event_summary(self):
+        summary = event_summary(
+            get_obj('payload_gh_push'), event='push', size=10
+        )
+        self.assertEqual(summary['repo'], 'baxterthehacker/public-repo')
+        self.assertEqual(summary['ref'], 'refs/heads/changes')
+        self.assertEqual(summary['after'][:7], '0d1a26e')
+
+        summary = event_summary(get_obj('payload_bb_v2_push'))
+        self.assertEqual(summary['repo'], 'keto/test')
+        self.assertEqual(summary['ref'], 'master')
+
+    def test_json_format(self):
+        summary = event_summary(get_obj('payload_gh_push'), size=10)
+        summary['result'] = 'launched'
+        record = logging.LogRecord(
+            'webhook_launcher.app.views', logging.INFO, __file__, 1,
+            SUMMARY_FORMAT, (summary,), None
+        )
+        record.__dict__.update(summary)
+        entry = json.loads(JSONFormatter().format(record))
+        self.assertEqual(entry['level'], 'INFO')
+        self.assertEqual(entry['result'], 'launched')
+        self.assertEqual(entry['size'], 10)
+        self.assertIn('(10 bytes): launched', entry['message'])
@@ -0,0 +1,289 @@
+# Copyright (C) 2017 Jolla Ltd.
+#
+# All rights reserved.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to
+# the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+from StringIO import StringIO
+
+from mock import patch
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from webhook_launcher.app.models import (
+    BuildService, LastSeenRevision, Project, VCSNameSpace, VCSService,
+    WebHookMapping
+)
+from webhook_launcher.app.projectmatcher import get_project_matcher
+
+
+class TestLastSeenRevision(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="test")
+        self.obs = BuildService.objects.create(
+            namespace="test",
+            apiurl="https://api.example.com",
+            weburl="https://build.example.com",
+        )
+        Project.objects.create(name="test", obs=self.obs, official=False)
+
+    def _create(self, count):
+        for i in range(count):
+            WebHookMapping.objects.create(
+                repourl="https://github.com/org/repo%s.git" % i,
+                project="test", package="repo%s" % i,
+                user=self.user, obs=self.obs,
+            )
+
+    def test_created_with_mapping(self):
+        self._create(1)
+        mapobj = WebHookMapping.objects.get()
+        lsr = LastSeenRevision.objects.get()
+        self.assertEqual(lsr.mapping, mapobj)
+        self.assertEqual(mapobj.lsr, lsr)
+        self.assertIsNone(WebHookMapping().lsr)
+
+    def _count_queries(self, url, count):
+        WebHookMapping.objects.all().delete()
+        self._create(count)
+        # The ProjectMatcher is shared, count the queries with a warm one
+        get_project_matcher().refresh()
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(context)
+
+    @override_settings(PUBLIC_LANDING_PAGE=True)
+    def test_list_queries(self):
+        self.client.force_login(self.user)
+        for url in ['/webhook/', '/webhook/api/webhookmappings/']:
+            self.assertEqual(
+                self._count_queries(url, 2), self._count_queries(url, 20)
+            )
+
+    def test_admin_add_with_revision(self):
+        self.user.is_staff = self.user.is_superuser = True
+        self.user.save()
+        self.client.force_login(self.user)
+        response = self.client.post('/webhook/admin/app/webhookmapping/add/', {
+            "repourl": "https://github.com/org/repo.git",
+            "branch": "master",
+            "project": "test",
+            "package": "repo",
+            "build": "on",
+            "obs": self.obs.pk,
+            "lastseenrevision-TOTAL_FORMS": 1,
+            "lastseenrevision-INITIAL_FORMS": 0,
+            "lastseenrevision-MIN_NUM_FORMS": 0,
+            "lastseenrevision-MAX_NUM_FORMS": 1,
+            "lastseenrevision-0-revision": "abc",
+            "lastseenrevision-0-tag": "1.0",
+        })
+        self.assertEqual(response.status_code, 302)
+        lsr = LastSeenRevision.objects.get()
+        self.assertEqual((lsr.revision, lsr.tag), ("abc", "1.0"))
+
+
+class TestCanonicalRepo(TestCase):
+    def setUp(self):
+        user = User.objects.create(username="test")
+        obs = BuildService.objects.create(
+            namespace="test",
+            apiurl="https://api.example.com",
+            weburl="https://build.example.com",
+        )
+        self.mapobj = WebHookMapping.objects.create(
+            repourl="https://github.com/Org/repo.git",
+            project="test", package="repo", user=user, obs=obs,
+        )
+
+    def test_set_on_save(self):
+        self.assertEqual(self.mapobj.canonical_repo, "github.com/Org/repo")
+        self.mapobj.repourl = "https://github.com/Org/other"
+        self.mapobj.save()
+        self.assertEqual(
+            WebHookMapping.objects.get().canonical_repo,
+            "github.com/Org/other"
+        )
+
+    def test_for_repo(self):
+        for repourl in [
+            "https://github.com/Org/repo.git",
+            "https://github.com/Org/repo",
+            "https://GitHub.com/Org/repo/",
+            "git@github.com:Org/repo.git",
+            "ssh://git@github.com:22/Org/repo.git",
+        ]:
+            self.assertEqual(
+                list(WebHookMapping.for_repo(repourl)), [self.mapobj]
+            )
+        self.assertFalse(
+            WebHookMapping.for_repo("https://github.com/Org/repo2").exists()
+        )
+        self.assertFalse(WebHookMapping.for_repo(None).exists())
+
+
+class TestProjectRules(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="test")
+        self.obs = BuildService.objects.create(
+            namespace="test",
+            apiurl="https://api.example.com",
+            weburl="https://build.example.com",
+        )
+        self.project = Project.objects.create(
+            name="nemo", obs=self.obs, match="nemo:"
+        )
+        self.mapobj = WebHookMapping.objects.create(
+            repourl="https://github.com/org/repo.git",
+            project="nemo:mw", package="repo",
+            user=self.user, obs=self.obs,
+        )
+
+    def _rules(self):
+        return WebHookMapping.objects.values_list(
+            *WebHookMapping.RULE_FIELDS
+        ).get()
+
+    def _rules_of(self, mapobj):
+        return WebHookMapping.objects.values_list(
+            *WebHookMapping.RULE_FIELDS
+        ).get(pk=mapobj.pk)
+
+    def test_mapping_saved(self):
+        self.assertEqual(self._rules(), (self.project.pk, True, True, False))
+        self.assertTrue(self.mapobj.project_disabled)
+        self.mapobj.project = "other"
+        self.mapobj.save()
+        self.assertEqual(self._rules(), (None, False, True, False))
+        self.assertFalse(self.mapobj.project_disabled)
+
+    def test_project_changed(self):
+        self.project.allowed = False
+        self.project.save()
+        self.assertEqual(self._rules(), (self.project.pk, False, False, False))
+        self.project.delete()
+        self.assertEqual(self._rules(), (None, False, True, False))
+
+    def test_project_renamed(self):
+        other = WebHookMapping.objects.create(
+            repourl="https://github.com/org/other.git",
+            project="other", package="other",
+            user=self.user, obs=self.obs,
+        )
+        # Only the mappings the Project matches before or after the change
+        # are checked
+        WebHookMapping.objects.filter(pk=other.pk).update(
+            project_official=True
+        )
+        self.project.match = ""
+        self.project.save()
+        self.assertEqual(
+            WebHookMapping.objects.values_list(
+                *WebHookMapping.RULE_FIELDS
+            ).get(pk=self.mapobj.pk),
+            (None, False, True, False)
+        )
+        self.assertTrue(
+            WebHookMapping.objects.get(pk=other.pk).project_official
+        )
+        self.project.name = "other"
+        self.project.save()
+        self.assertEqual(
+            WebHookMapping.objects.get(pk=other.pk).matched_project,
+            self.project
+        )
+
+    def test_namespace_changed(self):
+        service = VCSService.objects.create(name="gh", netloc="github.com")
+        namespace = VCSNameSpace.objects.create(service=service, path="/org")
+        self.assertEqual(self._rules(), (self.project.pk, True, True, True))
+        self.assertFalse(
+            WebHookMapping.objects.get().project_disabled
+        )
+        namespace.delete()
+        self.assertTrue(
+            WebHookMapping.objects.get().project_disabled
+        )
+
+    def test_namespace_scoped(self):
+        service = VCSService.objects.create(name="gh", netloc="github.com")
+        other = WebHookMapping.objects.create(
+            repourl="https://gitlab.com/org/other.git",
+            project="other", package="other",
+            user=self.user, obs=self.obs,
+        )
+        WebHookMapping.objects.filter(pk=other.pk).update(
+            namespace_valid=True
+        )
+        namespace = VCSNameSpace.objects.create(service=service, path="/org")
+        self.assertTrue(
+            WebHookMapping.objects.get(pk=other.pk).namespace_valid
+        )
+        # Moved to another service
+        service.netloc = "gitlab.com"
+        service.save()
+        self.assertEqual(self._rules_of(self.mapobj)[3], False)
+        self.assertEqual(self._rules_of(other)[3], True)
+        WebHookMapping.objects.filter(pk=other.pk).update(
+            namespace_valid=False
+        )
+        # Unrelated changes don't touch the mappings
+        with patch.object(WebHookMapping, "update_rules") as update_rules:
+            service.rate_limit = 10
+            service.save(update_fields=["rate_limit"])
+            service.save()
+            namespace.save()
+            update_rules.assert_not_called()
+        namespace.delete()
+        self.assertEqual(self._rules_of(other)[3], False)
+
+    def test_update_rules(self):
+        WebHookMapping.objects.update(
+            matched_project=None, project_official=False
+        )
+        out = StringIO()
+        call_command("update_project_rules", stdout=out)
+        self.assertEqual(out.getvalue(), "updated 1 mappings\n")
+        self.assertEqual(self._rules(), (self.project.pk, True, True, False))
+        self.assertEqual(WebHookMapping.update_rules(), 0)
+
+    def test_update_rules_queries(self):
+        for i in range(5):
+            WebHookMapping.objects.create(
+                repourl="https://github.com/org/repo%s.git" % i,
+                project="nemo:%s" % i, package="repo%s" % i,
+                user=self.user, obs=self.obs,
+            )
+        # The Projects are checked for changes once, not per project name
+        with self.assertNumQueries(3):
+            self.assertEqual(WebHookMapping.update_rules(), 0)
+
+    @override_settings(PUBLIC_LANDING_PAGE=True)
+    def test_landing_page(self):
+        WebHookMapping.objects.create(
+            repourl="https://github.com/org/other.git",
+            project="other", package="other",
+            user=User.objects.create(username="other"), obs=self.obs,
+        )
+        response = self.client.get('/webhook/landing/data/')
+        self.assertEqual(
+            [group["project"] for group in response.json()["results"]],
+            ["nemo:mw"]
+        )
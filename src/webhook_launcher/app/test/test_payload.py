@@ -17,18 +17,26 @@
 # the Free Software Foundation, Inc.,
 # 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 
+import json
+import zlib
+
 from mock import patch
 
 from django.contrib.auth.models import User
-from django.test import TestCase
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from webhook_launcher.app.models import (
-    BuildService, LastSeenRevision, WebHookMapping
+    BuildService, EventPayload, LastSeenRevision, Project, QueuePeriod,
+    RelayTarget, VCSNameSpace, VCSService, WebHookMapping
 )
+from webhook_launcher.app.parse import parse_payload
 from webhook_launcher.app.payload import (
-    BbPushV2, GhPush, get_payload
+    BbPushV2, GhPush, get_payload, load_event
 )
+from webhook_launcher.app.projectmatcher import get_project_matcher
 
-from .data import get_obj
+from .data import get_json, get_obj
 
 
 class TestPayloadDetection(TestCase):
@@ -40,6 +48,77 @@ class TestPayloadDetection(TestCase):
         p = get_payload(get_obj('payload_gh_push'))
         self.assertIsInstance(p, GhPush)
 
+    def test_payload_type(self):
+        p = get_payload(get_obj('payload_gh_push'), 'GhPush')
+        self.assertIsInstance(p, GhPush)
+        # Wrong type falls back to detection
+        p = get_payload(get_obj('payload_bb_v2_push'), 'GhPush')
+        self.assertIsInstance(p, BbPushV2)
+
+
+@override_settings(MAX_COMMITS=5)
+class TestParsePayload(TestCase):
+    def _body(self):
+        data = get_obj('payload_gh_push')
+        data['ratio'] = 0.5
+        data['commits'] = [
+            dict(data['commits'][0], id="%040x" % i) for i in range(50)
+        ]
+        return json.dumps(data), data
+
+    def test_truncate(self):
+        body, data = self._body()
+        parsed = parse_payload(body)
+        self.assertEqual(len(parsed['commits']), 5)
+        self.assertEqual(parsed['commits'], data['commits'][:5])
+        self.assertEqual(parsed['ratio'], 0.5)
+
+    @override_settings(STREAM_PARSE_SIZE=0)
+    def test_stream(self):
+        body, data = self._body()
+        streamed = parse_payload(body)
+        self.assertEqual(len(streamed['commits']), 5)
+        with self.settings(STREAM_PARSE_SIZE=len(body)):
+            self.assertEqual(streamed, parse_payload(body))
+        self.assertEqual(streamed, parse_payload(body.decode("utf-8")))
+        self.assertRaises(ValueError, parse_payload, body[:-10])
+
+
+@patch('webhook_launcher.app.payload.requests')
+class TestRelay(TestCase):
+    def test_compress(self, requests):
+        requests.post.return_value.status_code = 202
+        namespace = VCSNameSpace.objects.create(
+            service=VCSService.objects.create(
+                name="github", netloc="github.com"
+            ),
+            path="/baxterthehacker",
+        )
+        for name, compress in [("plain", False), ("compressed", True)]:
+            relay = RelayTarget.objects.create(
+                name=name,
+                url="https://%s.example.com/webhook/" % name,
+                compress=compress,
+            )
+            relay.sources.add(namespace)
+
+        data = get_obj('payload_gh_push')
+        data['webhook_parameters'] = {}
+        get_payload(data).relay()
+
+        self.assertEqual(requests.post.call_count, 2)
+        posts = dict(
+            (args[0], kwargs) for args, kwargs in requests.post.call_args_list
+        )
+        plain = posts["https://plain.example.com/webhook/"]
+        self.assertNotIn('content-encoding', plain['headers'])
+        compressed = posts["https://compressed.example.com/webhook/"]
+        self.assertEqual(compressed['headers']['content-encoding'], 'gzip')
+        self.assertEqual(
+            zlib.decompress(compressed['data'], 16 + zlib.MAX_WBITS),
+            plain['data']
+        )
+
 
 @patch('webhook_launcher.app.payload.requests')
 @patch('webhook_launcher.app.payload.bbAPIcall')
@@ -92,6 +171,76 @@ class TestPayloadHandling(TestCase):
         # TODO: Test GH tag push and build trigger
         #   Need to gerate proper test payloads for tags
 
+    def test_stored_payload(self, *mocks):
+        key = EventPayload.store(get_json('payload_gh_push'))
+        self.assertEqual(key, EventPayload.store(get_json('payload_gh_push')))
+        event = {
+            "payload_ref": key,
+            "envelope": {"webhook_parameters": {"packages": ["foo"]}},
+        }
+        data = load_event(event)
+        self.assertEqual(data["webhook_parameters"], {"packages": ["foo"]})
+        payload = get_payload(data)
+        payload.payload_ref = key
+        payload.handle()
+        lsr = LastSeenRevision.objects.get()
+        self.assertIsNone(lsr.payload)
+        self.assertEqual(lsr.event_id, key)
+        self.assertEqual(
+            lsr.payload_data(), json.loads(get_json('payload_gh_push'))
+        )
+
+    def _count_queries(self, mappings, launch_build, launch_notify):
+        WebHookMapping.objects.all().delete()
+        for i in range(mappings):
+            WebHookMapping.objects.create(
+                repourl="https://github.com/baxterthehacker/public-repo.git",
+                branch="changes", project="test:%s" % (i % 3),
+                package="package%s" % i, user=self.user,
+                obs=self.build_Service,
+            )
+        # The ProjectMatcher is shared, count the queries with a warm one
+        get_project_matcher().refresh()
+        queries = []
+        data = json.loads(get_json('payload_gh_push'))
+        for changes in [
+            # New mappings, revision seen before, tag
+            {}, {},
+            {"ref": "refs/tags/1.0", "base_ref": "refs/heads/changes"},
+        ]:
+            data.update(changes)
+            with CaptureQueriesContext(connection) as context:
+                get_payload(data).handle()
+            queries.append(len(context))
+        self.assertEqual(launch_build.call_count, mappings)
+        launch_build.reset_mock()
+        lsr = LastSeenRevision.objects.filter(
+            mapping__package="package0"
+        ).get()
+        self.assertEqual(lsr.tag, "1.0")
+        self.assertTrue(lsr.handled)
+        return queries
+
+    def test_gh_push_queries(self, launch_build, launch_notify, *mocks):
+        service = VCSService.objects.create(
+            name="github", netloc="github.com"
+        )
+        VCSNameSpace.objects.create(service=service, path="/baxterthehacker")
+        for i in range(3):
+            project = Project.objects.create(
+                name="test:%s" % i, obs=self.build_Service
+            )
+        QueuePeriod.objects.create(
+            start_date="2000-01-01", end_date="2000-01-02"
+        ).projects.add(project)
+
+        queries = self._count_queries(2, launch_build, launch_notify)
+        # Doesn't grow with the number of mappings
+        self.assertEqual(
+            self._count_queries(20, launch_build, launch_notify), queries
+        )
+        self.assertLessEqual(max(queries), 10)
+
     def _handle_first_push(
         self, data, launch_build, launch_notify, bbAPIcall, requests
     ):
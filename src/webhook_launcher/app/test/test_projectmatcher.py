@@ -0,0 +1,106 @@
+# Copyright (C) 2017 Jolla Ltd.
+#
+# All rights reserved.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to
+# the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+from django.core.exceptions import MultipleObjectsReturned
+from django.test import TestCase
+from webhook_launcher.app.models import BuildService, Project
+from webhook_launcher.app.projectmatcher import (
+    CHUNK_SIZE, ProjectMatcher
+)
+
+
+class TestProjectMatcher(TestCase):
+    def setUp(self):
+        self.obs = BuildService.objects.create(
+            namespace="test",
+            apiurl="https://api.example.com",
+            weburl="https://build.example.com",
+        )
+        self.other = BuildService.objects.create(
+            namespace="other",
+            apiurl="https://api.example.org",
+            weburl="https://build.example.org",
+        )
+        self.matcher = ProjectMatcher()
+
+    def _names(self, name, apiurl=None):
+        return [
+            project.name for project in self.matcher.matching(name, apiurl)
+        ]
+
+    def test_matching(self):
+        Project.objects.create(name="nemo:mw", obs=self.obs)
+        Project.objects.create(
+            name="nemo:devel", obs=self.obs, match=r"nemo:devel:.*"
+        )
+        Project.objects.create(
+            name="mer:core", obs=self.other, match=r"(mer|sailfish):core"
+        )
+        Project.objects.create(name="any", obs=self.other, match=r"(?i)NEMO")
+        self.assertEqual(self._names("nemo:mw"), ["nemo:mw", "any"])
+        self.assertEqual(
+            self._names("nemo:mw", "https://api.example.com"), ["nemo:mw"]
+        )
+        self.assertEqual(self._names("nemo:devel:mw"), ["nemo:devel", "any"])
+        self.assertEqual(self._names("sailfish:core"), ["mer:core"])
+        self.assertEqual(self._names("mer:core:x"), ["mer:core"])
+        self.assertEqual(self._names("x:nemo"), [])
+        self.assertEqual(self._names("nemo", "https://unknown"), [])
+        for project in Project.objects.all():
+            for name in ["nemo:mw", "nemo:devel:x", "mer:core", "NEMO"]:
+                self.assertEqual(
+                    project.matches(name),
+                    project in self.matcher.matching(name)
+                )
+
+    def test_many_regexes(self):
+        for i in range(CHUNK_SIZE * 2 + 1):
+            Project.objects.create(
+                name="p%s" % i, obs=self.obs, match=r"p%s:" % i
+            )
+        Project.objects.create(name="all", obs=self.obs, match=r"p\d+:")
+        self.assertEqual(self._names("p0:x"), ["p0", "all"])
+        self.assertEqual(self._names("p150:x"), ["p150", "all"])
+        self.assertEqual(self._names("p198"), ["p198"])
+        self.assertEqual(self.matcher.stats()["chunks"], 3)
+
+    def test_invalid_regex(self):
+        Project.objects.create(name="bad", obs=self.obs, match=r"bad(")
+        self.assertEqual(self._names("bad"), ["bad"])
+        self.assertEqual(self._names("bad("), [])
+
+    def test_invalidated(self):
+        self.assertEqual(self._names("nemo:mw"), [])
+        project = Project.objects.create(name="nemo:mw", obs=self.obs)
+        self.assertEqual(self._names("nemo:mw"), ["nemo:mw"])
+        project.name = "nemo:apps"
+        project.save()
+        self.assertEqual(self._names("nemo:mw"), [])
+        project.delete()
+        self.assertEqual(self._names("nemo:apps"), [])
+        self.assertEqual(self.matcher.stats()["reloads"], 4)
+
+    def test_get_matching(self):
+        Project.objects.create(name="nemo:mw", obs=self.obs)
+        self.assertEqual(
+            Project.get_matching("nemo:mw", self.obs.apiurl).name, "nemo:mw"
+        )
+        self.assertIsNone(Project.get_matching("nemo:mw", self.other.apiurl))
+        Project.objects.create(name="nemo", obs=self.obs, match="nemo:")
+        with self.assertRaises(MultipleObjectsReturned):
+            Project.get_matching("nemo:mw", self.obs.apiurl)
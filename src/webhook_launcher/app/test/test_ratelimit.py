@@ -0,0 +1,114 @@
+# Copyright (C) 2017 Jolla Ltd.
+#
+# All rights reserved.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to
+# the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+from mock import patch
+
+from django.test import TestCase, override_settings
+from webhook_launcher.app.models import VCSService
+from webhook_launcher.app.ratelimit import RateLimiter
+
+from .data import get_json
+
+
+class TestRateLimiter(TestCase):
+    @patch('webhook_launcher.app.ratelimit.time')
+    def test_bucket(self, time):
+        time.time.return_value = 1000.0
+        limiter = RateLimiter(rate=60, burst=3)
+        for _ in range(3):
+            self.assertEqual(limiter.admit("ip:192.0.2.1"), 0)
+        self.assertAlmostEqual(limiter.admit("ip:192.0.2.1"), 1.0)
+        # Other sources have their own bucket
+        self.assertEqual(limiter.admit("ip:192.0.2.2"), 0)
+        # One token per second comes back
+        time.time.return_value = 1001.5
+        self.assertEqual(limiter.admit("ip:192.0.2.1"), 0)
+        self.assertAlmostEqual(limiter.admit("ip:192.0.2.1"), 0.5)
+
+        stats = limiter.stats()
+        self.assertEqual(stats["admitted"], 5)
+        self.assertEqual(stats["throttled"], 2)
+        self.assertEqual(
+            stats["keys"]["ip:192.0.2.1"], {"admitted": 4, "throttled": 2}
+        )
+
+    def test_cache_keys_bounded(self):
+        limiter = RateLimiter(rate=60, burst=1, cache="default", max_keys=10)
+        limiter.cache.clear()
+        for i in range(25):
+            self.assertEqual(limiter.admit("ip:192.0.2.%s" % i), 0)
+        self.assertTrue(limiter.admit("ip:192.0.2.24"))
+        self.assertLessEqual(len(limiter.stats()["keys"]), 10)
+        self.assertEqual(limiter.stats()["admitted"], 25)
+
+    def test_service_limits(self):
+        VCSService.objects.create(
+            name="github", netloc="github.com", rate_limit=1, rate_burst=1
+        )
+        limiter = RateLimiter(rate=0, burst=20, check_interval=0)
+        self.assertEqual(limiter.limits("github.com"), (1, 1))
+        self.assertEqual(limiter.limits("gitlab.com"), (0, 20))
+        self.assertEqual(limiter.admit("repo:gitlab.com/a/b", "gitlab.com"), 0)
+        self.assertEqual(limiter.admit("repo:github.com/a/b", "github.com"), 0)
+        self.assertTrue(limiter.admit("repo:github.com/a/b", "github.com"))
+
+
+@patch('webhook_launcher.app.ingest.launch_queue')
+class TestThrottling(TestCase):
+    def _post(self, address):
+        return self.client.post(
+            '/webhook/',
+            content_type='application/json',
+            data=get_json('payload_gh_push'),
+            REMOTE_ADDR=address,
+        )
+
+    def test_repo_limit(self, launch_queue):
+        limiter = RateLimiter(rate=1, burst=2)
+        with patch('webhook_launcher.app.ratelimit._limiter', limiter):
+            self.assertEqual(self._post("192.0.2.1").status_code, 200)
+            self.assertEqual(self._post("192.0.2.2").status_code, 200)
+            response = self._post("192.0.2.3")
+            self.assertEqual(response.status_code, 429)
+            self.assertEqual(response["Retry-After"], "60")
+            self.assertEqual(launch_queue.call_count, 2)
+            stats = limiter.stats()
+            self.assertEqual(
+                stats["keys"]["repo:github.com/baxterthehacker/public-repo"],
+                {"admitted": 2, "throttled": 1}
+            )
+
+    @override_settings(RAW_INGEST=True)
+    def test_raw_ingest_repo_limit(self, launch_queue):
+        # The body is parsed for the repository limits
+        limiter = RateLimiter(rate=1, burst=1)
+        with patch('webhook_launcher.app.ratelimit._limiter', limiter):
+            self.assertEqual([
+                self._post("192.0.2.%s" % i).status_code for i in range(3)
+            ], [200, 429, 429])
+            self.assertIn("raw", launch_queue.call_args[0][0])
+
+        VCSService.objects.create(
+            name="github", netloc="github.com", rate_limit=1, rate_burst=1
+        )
+        limiter = RateLimiter(rate=0, burst=20, check_interval=0)
+        with patch('webhook_launcher.app.ratelimit._limiter', limiter):
+            self.assertEqual([
+                self._post("192.0.2.%s" % i).status_code for i in range(3)
+            ], [200, 429, 429])
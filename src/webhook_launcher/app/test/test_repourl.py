@@ -0,0 +1,115 @@
+# Copyright (C) 2017 Jolla Ltd.
+#
+# All rights reserved.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to
+# the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+import random
+from collections import OrderedDict
+
+from django.test import SimpleTestCase
+from webhook_launcher.app.misc import (
+    LRUCache, canonical_repourl, parse_repourl
+)
+
+HOSTS = ["github.com", "GitLab.example.com", "bitbucket.org", "10.0.0.1"]
+PATHS = ["/org/repo", "/group/sub/repo", "/~user/repo-1.0", "/r"]
+
+
+def variants(rand, host, path):
+    """ Yields (url, scheme) for random ways to write a repository url """
+    for _ in range(20):
+        user = rand.choice(["", "git@", "user:secret@"])
+        suffix = rand.choice(["", ".git", "/", ".git/"])
+        port = rand.choice(["", ":22", ":8443"])
+        scheme = rand.choice(["https", "HTTP", "ssh", "git", None])
+        if scheme is None:
+            # scp like url, which has no port
+            yield "%s%s:%s%s" % (user, host, path[1:], suffix), "git"
+        else:
+            yield "%s://%s%s%s%s%s" % (
+                scheme, user, host, port, path, suffix
+            ), scheme.lower()
+
+
+class TestParseRepourl(SimpleTestCase):
+    def test_corpus(self):
+        rand = random.Random(0)
+        for host in HOSTS:
+            for path in PATHS:
+                for url, scheme in variants(rand, host, path):
+                    parsed = parse_repourl(url)
+                    self.assertEqual(parsed.scheme, scheme, url)
+                    self.assertEqual(parsed.netloc, host, url)
+                    self.assertEqual(
+                        parsed.path.rstrip("/").replace(".git", ""), path,
+                        url
+                    )
+                    self.assertEqual(
+                        parsed.canonical, host.lower() + path, url
+                    )
+                    # the canonical form parses to itself
+                    self.assertEqual(
+                        canonical_repourl(parsed.canonical),
+                        parsed.canonical
+                    )
+
+    def test_immutable(self):
+        parsed = parse_repourl(" https://github.com/org/repo.git\n")
+        self.assertEqual(parsed.path, "/org/repo.git")
+        self.assertIs(parse_repourl(" https://github.com/org/repo.git\n"),
+                      parsed)
+        with self.assertRaises(AttributeError):
+            parsed.netloc = "example.com"
+
+    def test_no_path(self):
+        self.assertEqual(
+            parse_repourl("https://example.com"),
+            ("https", "example.com", "", "example.com")
+        )
+
+
+class TestLRUCache(SimpleTestCase):
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        self.assertEqual(cache.get("a"), 1)
+        cache.put("c", 3)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(cache.get("c"), 3)
+        self.assertEqual(
+            cache.stats(), {"hits": 3, "misses": 1, "items": 2, "size": 2}
+        )
+
+    def test_matches_reference(self):
+        rand = random.Random(0)
+        cache, reference = LRUCache(8), OrderedDict()
+        for i in range(2000):
+            key = rand.randint(0, 20)
+            if rand.random() < 0.5:
+                value = reference.pop(key, None)
+                if value is not None:
+                    reference[key] = value
+                self.assertEqual(cache.get(key), value)
+            else:
+                reference.pop(key, None)
+                reference[key] = i
+                if len(reference) > 8:
+                    reference.popitem(last=False)
+                cache.put(key, i)
+        for key in range(21):
+            self.assertEqual(cache.get(key), reference.get(key))
@@ -32,5 +32,7 @@ urlpatterns = [
     url(r'^api-auth/', include('rest_framework.urls', namespace='rest_framework')),
     url(r'^login/', views.remotelogin_redirect, name='redirect'),
     url(r'^landing/$', views.index, name='index'),
+    url(r'^landing/data/$', views.landing_data, name='landing_data'),
+    url(r'^stats/$', views.stats, name='stats'),
     url(r'^$', views.index, name='index'),
 ]
@@ -19,35 +19,190 @@
 
 """ webhook view """
 
-import json
-import socket
-import struct
-from collections import OrderedDict
-from pprint import pprint
+import logging
+import math
+import time
+import urlparse
+from pprint import pformat
 
 import django_filters
 from django.conf import settings
-from django.db.models import Q
+from django.core.cache import caches
+from django.core.exceptions import RequestDataTooBig
 from django.http import (
     HttpResponse, HttpResponseBadRequest, HttpResponseNotAllowed,
-    HttpResponseRedirect
+    HttpResponseRedirect, JsonResponse, QueryDict, StreamingHttpResponse
 )
 from django.shortcuts import render
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag
 from rest_framework import permissions, status, viewsets
 from rest_framework.decorators import detail_route
 from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
 
-from webhook_launcher.app.boss import launch_queue
-from webhook_launcher.app.models import BuildService, Project, WebHookMapping
+from webhook_launcher.app import landing
+from webhook_launcher.app.dispatch import (
+    IGNORE, PING, delivery_id, dispatch
+)
+from webhook_launcher.app.dispatch import stats as dispatch_stats
+from webhook_launcher.app.ingest import (
+    LAUNCHED, claim_check, coalesce, get_coalescer, get_queue, ingest
+)
+from webhook_launcher.app.ipfilter import get_allow_list
+from webhook_launcher.app.log import SUMMARY_FORMAT, event_summary
+from webhook_launcher.app.misc import (
+    canonical_repourl, handler_participant, repourl_cache_stats
+)
+from webhook_launcher.app.models import BuildService, WebHookMapping
+from webhook_launcher.app.parse import (
+    PayloadTooLarge, decompress, parse_payload
+)
+from webhook_launcher.app.payload import get_payload
+from webhook_launcher.app.projectmatcher import get_project_matcher
+from webhook_launcher.app.ratelimit import get_rate_limiter
+from webhook_launcher.app.repoindex import get_repo_index
 from webhook_launcher.app.serializers import (
     BuildServiceSerializer, WebHookMappingSerializer
 )
+from webhook_launcher.app.spool import get_spool
+
+logger = logging.getLogger(__name__)
+
+# Number of mappings loaded at a time when streaming the API list
+STREAM_BATCH_SIZE = 500
 
 
 def remotelogin_redirect(request):
     return HttpResponseRedirect(settings.LOGIN_REDIRECT_URL)
 
 
+def throttled(wait):
+    """ Returns a 429 response asking to retry after wait seconds """
+    response = HttpResponse("Too many events", status=429)
+    response["Retry-After"] = int(math.ceil(wait))
+    return response
+
+
+def raw_fields(request, body, event, params):
+    """ Returns the fields for launching a request body as is
+
+    The body is forwarded unparsed in "raw" together with an "envelope" of
+    the request details the participants need.
+    """
+    if isinstance(body, str):
+        body = body.decode("utf-8")
+    headers = dict(
+        (key, value) for key, value in request.META.items()
+        if key.startswith("HTTP_X_")
+    )
+    headers["HTTP_USER_AGENT"] = request.META.get("HTTP_USER_AGENT")
+    return {
+        "raw": body,
+        "envelope": {
+            "event": event,
+            "delivery": delivery_id(request.META),
+            "headers": headers,
+            "webhook_parameters": params,
+            "received": time.time(),
+        },
+    }
+
+
+def stats(request):
+    """
+    GET: returns JSON counters of the webhook ingest
+    """
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+    if (
+        not settings.PUBLIC_LANDING_PAGE and
+        not request.user.is_authenticated
+    ):
+        return HttpResponseRedirect(settings.LOGIN_URL)
+
+    counters = {"dispatch": dispatch_stats()}
+    if settings.POST_IP_FILTER:
+        counters["ip_filter"] = get_allow_list().stats()
+    if settings.ASYNC_INGEST:
+        counters["ingest"] = get_queue().stats()
+    spool = get_spool()
+    if spool is not None:
+        counters["spool"] = spool.stats()
+    if settings.UNMAPPED_REPOS != "create":
+        counters["repo_index"] = get_repo_index().stats()
+    counters["rate_limit"] = get_rate_limiter().stats()
+    counters["repourl_cache"] = repourl_cache_stats()
+    counters["project_matcher"] = get_project_matcher().stats()
+    if settings.COALESCE_WINDOW:
+        counters["coalesce"] = get_coalescer().stats()
+    return JsonResponse(counters)
+
+
+def landing_data(request):
+    """
+    GET: returns a page of the landing page data as JSON
+
+    Query parameters:
+      tab: "official" (default) or "personal" mappings
+      q: only mappings with this in the project, package or repourl
+      project: list the packages of this project instead of the projects
+      after: "next" cursor of the previous page
+      limit: page size, LANDING_PAGE_SIZE by default
+
+    The response is {"results": [...], "next": cursor or null}.
+    """
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+    if (
+        not settings.PUBLIC_LANDING_PAGE and
+        not request.user.is_authenticated
+    ):
+        return HttpResponseRedirect(settings.LOGIN_URL)
+
+    tab = request.GET.get("tab", landing.OFFICIAL)
+    if tab not in landing.TABS:
+        return HttpResponseBadRequest("unknown tab %s" % tab)
+    try:
+        limit = int(request.GET.get("limit", settings.LANDING_PAGE_SIZE))
+    except ValueError:
+        return HttpResponseBadRequest("bad limit")
+    limit = max(1, min(limit, settings.LANDING_PAGE_SIZE))
+    project = request.GET.get("project")
+    after = request.GET.get("after")
+
+    queryset = landing.mappings(tab, request.user, request.GET.get("q"))
+    etag = landing.etag(
+        tab, sorted(request.GET.items()), limit,
+        request.user.pk if tab == landing.PERSONAL else None
+    )
+    response = get_conditional_response(request, etag=quote_etag(etag))
+    if response is not None:
+        return response
+
+    # The official mappings are the same for everybody
+    cache = caches[settings.LANDING_CACHE]
+    key = "webhook-landing:%s" % etag
+    content = cache.get(key) if tab == landing.OFFICIAL else None
+    if content is None:
+        try:
+            if project is None:
+                page = landing.groups(queryset, after, limit)
+            else:
+                page = landing.packages(queryset, project, after, limit)
+        except ValueError as exc:
+            return HttpResponseBadRequest(str(exc))
+        content = JsonResponse(page).content
+        if tab == landing.OFFICIAL:
+            cache.set(key, content, settings.LANDING_CACHE_TIMEOUT)
+
+    response = HttpResponse(content, content_type="application/json")
+    response["ETag"] = quote_etag(etag)
+    # Clients revalidate with the ETag before using a stored page
+    patch_cache_control(response, no_cache=True)
+    return response
+
+
 def index(request):
     """
     GET: returns 403
@@ -62,107 +217,163 @@ def index(request):
         ):
             return HttpResponseRedirect(settings.LOGIN_URL)
 
-        # Get all the webhook project names
-        all_wh_project_names = list(WebHookMapping.objects.exclude(
-            package="").values_list("project", flat=True).distinct())
-
-        # and all the official Project objects
-        official_Projects = set(
-            Project.objects.filter(official=True, allowed=True)
-        )
-
-        # And create a set of project names that match a project
-        official_wh_project_names = set()
-
-        def collect_pname(P1, pname1):
-                if P1.matches(pname1):
-                    official_wh_project_names.add(pname1)
-                    return True
-                return False
-        for P in official_Projects:
-            # re-create the list so we only check names we haven't
-            # collected next time round
-            all_wh_project_names = [pname for pname in all_wh_project_names
-                                    if not collect_pname(P, pname)]
-
-        # Get all the webhooks for official Projects and the logged in
-        # user (sorted by project to make it look nice)
-        maps = WebHookMapping.objects.exclude(package="").filter(
-            Q(project__in=official_wh_project_names) | Q(user=request.user)
-        ).order_by("project").prefetch_related("obs", "lastseenrevision_set")
-
-        # and create an ordered collection of project names pointing
-        # to a data structures to be used by the template
-        # FYI: A profile of this code showed ~0.1 sec to this point and
-        # 8 seconds in the following loop.
-        mappings = OrderedDict()
-        for mapobj in maps:
-            if mapobj.project not in mappings:
-                mappings[mapobj.project] = {
-                    "personal": mapobj.user.pk == request.user.pk,
-                    "official": mapobj.project in official_wh_project_names,
-                    "obsweburl": mapobj.obs.weburl,
-                    "packages": []
-                }
-
-            mappings[mapobj.project]["packages"].append(mapobj.to_fields())
-
-        return render(
-            request, 'app/index.html', {'mappings': mappings}
-        )
+        # The mappings are loaded by the page from landing_data()
+        return render(request, 'app/index.html')
 
     elif request.method == 'POST':
-        # TODO: Move to database ip filter list
+        # If behind a rev-proxy then use XFF header
+        if settings.POST_IP_FILTER_HAS_REV_PROXY:
+            # Take the last value only to avoid spoofing
+            ip = request.META.get(
+                "HTTP_X_FORWARDED_FOR", ""
+            ).split(",")[-1].strip()
+            logger.debug(
+                "Using %s as IP from HTTP_X_FORWARDED_FOR: %s",
+                ip, request.META.get("HTTP_X_FORWARDED_FOR")
+            )
+        else:
+            ip = request.META.get("REMOTE_ADDR", "")
+
         # Use the ip_filter to decide whether to accept a post
-        if settings.POST_IP_FILTER:
-            # If behind a rev-proxy then use XFF header
-            if settings.POST_IP_FILTER_HAS_REV_PROXY:
-                # Take the last value only to avoid spoofing
-                ip = request.META["HTTP_X_FORWARDED_FOR"].split(",")[-1]
-                print "Using %s as IP from HTTP_X_FORWARDED_FOR: %s" % (
-                    ip, request.META["HTTP_X_FORWARDED_FOR"]
+        if settings.POST_IP_FILTER and not get_allow_list().allows(ip):
+            logger.warning("POST from %s not in settings.post_ip_filter", ip)
+            return HttpResponseBadRequest()
+
+        wait = get_rate_limiter().admit("ip:%s" % ip)
+        if wait:
+            logger.warning("Throttling POSTs from %s", ip)
+            return throttled(wait)
+
+        # Reject oversized bodies before reading them
+        try:
+            length = int(request.META.get("CONTENT_LENGTH") or 0)
+        except ValueError:
+            length = 0
+        if length > settings.MAX_BODY_SIZE:
+            logger.warning("POST of %s bytes exceeds max_body_size", length)
+            return HttpResponse("Payload too large", status=413)
+
+        event, route = dispatch(request.META)
+        if route == PING:
+            logger.info("Ping (%s) received", event)
+            return HttpResponse("pong")
+        elif route == IGNORE:
+            logger.info("Ignoring unsupported event %s", event)
+            return HttpResponse("ignored %s event" % event)
+
+        ctype = request.META.get("CONTENT_TYPE", None)
+        encoding = request.META.get("HTTP_CONTENT_ENCODING", "")
+        try:
+            if ctype == "application/json":
+                payload = decompress(
+                    request.body, encoding, settings.MAX_BODY_SIZE
                 )
+            elif ctype == "application/x-www-form-urlencoded":
+                if encoding:
+                    form = QueryDict(decompress(
+                        request.body, encoding, settings.MAX_BODY_SIZE
+                    ), encoding=request.encoding)
+                else:
+                    form = request.POST
+                payload = form.get("payload", None)
             else:
-                ip = request.META["REMOTE_IP"]
-            ipaddr = struct.unpack('<L', socket.inet_aton(ip))[0]
-            ip_ok = False
-            for netmask in settings.NETMASKS:
-                if ipaddr & netmask == netmask:
-                    ip_ok = True
-                    break
-            if not ip_ok:
-                print "POST from %s not in settings.post_ip_filter" % (ip,)
+                logger.warning("POST with unknown content type %s", ctype)
                 return HttpResponseBadRequest()
-
-        ctype = request.META.get("CONTENT_TYPE", None)
-        if ctype == "application/json":
-            payload = request.body
-        elif ctype == "application/x-www-form-urlencoded":
-            payload = request.POST.get("payload", None)
-        else:
-            print "POST with unknown content type %s" % (ctype)
+        except (RequestDataTooBig, PayloadTooLarge):
+            logger.warning("POST exceeds max_body_size")
+            return HttpResponse("Payload too large", status=413)
+        except ValueError as e:
+            logger.warning("POST with invalid body encoding: %s", e)
             return HttpResponseBadRequest()
 
-        try:
-            data = json.loads(payload)
-            # merge in GET params
-            get = {}
-            for key, values in request.GET.lists():
-                get[key] = values
-            data['webhook_parameters'] = get
-
-            print "Payload to launch:"
-            pprint(data, indent=2, width=80, depth=6)
-            launch_queue({"payload": data})
-            print "launched"
-
-        except Exception as e:
-            print e
-            print "POST with invalid payload from %s" % \
-                request.META.get("REMOTE_HOST", None)
+        if payload is None:
+            logger.warning("POST without payload")
             return HttpResponseBadRequest()
 
-        return HttpResponse()
+        # merge in GET params
+        get = {}
+        for key, values in request.GET.lists():
+            get[key] = values
+
+        # With raw ingest the body is only parsed when it's needed here
+        data = None
+        if (
+            not settings.RAW_INGEST or
+            settings.UNMAPPED_REPOS != "create" or
+            settings.HANDLER_SHARDS > 1 or
+            settings.COALESCE_WINDOW or
+            get_rate_limiter().limited()
+        ):
+            try:
+                data = parse_payload(payload)
+                data['webhook_parameters'] = get
+            except Exception as e:
+                logger.warning(
+                    "POST with invalid payload from %s: %s",
+                    request.META.get("REMOTE_HOST", None), e
+                )
+                return HttpResponseBadRequest()
+
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(
+                    "Payload to launch:\n%s",
+                    pformat(data, indent=2, width=80, depth=6)
+                )
+        summary = event_summary(data or {}, event=event, size=len(payload))
+
+        parsed = None if data is None else get_payload(data, route)
+        if parsed is not None and parsed.url:
+            wait = get_rate_limiter().admit(
+                "repo:%s" % canonical_repourl(parsed.url),
+                netloc=urlparse.urlparse(parsed.url).netloc,
+            )
+            if wait:
+                summary["result"] = "throttled"
+                logger.warning(SUMMARY_FORMAT, summary, extra=summary)
+                return throttled(wait)
+
+        if settings.UNMAPPED_REPOS != "create":
+            mapped = get_repo_index().contains(parsed.url, parsed.sshurl)
+            if not mapped and parsed.url and \
+                    settings.UNMAPPED_REPOS == "drop":
+                summary["result"] = "unmapped"
+                logger.info(SUMMARY_FORMAT, summary, extra=summary)
+                return HttpResponse("ignored unmapped repository")
+
+        if settings.RAW_INGEST:
+            try:
+                fields = raw_fields(request, payload, event, get)
+            except UnicodeDecodeError as e:
+                logger.warning("POST with invalid payload encoding: %s", e)
+                return HttpResponseBadRequest()
+        else:
+            fields = {"payload": data}
+            delivery = delivery_id(request.META)
+            if delivery:
+                fields["delivery"] = delivery
+        if route:
+            fields["payload_type"] = route
+        if parsed is not None:
+            fields["handler"] = handler_participant(
+                parsed.url or parsed.sshurl, settings.HANDLER_SHARDS
+            )
+        if settings.PAYLOAD_STORE:
+            fields = claim_check(fields, summary)
+        if settings.COALESCE_WINDOW and parsed is not None and parsed.url:
+            result = coalesce(fields, parsed)
+        else:
+            result = ingest(fields)
+        summary["result"] = result or "rejected"
+        logger.info(SUMMARY_FORMAT, summary, extra=summary)
+        if result is None:
+            response = HttpResponse(
+                "Event could not be launched", status=503
+            )
+            response["Retry-After"] = settings.INGEST_RETRY_AFTER
+            return response
+        if result == LAUNCHED:
+            return HttpResponse()
+        return HttpResponse(status=202)
 
     else:
         return HttpResponseNotAllowed(['GET', 'POST'])
@@ -184,7 +395,9 @@ class WebHookMappingFilter(django_filters.FilterSet):
 
 
 class WebHookMappingViewSet(viewsets.ModelViewSet):
-    queryset = WebHookMapping.objects.select_related("obs").exclude(package="")
+    queryset = WebHookMapping.objects.select_related(
+        "obs", "user", "lastseenrevision"
+    ).exclude(package="")
     serializer_class = WebHookMappingSerializer
     permission_classes = (permissions.IsAuthenticatedOrReadOnly,)
     filter_class = WebHookMappingFilter
@@ -193,6 +406,44 @@ class WebHookMappingViewSet(viewsets.ModelViewSet):
         obj.user = self.request.user
         obj.placeholder = False
 
+    def list(self, request, *args, **kwargs):
+        if (
+            request.query_params.get("stream") and
+            request.accepted_renderer.format == "json"
+        ):
+            return StreamingHttpResponse(
+                self.stream(self.filter_queryset(self.get_queryset())),
+                content_type="application/json",
+            )
+        return super(WebHookMappingViewSet, self).list(
+            request, *args, **kwargs
+        )
+
+    def stream(self, queryset):
+        """ Yields all the mappings in queryset as a JSON list
+
+        The mappings are loaded and serialized STREAM_BATCH_SIZE at a time,
+        in pk order, so that memory use doesn't grow with their number.
+        """
+        queryset = queryset.order_by("pk")
+        # Encoded like the JSONRenderer does by default
+        encoder = JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+        last = None
+        yield "["
+        while True:
+            batch = queryset
+            if last is not None:
+                batch = batch.filter(pk__gt=last)
+            batch = list(batch[:STREAM_BATCH_SIZE])
+            if not batch:
+                break
+            data = self.get_serializer(batch, many=True).data
+            yield ("," if last is not None else "") + ",".join(
+                encoder.encode(item) for item in data
+            ).encode("utf-8")
+            last = batch[-1].pk
+        yield "]"
+
     def create(self, request, **kwargs):
         user = request.data.get('user', None)
         if user is None:
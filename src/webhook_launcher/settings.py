@@ -19,8 +19,6 @@
 
 import ConfigParser
 import os
-import socket
-import struct
 import warnings
 
 PROJECT_DIR = os.path.dirname(__file__)
@@ -66,25 +64,200 @@ if config.has_option('web', 'only_known_services'):
 # IP filtering for POST
 POST_IP_FILTER = False
 POST_IP_FILTER_HAS_REV_PROXY = False
-NETMASKS = []
+POST_IP_FILTER_NETWORKS = []
 if config.has_option('web', 'post_ip_filter'):
     POST_IP_FILTER = True
     if config.has_option('web', 'post_ip_filter_has_rev_proxy'):
         POST_IP_FILTER_HAS_REV_PROXY = True
-    # http://stackoverflow.com/questions/819355/how-can-i-check-if-an-ip-is-in-a-network-in-python
-    # settings.post_ip_filter should be a list of IPs or CIDR (eg
-    # 10.0.0.0/24)
-    for ip in config.get('web', 'post_ip_filter').split(","):
-        ip = ip.strip()
-        if "/" in ip:
-            ip, bits = ip.split('/')
-            bits = int(bits)
-        else:
-            bits = 32
-        NETMASKS.append(
-            struct.unpack('<L', socket.inet_aton(ip))[0] &
-            ((2 << bits - 1) - 1)
-        )
+    # settings.post_ip_filter should be a list of IPv4 or IPv6 addresses or
+    # CIDR networks (eg 10.0.0.0/24). The ips of the VCSServices are
+    # accepted as well.
+    POST_IP_FILTER_NETWORKS = [
+        ip.strip() for ip in config.get('web', 'post_ip_filter').split(",")
+        if ip.strip()
+    ]
+
+# Asynchronous ingest: POSTs are acknowledged with 202 once queued and
+# launched to BOSS by background threads
+ASYNC_INGEST = False
+if config.has_option('web', 'async_ingest'):
+    ASYNC_INGEST = config.getboolean('web', 'async_ingest')
+INGEST_QUEUE_SIZE = 1000
+if config.has_option('web', 'ingest_queue_size'):
+    INGEST_QUEUE_SIZE = config.getint('web', 'ingest_queue_size')
+INGEST_WORKERS = 2
+if config.has_option('web', 'ingest_workers'):
+    INGEST_WORKERS = config.getint('web', 'ingest_workers')
+INGEST_RETRY_AFTER = 30
+if config.has_option('web', 'ingest_retry_after'):
+    INGEST_RETRY_AFTER = config.getint('web', 'ingest_retry_after')
+# Queued events can be launched in batches of up to INGEST_BATCH_SIZE events
+# arriving within INGEST_BATCH_WINDOW seconds
+INGEST_BATCH_SIZE = 1
+if config.has_option('web', 'ingest_batch_size'):
+    INGEST_BATCH_SIZE = config.getint('web', 'ingest_batch_size')
+INGEST_BATCH_WINDOW = 0.5
+if config.has_option('web', 'ingest_batch_window'):
+    INGEST_BATCH_WINDOW = config.getfloat('web', 'ingest_batch_window')
+
+# Events that can't be launched (broker down or ingest queue full) are
+# spooled to disk and replayed in order when launching works again
+SPOOL_DIR = None
+if config.has_option('web', 'spool_dir'):
+    SPOOL_DIR = config.get('web', 'spool_dir')
+SPOOL_SEGMENT_SIZE = 16 * 1024 * 1024
+if config.has_option('web', 'spool_segment_size'):
+    SPOOL_SEGMENT_SIZE = config.getint('web', 'spool_segment_size')
+SPOOL_FSYNC_BATCH = 32
+if config.has_option('web', 'spool_fsync_batch'):
+    SPOOL_FSYNC_BATCH = config.getint('web', 'spool_fsync_batch')
+SPOOL_FSYNC_INTERVAL = 1.0
+if config.has_option('web', 'spool_fsync_interval'):
+    SPOOL_FSYNC_INTERVAL = config.getfloat('web', 'spool_fsync_interval')
+SPOOL_DRAIN_INTERVAL = 30
+if config.has_option('web', 'spool_drain_interval'):
+    SPOOL_DRAIN_INTERVAL = config.getint('web', 'spool_drain_interval')
+
+# POSTs with bodies larger than MAX_BODY_SIZE bytes are rejected. Only the
+# first MAX_COMMITS commits of a push are kept (0 keeps all of them) and
+# bodies over STREAM_PARSE_SIZE bytes are parsed incrementally with ijson,
+# if it is installed, to never build the dropped ones.
+MAX_BODY_SIZE = 25 * 1024 * 1024
+if config.has_option('web', 'max_body_size'):
+    MAX_BODY_SIZE = config.getint('web', 'max_body_size')
+DATA_UPLOAD_MAX_MEMORY_SIZE = MAX_BODY_SIZE
+MAX_COMMITS = 20
+if config.has_option('web', 'max_commits'):
+    MAX_COMMITS = config.getint('web', 'max_commits')
+STREAM_PARSE_SIZE = 1024 * 1024
+if config.has_option('web', 'stream_parse_size'):
+    STREAM_PARSE_SIZE = config.getint('web', 'stream_parse_size')
+
+# Caches shared between processes are added below when configured
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+}
+
+# Token bucket rate limits of POSTs per client IP and per repository, in
+# events per minute (0 disables) and events allowed in a burst. Limits for
+# repositories can be set per VCSService. With rate_limit_cache the buckets
+# are kept in memcached and shared between processes.
+RATE_LIMIT = 0
+if config.has_option('web', 'rate_limit'):
+    RATE_LIMIT = config.getint('web', 'rate_limit')
+RATE_BURST = 20
+if config.has_option('web', 'rate_burst'):
+    RATE_BURST = config.getint('web', 'rate_burst')
+RATE_LIMIT_CACHE = None
+if config.has_option('web', 'rate_limit_cache'):
+    RATE_LIMIT_CACHE = 'ratelimit'
+    CACHES['ratelimit'] = {
+        'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+        'LOCATION': config.get('web', 'rate_limit_cache'),
+    }
+
+# Events seen within DEDUP_TTL seconds are not handled again. The seen
+# events are remembered per process, in the SQLite database DEDUP_DB shared
+# by the processes of a node, or with dedup_cache in memcached shared
+# between nodes.
+DEDUP_TTL = 30
+if config.has_option('web', 'dedup_ttl'):
+    DEDUP_TTL = config.getint('web', 'dedup_ttl')
+DEDUP_DB = None
+if config.has_option('web', 'dedup_db'):
+    DEDUP_DB = config.get('web', 'dedup_db')
+DEDUP_CACHE = None
+if config.has_option('web', 'dedup_cache'):
+    DEDUP_CACHE = 'dedup'
+    CACHES['dedup'] = {
+        'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+        'LOCATION': config.get('web', 'dedup_cache'),
+    }
+
+# The landing page loads its data in pages of LANDING_PAGE_SIZE projects or
+# packages. Pages of the official mappings are cached for
+# LANDING_CACHE_TIMEOUT seconds, or until the mappings change, in process
+# memory or with landing_cache in memcached shared between processes.
+LANDING_PAGE_SIZE = 100
+if config.has_option('web', 'landing_page_size'):
+    LANDING_PAGE_SIZE = config.getint('web', 'landing_page_size')
+LANDING_CACHE_TIMEOUT = 300
+if config.has_option('web', 'landing_cache_timeout'):
+    LANDING_CACHE_TIMEOUT = config.getint('web', 'landing_cache_timeout')
+LANDING_CACHE = 'default'
+if config.has_option('web', 'landing_cache'):
+    LANDING_CACHE = 'landing'
+    CACHES['landing'] = {
+        'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+        'LOCATION': config.get('web', 'landing_cache'),
+    }
+
+# Number of handle_webhook participants (handle_webhook_0 ..) events are
+# sharded over by repository. With 1 all events go to handle_webhook.
+HANDLER_SHARDS = 1
+if config.has_option('web', 'handler_shards'):
+    HANDLER_SHARDS = config.getint('web', 'handler_shards')
+
+# Pushes to a branch are held until no newer push arrived for
+# COALESCE_WINDOW seconds and only the latest one is handled (0 disables).
+# Pushes are held in process memory and only coalesced with pushes received
+# by the same process.
+COALESCE_WINDOW = 0
+if config.has_option('web', 'coalesce_window'):
+    COALESCE_WINDOW = config.getfloat('web', 'coalesce_window')
+
+# Forward request bodies to the participants without parsing them here
+RAW_INGEST = False
+if config.has_option('web', 'raw_ingest'):
+    RAW_INGEST = config.getboolean('web', 'raw_ingest')
+
+# Store payloads in the database and launch only a reference to them
+PAYLOAD_STORE = False
+if config.has_option('web', 'payload_store'):
+    PAYLOAD_STORE = config.getboolean('web', 'payload_store')
+
+# What to do with push events for repositories that have no WebHookMapping
+# and are not relayed: "create" launches them to create placeholder
+# mappings, "count" does the same but counts them in the stats and "drop"
+# doesn't launch them at all
+UNMAPPED_REPOS = "create"
+if config.has_option('web', 'unmapped_repos'):
+    UNMAPPED_REPOS = config.get('web', 'unmapped_repos')
+
+# Logging of the web app and the participants. Full payloads are only logged
+# at DEBUG level. With log_format = json every record is logged as a JSON
+# object on its own line.
+LOG_LEVEL = "INFO"
+if config.has_option('web', 'log_level'):
+    LOG_LEVEL = config.get('web', 'log_level').upper()
+LOG_FORMAT = "text"
+if config.has_option('web', 'log_format'):
+    LOG_FORMAT = config.get('web', 'log_format')
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'text': {
+            'format': '%(asctime)s %(levelname)s %(name)s: %(message)s',
+        },
+        'json': {
+            '()': 'webhook_launcher.app.log.JSONFormatter',
+        },
+    },
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+            'formatter': LOG_FORMAT,
+        },
+    },
+    'root': {
+        'handlers': ['console'],
+        'level': LOG_LEVEL,
+    },
+}
 
 # Credentials for accessing Bitbucket API with HTTP basic auth
 BB_API_USER = ''
@@ -104,6 +277,14 @@ if not DEVEL_MODE:
     BOSS_PASS = config.get('boss', 'amqp_pwd')
     BOSS_VHOST = config.get('boss', 'amqp_vhost')
 
+# Persistent AMQP connections used for launching BOSS processes
+BOSS_POOL_SIZE = 4
+if config.has_option('boss', 'launcher_pool_size'):
+    BOSS_POOL_SIZE = config.getint('boss', 'launcher_pool_size')
+BOSS_POOL_MAX_IDLE = 300
+if config.has_option('boss', 'launcher_max_idle'):
+    BOSS_POOL_MAX_IDLE = config.getint('boss', 'launcher_max_idle')
+
 db_engine = config.get('db', 'db_engine')
 db_name = config.get('db', 'db_name')
 db_user = config.get('db', 'db_user')
@@ -114,6 +295,11 @@ VCSCOMMIT_QUEUE = config.get('processes', 'vcscommit_queue')
 VCSCOMMIT_NOTIFY = config.get('processes', 'vcscommit_notify')
 VCSCOMMIT_BUILD = config.get('processes', 'vcscommit_build')
 
+# How often (in seconds) cached process definitions are checked for changes
+PDEF_CHECK_INTERVAL = 1.0
+if config.has_option('processes', 'check_interval'):
+    PDEF_CHECK_INTERVAL = config.getfloat('processes', 'check_interval')
+
 
 USE_LDAP = config.getboolean('ldap', 'use_ldap')
 USE_SEARCH = config.getboolean('ldap', 'use_search')
@@ -336,6 +522,7 @@ if USE_LDAP:
     logger = logging.getLogger('django_auth_ldap')
     logger.addHandler(logging.StreamHandler())
     logger.setLevel(logging.DEBUG)
+    logger.propagate = False
 
     AUTH_LDAP_SERVER_URI = LDAP_SERVER
     if not ldap_verify_cert: